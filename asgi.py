@@ -0,0 +1,211 @@
+# asgi.py
+"""
+ASGI entry point that streams LLM answers without holding a thread each.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000 --workers 4
+
+Views still run synchronously, on a bounded thread pool, exactly as under
+gunicorn. Streaming responses are then driven on the event loop: their
+Gemini chunks come from the SDK's asyncio client, so an open stream costs
+a coroutine instead of a worker, and one process can hold hundreds.
+Non-streaming responses and static files are sent as usual.
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_app import app
+from llm_client import LLMError
+from stream_guard import aclose_quietly, aiter_chunks
+
+ASGI_DISPATCH_THREADS = int(os.getenv('ASGI_DISPATCH_THREADS', '64'))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _dispatch_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=ASGI_DISPATCH_THREADS,
+                                           thread_name_prefix='asgi-dispatch')
+    return _pool
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope, flagged for asynchronous streams."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        # Tells llm_stream() to leave opening the Gemini stream to us.
+        'diagnoseme.async_streams': True,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').lower()
+        value = value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def dispatch(environ):
+    """Run the Flask view like Flask.wsgi_app; return (response, status, headers)."""
+    ctx = app.request_context(environ)
+    error = None
+    try:
+        try:
+            ctx.push()
+            response = app.full_dispatch_request()
+        except Exception as e:
+            error = e
+            response = app.handle_exception(e)
+        headers = response.get_wsgi_headers(environ)
+        return response, response.status_code, headers
+    finally:
+        if error is not None and app.should_ignore_error(error):
+            error = None
+        ctx.pop(error)
+
+
+def _start_message(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(key.lower().encode('latin-1'), value.encode('latin-1'))
+                    for key, value in headers.items()],
+    }
+
+
+async def _read_body(receive):
+    """The request body, or None if the client went away first."""
+    parts = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        parts.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(parts)
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        if (await receive())['type'] == 'http.disconnect':
+            return
+
+
+async def _send_chunks(send, chunks):
+    async for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if chunk:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+
+async def _stream(receive, send, chunks, path):
+    """Send `chunks` until they end or the client disconnects, then close them."""
+    sender = asyncio.ensure_future(_send_chunks(send, chunks))
+    watcher = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({sender, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if not sender.done():
+            # Cancelling unwinds the chunk pipeline, closing the Gemini stream.
+            logging.info("Client disconnected from %s mid-stream", path)
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+            return
+        if sender.exception() is not None:
+            logging.error("Streaming %s failed: %s", path, sender.exception())
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        watcher.cancel()
+        await aclose_quietly(chunks)
+
+
+async def _http(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    body = await _read_body(receive)
+    if body is None:
+        return
+    environ = build_environ(scope, body)
+    response, status, headers = await loop.run_in_executor(_dispatch_pool(), dispatch, environ)
+    try:
+        content = response.response
+        no_body = scope['method'] == 'HEAD' or status in (204, 304) \
+            or 100 <= status < 200
+        if hasattr(content, '__aiter__') and not no_body:
+            try:
+                # Open Gemini before committing to a 200, like the WSGI path.
+                await content.aopen()
+            except LLMError as e:
+                logging.error("LLM unavailable for %s: %s", scope['path'], e)
+                payload = json.dumps({"error": "llm_unavailable", "retryable": e.retryable})
+                await send(_start_message(503, {'Content-Type': 'application/json'}))
+                await send({'type': 'http.response.body', 'body': payload.encode('utf-8')})
+                return
+            await send(_start_message(status, headers))
+            await _stream(receive, send, content.__aiter__(), scope['path'])
+            return
+
+        await send(_start_message(status, headers))
+        if response.is_sequence or no_body:
+            data = b'' if no_body else b''.join(response.iter_encoded())
+            await send({'type': 'http.response.body', 'body': data})
+        else:
+            # Sync streamed bodies (e.g. files) are pulled on worker threads.
+            await _stream(receive, send, aiter_chunks(response.get_app_iter(environ)),
+                          scope['path'])
+    finally:
+        await loop.run_in_executor(_dispatch_pool(), response.close)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await _http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    elif scope['type'] == 'websocket':
+        # No websocket routes; refuse the handshake (HTTP 403) instead of erroring.
+        logging.debug("Rejecting websocket connection to %s", scope.get('path'))
+        await send({'type': 'websocket.close', 'code': 1000})
+    else:
+        logging.debug("Ignoring unsupported ASGI scope type %s", scope['type'])
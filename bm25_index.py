@@ -0,0 +1,248 @@
+# bm25_index.py
+"""
+On-disk BM25 index over the corpus/*_id2text.json texts, for CPU-only retrieval.
+
+Postings are stored term-major in CSR form as .npy files that are memory-
+mapped on load, so a query only touches the postings of its own terms:
+
+    indptr.npy   int64   postings of term t are [indptr[t], indptr[t + 1])
+    docs.npy     uint32  document numbers
+    tfs.npy      uint16  term frequencies
+    doc_len.npy  uint32  tokens per document
+    vocab.json   terms in term-id order
+    ids.txt      corpus ids in document-number order
+
+    python bm25_index.py build MedText
+    python bm25_index.py bench MedText --k 32 --compare MedCPT
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from corpus_store import CORPUS_DIR, iter_json_object, open_id2text
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the
+this to was were which with
+""".split())
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def document_text(value):
+    """Searchable text of an id2text value (plain text or a title/content dict)."""
+    if isinstance(value, dict):
+        return ' '.join(str(value.get(field, '')) for field in ('title', 'content'))
+    return str(value)
+
+
+def index_dir_for(corpus_name, corpus_dir=CORPUS_DIR):
+    return os.path.join(corpus_dir, f"{corpus_name}_bm25")
+
+
+def build_index(corpus_name, corpus_dir=CORPUS_DIR, out_dir=None):
+    """Tokenise every document of a corpus and write its BM25 index."""
+    out_dir = out_dir or index_dir_for(corpus_name, corpus_dir)
+    json_path = os.path.join(corpus_dir, f"{corpus_name}_id2text.json")
+    vocab = {}
+    doc_ids, term_ids, tfs = array('I'), array('I'), array('H')
+    doc_len = array('I')
+    ids = []
+
+    started = time.time()
+    with open(json_path, encoding='utf-8') as f:
+        for doc_number, (doc_id, value) in enumerate(iter_json_object(f)):
+            tokens = tokenize(document_text(value))
+            ids.append(str(doc_id))
+            doc_len.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(doc_number)
+                tfs.append(min(tf, 0xFFFF))
+            if doc_number and doc_number % 100000 == 0:
+                logging.info("Tokenised %d documents (%.0fs)", doc_number,
+                             time.time() - started)
+
+    # Group postings by term; a stable sort keeps documents ascending per term.
+    term_ids = np.frombuffer(term_ids, dtype=np.uint32)
+    order = np.argsort(term_ids, kind='stable')
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ids, minlength=len(vocab)), out=indptr[1:])
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, 'indptr.npy'), indptr)
+    np.save(os.path.join(out_dir, 'docs.npy'), np.frombuffer(doc_ids, dtype=np.uint32)[order])
+    np.save(os.path.join(out_dir, 'tfs.npy'), np.frombuffer(tfs, dtype=np.uint16)[order])
+    np.save(os.path.join(out_dir, 'doc_len.npy'), np.frombuffer(doc_len, dtype=np.uint32))
+    with open(os.path.join(out_dir, 'vocab.json'), 'w', encoding='utf-8') as f:
+        json.dump(sorted(vocab, key=vocab.get), f, ensure_ascii=False)
+    with open(os.path.join(out_dir, 'ids.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(ids))
+
+    logging.info("Indexed %s: %d documents, %d terms, %d postings in %.0fs",
+                 corpus_name, len(ids), len(vocab), len(order), time.time() - started)
+    return out_dir
+
+
+class BM25Index:
+    """Memory-mapped BM25 index; `search` returns the top-k (doc id, score) pairs."""
+
+    def __init__(self, index_dir, k1=BM25_K1, b=BM25_B):
+        def load(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode='r')
+
+        self.index_dir = index_dir
+        self.indptr = load('indptr.npy')
+        self.docs = load('docs.npy')
+        self.tfs = load('tfs.npy')
+        doc_len = np.asarray(load('doc_len.npy'), dtype=np.float32)
+        with open(os.path.join(index_dir, 'vocab.json'), encoding='utf-8') as f:
+            self.vocab = {term: i for i, term in enumerate(json.load(f))}
+        with open(os.path.join(index_dir, 'ids.txt'), encoding='utf-8') as f:
+            self.ids = f.read().split('\n')
+
+        self.num_docs = len(doc_len)
+        self.k1 = k1
+        # Per-document part of the BM25 denominator, computed once.
+        avg_len = float(doc_len.mean()) if self.num_docs else 0.0
+        self._norm = (k1 * (1 - b + b * doc_len / avg_len)).astype(np.float32) \
+            if avg_len else np.full(self.num_docs, k1, dtype=np.float32)
+
+    @classmethod
+    def for_corpus(cls, corpus_name, corpus_dir=CORPUS_DIR):
+        return cls(index_dir_for(corpus_name, corpus_dir))
+
+    def idf(self, term_id):
+        df = int(self.indptr[term_id + 1] - self.indptr[term_id])
+        return np.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=32):
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term, qtf in Counter(tokenize(query)).items():
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.docs[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            # Documents are unique within a term's postings, so plain
+            # fancy-index accumulation is safe here.
+            scores[docs] += qtf * self.idf(term_id) * tf * (self.k1 + 1) / (tf + self._norm[docs])
+
+        k = min(k, self.num_docs)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top if scores[i] > 0]
+
+
+class LocalBM25Retriever:
+    """
+    Drop-in for MedRAG's RetrievalSystem backed by BM25Index.
+
+    `retrieve` returns (snippets, scores) like RetrievalSystem.retrieve, with
+    snippets as dicts carrying id/title/content.
+    """
+
+    def __init__(self, corpus_name, corpus_dir=CORPUS_DIR):
+        self.corpus_name = corpus_name
+        self.index = BM25Index.for_corpus(corpus_name, corpus_dir)
+        self.id2text = open_id2text(corpus_name, corpus_dir)
+
+    def retrieve(self, question, k=32, rrf_k=100):
+        hits = self.index.search(question, k)
+        snippets = []
+        for doc_id, _ in hits:
+            value = self.id2text[doc_id]
+            snippet = dict(value) if isinstance(value, dict) else {'title': '', 'content': value}
+            snippet.setdefault('id', doc_id)
+            snippets.append(snippet)
+        return snippets, [score for _, score in hits]
+
+
+def reference_retriever(retriever_name, corpus_name):
+    """MedRAG's own RetrievalSystem, for benchmarking against; None if unavailable."""
+    src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MedRAG', 'src')
+    if src_dir not in sys.path:
+        sys.path.insert(0, src_dir)
+    try:
+        from utils import RetrievalSystem
+    except ImportError as e:
+        logging.warning("MedRAG retriever unavailable, benchmarking BM25 alone: %s", e)
+        return None
+    return RetrievalSystem(retriever_name, corpus_name)
+
+
+def benchmark(corpus_name, queries, k=32, compare=None):
+    """Latency of BM25 search and, with `compare`, its recall@k against that retriever."""
+    index = BM25Index.for_corpus(corpus_name)
+    reference = reference_retriever(compare, corpus_name) if compare else None
+
+    latencies, recalls = [], []
+    for query in queries:
+        started = time.perf_counter()
+        hits = index.search(query, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if reference is not None:
+            snippets, _ = reference.retrieve(query, k=k)
+            expected = {snippet['id'] for snippet in snippets}
+            if expected:
+                recalls.append(len(expected & {doc_id for doc_id, _ in hits}) / len(expected))
+
+    latencies.sort()
+    result = {
+        'queries': len(queries),
+        'k': k,
+        'p50_ms': round(latencies[len(latencies) // 2], 2),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+        'max_ms': round(latencies[-1], 2),
+    }
+    if recalls:
+        result[f'recall_at_{k}_vs_{compare}'] = round(sum(recalls) / len(recalls), 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or benchmark the local BM25 index.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Index corpus/<corpus>_id2text.json.")
+    build.add_argument('corpora', nargs='+')
+    bench = commands.add_parser('bench', help="Query latency and recall on DISEASES.")
+    bench.add_argument('corpus')
+    bench.add_argument('--k', type=int, default=32)
+    bench.add_argument('--compare', help="MedRAG retriever to measure recall against, e.g. MedCPT.")
+    search = commands.add_parser('search', help="Print the top-k hits for a query.")
+    search.add_argument('corpus')
+    search.add_argument('query')
+    search.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'build':
+        for corpus_name in args.corpora:
+            build_index(corpus_name)
+    elif args.command == 'bench':
+        from disease_selector import DISEASES
+        print(json.dumps(benchmark(args.corpus, DISEASES, args.k, args.compare), indent=2))
+    else:
+        for doc_id, score in BM25Index.for_corpus(args.corpus).search(args.query, args.k):
+            print(f"{score:8.3f}  {doc_id}")
+
+
+if __name__ == '__main__':
+    main()
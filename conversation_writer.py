@@ -0,0 +1,463 @@
+# conversation_writer.py
+"""
+Write-behind, append-only storage for /save_conversation snapshots.
+
+Clients send the whole transcript with every snapshot. Only the text added
+since the last write is stored, zlib-compressed:
+
+    CONVERSATIONS_TABLE (hash key: session_id)
+        player and game attributes as before, plus
+        conversation_format  'zlib-segments-v1'
+        conversation_length  characters in the transcript
+        conversation_sha256  digest of the full transcript
+        segments             number of segments written
+
+    CONVERSATION_SEGMENTS_TABLE (hash key: session_id, range key: seq)
+        offset  transcript position this segment's text starts at
+        data    zlib-compressed UTF-8 text (binary)
+
+A snapshot's segments and its conversation item are written in one
+transaction, conditional on the item still recording the length/digest the
+delta was computed against; another worker having written the session since
+makes the write re-read and retry.
+
+Replaying segments in seq order, each one truncating the transcript at its
+offset before appending, rebuilds the transcript. That includes the rare
+snapshot that doesn't extend the last one, which is written again from
+offset 0. Items from before this format keep a plain `conversation`
+string and are read as-is.
+
+    python conversation_writer.py show <session id>
+    python conversation_writer.py export conversations.jsonl
+"""
+import argparse
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+
+from botocore.exceptions import ClientError
+
+from lru import LRUCache
+
+CONVERSATIONS_TABLE = os.getenv('CONVERSATIONS_TABLE', 'diagnosemeconversations')
+CONVERSATION_SEGMENTS_TABLE = os.getenv('CONVERSATION_SEGMENTS_TABLE',
+                                        'diagnosemeconversationsegments')
+CONVERSATION_BACKEND = os.getenv('CONVERSATION_BACKEND', 'dynamodb')
+CONVERSATION_FLUSH_SECONDS = float(os.getenv('CONVERSATION_FLUSH_SECONDS', '5'))
+# Sessions waiting to be written; beyond this, snapshots are written inline.
+CONVERSATION_QUEUE_MAX = int(os.getenv('CONVERSATION_QUEUE_MAX', '5000'))
+# Sessions whose written length/digest this process remembers.
+CONVERSATION_STATE_CACHE_SIZE = int(os.getenv('CONVERSATION_STATE_CACHE_SIZE', '20000'))
+# Uncompressed characters per segment, well under the 400 KB item limit.
+SEGMENT_MAX_CHARS = int(os.getenv('CONVERSATION_SEGMENT_MAX_CHARS', '100000'))
+CONVERSATION_FORMAT = 'zlib-segments-v1'
+# Snapshots handed to ConversationLog.write_batch per call.
+BATCH_WRITE_MAX_ITEMS = 25
+# TransactWriteItems accepts at most 100 items: the conversation item and
+# up to 99 segments (~10 MB of text) per snapshot.
+TRANSACT_MAX_ITEMS = 100
+# Writes of one snapshot that lost the race to another worker before giving up.
+CONFLICT_ATTEMPTS = 4
+
+
+def transcript_digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def assemble_transcript(meta, segments):
+    """The transcript for a stored item and its segment items (any order)."""
+    if 'conversation' in meta:
+        return meta['conversation']['S']
+    count = int(meta.get('segments', {}).get('N', '0'))
+    text = ''
+    for segment in sorted(segments, key=lambda s: int(s['seq']['N'])):
+        # Segments past the count belong to a write that didn't complete.
+        if int(segment['seq']['N']) >= count:
+            break
+        offset = int(segment['offset']['N'])
+        text = text[:offset] + zlib.decompress(bytes(segment['data']['B'])).decode('utf-8')
+    return text
+
+
+class LocalConversationBackend:
+    """In-process stand-in for the conversations and segments tables."""
+
+    def __init__(self):
+        self.items = {}
+        self.segments = {}
+        self._lock = threading.Lock()
+
+    def put(self, segment_items, meta, expected_segments, expected_digest):
+        session_id = meta['session_id']['S']
+        with self._lock:
+            current = self.items.get(session_id)
+            stored = current.get('segments') if current else None
+            if expected_segments == 0:
+                if stored is not None and stored['N'] != '0':
+                    return False
+            elif (stored is None or int(stored['N']) != expected_segments
+                    or current['conversation_sha256']['S'] != expected_digest):
+                return False
+            for item in segment_items:
+                self.segments.setdefault(session_id, {})[int(item['seq']['N'])] = item
+            self.items[session_id] = meta
+            return True
+
+    def get_meta(self, session_id):
+        with self._lock:
+            return self.items.get(session_id)
+
+    def get_segments(self, session_id):
+        with self._lock:
+            return list(self.segments.get(session_id, {}).values())
+
+    def scan_meta(self):
+        with self._lock:
+            return list(self.items.values())
+
+
+class DynamoConversationBackend:
+    """Conversation items in CONVERSATIONS_TABLE, their segments in CONVERSATION_SEGMENTS_TABLE."""
+
+    def __init__(self, dynamodb, table_name=CONVERSATIONS_TABLE,
+                 segments_table_name=CONVERSATION_SEGMENTS_TABLE):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.segments_table_name = segments_table_name
+
+    def put(self, segment_items, meta, expected_segments, expected_digest):
+        # One transaction, so segments never land without the item counting them.
+        if expected_segments == 0:
+            condition = "attribute_not_exists(segments) OR segments = :segments"
+            values = {':segments': {'N': '0'}}
+        else:
+            condition = "segments = :segments AND conversation_sha256 = :digest"
+            values = {':segments': {'N': str(expected_segments)},
+                      ':digest': {'S': expected_digest}}
+        if len(segment_items) >= TRANSACT_MAX_ITEMS:
+            raise ValueError(f"{len(segment_items)} segments is too many for one write")
+        try:
+            self.dynamodb.transact_write_items(TransactItems=[
+                {'Put': {'TableName': self.segments_table_name, 'Item': item}}
+                for item in segment_items
+            ] + [{'Put': {
+                'TableName': self.table_name,
+                'Item': meta,
+                'ConditionExpression': condition,
+                'ExpressionAttributeValues': values,
+            }}])
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'TransactionCanceledException':
+                raise
+            reasons = {reason.get('Code') for reason in
+                       e.response.get('CancellationReasons', [])}
+            if reasons & {'ConditionalCheckFailed', 'TransactionConflict'}:
+                return False
+            raise
+
+    def get_meta(self, session_id):
+        response = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key={'session_id': {'S': session_id}},
+            ConsistentRead=True
+        )
+        return response.get('Item')
+
+    def get_segments(self, session_id):
+        segments = []
+        kwargs = {
+            'TableName': self.segments_table_name,
+            'KeyConditionExpression': 'session_id = :sid',
+            'ExpressionAttributeValues': {':sid': {'S': session_id}},
+            'ConsistentRead': True,
+        }
+        while True:
+            response = self.dynamodb.query(**kwargs)
+            segments.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return segments
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def scan_meta(self):
+        kwargs = {'TableName': self.table_name}
+        while True:
+            response = self.dynamodb.scan(**kwargs)
+            yield from response.get('Items', [])
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def make_conversation_backend(dynamodb=None, backend=CONVERSATION_BACKEND):
+    if backend == 'dynamodb':
+        return DynamoConversationBackend(dynamodb)
+    if backend != 'local':
+        logging.warning(
+            "Unknown CONVERSATION_BACKEND '%s'; using in-process storage", backend)
+    return LocalConversationBackend()
+
+
+class ConversationLog:
+    """
+    Turns full-transcript snapshots into compressed, append-only segments.
+
+    What each session has stored (length, digest, segment count) is kept in
+    an LRU. On a miss it is read back from the conversation item, so any
+    worker can append to a game another worker started. The cached state is
+    only a guess: each write is conditional on it, and one that finds the
+    item changed by another worker drops it and tries again.
+    """
+
+    def __init__(self, backend, state_cache_size=CONVERSATION_STATE_CACHE_SIZE):
+        self.backend = backend
+        self.state = LRUCache(state_cache_size)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _stored_state(self, session_id):
+        state = self.state.get(session_id)
+        if state is not None:
+            return state
+        meta = self.backend.get_meta(session_id)
+        self._count('state_reads')
+        if not meta or meta.get('conversation_format', {}).get('S') != CONVERSATION_FORMAT:
+            # New game, or a legacy whole-string item: start over at offset 0.
+            return (0, transcript_digest(''), 0)
+        return (int(meta['conversation_length']['N']), meta['conversation_sha256']['S'],
+                int(meta['segments']['N']))
+
+    def _segments(self, session_id, text, seq, offset, truncate=False):
+        items = []
+        # Cutting the transcript back to nothing still takes one (empty) segment.
+        for start in range(0, max(len(text), int(truncate)), SEGMENT_MAX_CHARS):
+            data = zlib.compress(text[start:start + SEGMENT_MAX_CHARS].encode('utf-8'))
+            items.append({
+                'session_id': {'S': session_id},
+                'seq': {'N': str(seq + len(items))},
+                'offset': {'N': str(offset + start)},
+                'data': {'B': data},
+            })
+            self._count('bytes_compressed', len(data))
+        return items
+
+    def write_batch(self, snapshots):
+        """Store snapshot items (with a `conversation` string) as segment deltas."""
+        for snapshot in snapshots:
+            self._write(snapshot)
+
+    def _write(self, snapshot):
+        session_id = snapshot['session_id']['S']
+        meta = dict(snapshot)
+        text = meta.pop('conversation', {}).get('S', '')
+        full_digest = transcript_digest(text)
+        for attempt in range(CONFLICT_ATTEMPTS):
+            length, digest, seq = self._stored_state(session_id)
+            if len(text) >= length and transcript_digest(text[:length]) == digest:
+                offset = length
+            else:
+                self._count('rewrites')
+                offset = 0
+            segments = self._segments(session_id, text[offset:], seq, offset,
+                                      truncate=offset < length)
+            self._count('bytes_raw', len(text[offset:].encode('utf-8')))
+            new_seq = seq + len(segments)
+            meta.update({
+                'conversation_format': {'S': CONVERSATION_FORMAT},
+                'conversation_length': {'N': str(len(text))},
+                'conversation_sha256': {'S': full_digest},
+                'segments': {'N': str(new_seq)},
+            })
+            try:
+                stored = self.backend.put(segments, meta, seq, digest)
+            except Exception:
+                # Re-read what actually got stored before the next attempt.
+                self.state.pop(session_id)
+                raise
+            if stored:
+                self.state.put(session_id, (len(text), full_digest, new_seq))
+                self._count('segments_written', len(segments))
+                return
+            # Another worker wrote this session since its state was read.
+            self.state.pop(session_id)
+            self._count('conflicts')
+        raise RuntimeError(f"Conversation {session_id} changed on every write attempt")
+
+    def read(self, session_id):
+        """The stored transcript for a session, or None."""
+        meta = self.backend.get_meta(session_id)
+        if meta is None:
+            return None
+        if 'conversation' in meta:
+            return meta['conversation']['S']
+        return assemble_transcript(meta, self.backend.get_segments(session_id))
+
+    def export(self):
+        """Yield every stored conversation as a plain dict, transcript reassembled."""
+        for meta in self.backend.scan_meta():
+            segments = [] if 'conversation' in meta else \
+                self.backend.get_segments(meta['session_id']['S'])
+            record = {key: next(iter(value.values())) for key, value in meta.items()
+                      if key not in ('conversation', 'conversation_sha256')}
+            record['conversation'] = assemble_transcript(meta, segments)
+            yield record
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        if stats.get('bytes_raw'):
+            stats['compression_ratio'] = round(
+                stats.get('bytes_compressed', 0) / stats['bytes_raw'], 3)
+        return stats
+
+
+class ConversationWriter:
+    """
+    Write-behind queue for conversation snapshots.
+
+    Only the latest snapshot per session is kept. Pending snapshots are
+    written every `flush_seconds` by a background thread (one per process)
+    through `log.write_batch`. A final snapshot wakes it at once, and
+    anything still pending is flushed at exit. At most `max_pending`
+    sessions wait; past that a snapshot is written inline instead of queued.
+    """
+
+    def __init__(self, log, flush_seconds=CONVERSATION_FLUSH_SECONDS,
+                 max_pending=CONVERSATION_QUEUE_MAX):
+        self.log = log
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.stats = Counter()
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+        self._last_flush_ms = None
+        self._max_flush_ms = 0.0
+        atexit.register(self.close)
+
+    def _ensure_thread(self):
+        # Threads don't survive fork; each worker starts its own flusher.
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='conversation-writer')
+            self._thread.start()
+
+    def submit(self, item, final=False):
+        """Queue `item` (a DynamoDB item keyed by session_id), replacing any pending one."""
+        session_id = item['session_id']['S']
+        with self._lock:
+            self._ensure_thread()
+            self.stats['submitted'] += 1
+            queued = session_id in self._pending or len(self._pending) < self.max_pending
+            if session_id in self._pending:
+                self.stats['coalesced'] += 1
+            if queued:
+                self._pending[session_id] = item
+            else:
+                self.stats['overflow_writes'] += 1
+        if not queued:
+            self._wake.set()
+            with self._flush_lock:
+                self.log.write_batch([item])
+        elif final:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error("Conversation flush failed: %s", e, exc_info=True)
+
+    def flush(self):
+        """Write every pending snapshot now; failed ones are re-queued unless superseded."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, OrderedDict()
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            items = list(batch.values())
+            written = 0
+            try:
+                for start in range(0, len(items), BATCH_WRITE_MAX_ITEMS):
+                    self.log.write_batch(items[start:start + BATCH_WRITE_MAX_ITEMS])
+                    written += len(items[start:start + BATCH_WRITE_MAX_ITEMS])
+            except Exception as e:
+                logging.error("Error writing conversation snapshots: %s", e)
+                with self._lock:
+                    self.stats['flush_errors'] += 1
+                    for item in items[written:]:
+                        self._pending.setdefault(item['session_id']['S'], item)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.stats['flushes'] += 1
+                self.stats['items_written'] += written
+                self._last_flush_ms = round(elapsed_ms, 2)
+                self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            return written
+
+    def close(self):
+        self._stopping = True
+        self._wake.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error("Final conversation flush failed: %s", e)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats,
+                         queue_depth=len(self._pending),
+                         last_flush_ms=self._last_flush_ms,
+                         max_flush_ms=round(self._max_flush_ms, 2))
+        stats['storage'] = self.log.snapshot()
+        return stats
+
+
+def main():
+    import boto3
+
+    parser = argparse.ArgumentParser(description="Read stored game conversations.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    show = commands.add_parser('show', help="Print one session's transcript.")
+    show.add_argument('session_id')
+    export = commands.add_parser('export', help="Write every conversation as JSON lines.")
+    export.add_argument('out')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    log = ConversationLog(DynamoConversationBackend(boto3.client('dynamodb')))
+    if args.command == 'show':
+        transcript = log.read(args.session_id)
+        if transcript is None:
+            raise SystemExit(f"No conversation stored for {args.session_id}")
+        print(transcript)
+    else:
+        count = 0
+        with open(args.out, 'w', encoding='utf-8') as f:
+            for record in log.export():
+                f.write(json.dumps(record) + '\n')
+                count += 1
+        logging.info("Exported %d conversations to %s", count, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+# corpus_store.py
+"""
+Memory-mapped id -> text store for the corpus/*_id2text.json files.
+
+The JSON files are single multi-hundred-MB dicts; json.load turns them into
+several GB of Python objects per worker. `build` converts one into a flat
+binary file (same name, .dmc extension) that `CorpusStore` maps read-only:
+opening is instant, lookups are one hash probe plus a slice of the mapping,
+and the pages live in the OS page cache shared by every process.
+
+    python corpus_store.py build corpus/MedText_id2text.json
+    python corpus_store.py get corpus/MedText_id2text.dmc <doc id>
+
+Layout (little endian):
+    header   MAGIC, version, flags, count, slots, index/table/data offsets
+    index    count x (id_offset u64, id_length u32, text_offset u64, text_length u32)
+    table    slots x u32 (record number + 1, 0 = empty), linear probing
+    data     utf-8 ids and texts, back to back
+"""
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from collections.abc import Mapping
+
+CORPUS_DIR = os.getenv('CORPUS_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'corpus'))
+STORE_EXTENSION = '.dmc'
+
+MAGIC = b'DMCORP\x00\x01'
+VERSION = 1
+# Values were not plain strings and are stored as JSON documents.
+FLAG_JSON_VALUES = 1
+
+HEADER = struct.Struct('<8sIIQQQQQ')
+RECORD = struct.Struct('<QIQI')
+SLOT = struct.Struct('<I')
+
+
+def _hash(key_bytes):
+    return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little')
+
+
+def _table_size(count):
+    slots = 1
+    while slots < count * 2:
+        slots <<= 1
+    return slots
+
+
+def iter_json_object(fp, chunk_size=1 << 20):
+    """
+    Yield (key, value) pairs of a top-level JSON object without loading it whole.
+
+    Only one value (plus a read chunk) is held in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def expect(chars):
+        nonlocal pos
+        skip_space()
+        if pos >= len(buf) or buf[pos] not in chars:
+            raise ValueError(f"Expected one of {chars!r} at offset {pos}")
+        pos += 1
+        return buf[pos - 1]
+
+    def decode():
+        nonlocal pos
+        while True:
+            skip_space()
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # A number or literal at the end of the buffer may be cut short.
+                if end < len(buf) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    fill()
+    expect('{')
+    skip_space()
+    if pos < len(buf) and buf[pos] == '}':
+        return
+    while True:
+        key = decode()
+        expect(':')
+        yield key, decode()
+        if expect(',}') == '}':
+            return
+
+
+def build_store(json_path, out_path=None, json_values=False):
+    """Convert an id2text JSON dict into a .dmc store; returns the output path."""
+    out_path = out_path or os.path.splitext(json_path)[0] + STORE_EXTENSION
+    id_offsets, id_lengths = array('Q'), array('I')
+    text_offsets, text_lengths = array('Q'), array('I')
+
+    # Stream ids and texts into a scratch file first; the index and table
+    # sizes are only known once the whole dict has been read.
+    with open(json_path, encoding='utf-8') as src, \
+            tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(out_path))) as data:
+        offset = 0
+        for doc_id, value in iter_json_object(src):
+            if not json_values and not isinstance(value, str):
+                # Every value has to be decoded the same way; start over
+                # storing them all as JSON documents.
+                logging.info("Non-string values in %s; storing values as JSON", json_path)
+                return build_store(json_path, out_path, json_values=True)
+            if json_values:
+                value = json.dumps(value, ensure_ascii=False)
+            for part, offsets, lengths in (
+                    (str(doc_id), id_offsets, id_lengths),
+                    (value, text_offsets, text_lengths)):
+                encoded = part.encode('utf-8')
+                data.write(encoded)
+                offsets.append(offset)
+                lengths.append(len(encoded))
+                offset += len(encoded)
+
+        count = len(id_offsets)
+        slots = _table_size(count)
+        index_offset = HEADER.size
+        table_offset = index_offset + count * RECORD.size
+        data_offset = table_offset + slots * SLOT.size
+        flags = FLAG_JSON_VALUES if json_values else 0
+
+        table = array('I', bytes(slots * SLOT.size))
+        mask = slots - 1
+        tmp_path = out_path + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, VERSION, flags, count, slots,
+                                  index_offset, table_offset, data_offset))
+            for i in range(count):
+                out.write(RECORD.pack(id_offsets[i], id_lengths[i],
+                                      text_offsets[i], text_lengths[i]))
+            # Read the ids back from the scratch file to fill the hash table.
+            for i in range(count):
+                data.seek(id_offsets[i])
+                slot = _hash(data.read(id_lengths[i])) & mask
+                while table[slot]:
+                    slot = (slot + 1) & mask
+                table[slot] = i + 1
+            if sys.byteorder != 'little':
+                table.byteswap()
+            out.write(table.tobytes())
+            data.seek(0)
+            shutil.copyfileobj(data, out, 1 << 20)
+        os.replace(tmp_path, out_path)
+
+    logging.info("Wrote %s: %d documents, %.1f MB", out_path, count,
+                 os.path.getsize(out_path) / 1e6)
+    return out_path
+
+
+class CorpusStore(Mapping):
+    """
+    Read-only dict-like view of a .dmc store.
+
+    Behaves like the dict json.load returned (`store[doc_id]`, `in`, `len`,
+    iteration in file order, `.get`, `.items()`), so it can be passed
+    wherever an id2text dict was used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.flags, self._count, self._slots, self._index_offset,
+         self._table_offset, self._data_offset) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a version {VERSION} corpus store")
+        self._view = memoryview(self._mm)
+        self._mask = self._slots - 1
+
+    def _record(self, i):
+        return RECORD.unpack_from(self._mm, self._index_offset + i * RECORD.size)
+
+    def _find(self, doc_id):
+        key = doc_id.encode('utf-8') if isinstance(doc_id, str) else bytes(doc_id)
+        slot = _hash(key) & self._mask
+        data = self._data_offset
+        while True:
+            entry = SLOT.unpack_from(self._mm, self._table_offset + slot * SLOT.size)[0]
+            if not entry:
+                return None
+            id_offset, id_length, text_offset, text_length = self._record(entry - 1)
+            if self._view[data + id_offset:data + id_offset + id_length] == key:
+                return data + text_offset, text_length
+            slot = (slot + 1) & self._mask
+
+    def get_bytes(self, doc_id):
+        """Zero-copy memoryview of the stored utf-8 value, or None."""
+        found = self._find(doc_id)
+        if found is None:
+            return None
+        start, length = found
+        return self._view[start:start + length]
+
+    def __getitem__(self, doc_id):
+        raw = self.get_bytes(doc_id)
+        if raw is None:
+            raise KeyError(doc_id)
+        text = str(raw, 'utf-8')
+        return json.loads(text) if self.flags & FLAG_JSON_VALUES else text
+
+    def __contains__(self, doc_id):
+        return self._find(doc_id) is not None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        data = self._data_offset
+        for i in range(self._count):
+            id_offset, id_length, _, _ = self._record(i)
+            yield str(self._view[data + id_offset:data + id_offset + id_length], 'utf-8')
+
+    def close(self):
+        self._view.release()
+        self._mm.close()
+
+
+_open_stores = {}
+
+
+def open_id2text(corpus_name, corpus_dir=CORPUS_DIR):
+    """
+    id2text mapping for a corpus, preferring the memory-mapped store.
+
+    Falls back to json.load of `<corpus_name>_id2text.json` when no .dmc
+    has been built. Stores are opened once per process.
+    """
+    base = os.path.join(corpus_dir, f"{corpus_name}_id2text")
+    store_path = base + STORE_EXTENSION
+    if os.path.exists(store_path):
+        store = _open_stores.get(store_path)
+        if store is None:
+            store = _open_stores[store_path] = CorpusStore(store_path)
+        return store
+    logging.warning("No %s; loading %s.json into memory (run `python corpus_store.py "
+                    "build %s.json`)", store_path, base, base)
+    with open(base + '.json', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query .dmc corpus stores.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Convert *_id2text.json files.")
+    build.add_argument('json_paths', nargs='+')
+    get = commands.add_parser('get', help="Print one document by id.")
+    get.add_argument('store_path')
+    get.add_argument('doc_id')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'build':
+        for json_path in args.json_paths:
+            build_store(json_path)
+    else:
+        store = CorpusStore(args.store_path)
+        if args.doc_id not in store:
+            sys.exit(f"{args.doc_id} not found")
+        value = store[args.doc_id]
+        print(value if isinstance(value, str) else json.dumps(value, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+# diagnosis_matcher.py
+import logging
+import re
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+
+from disease_selector import DISEASES
+
+# Abbreviations and eponyms players commonly type, keyed by DISEASES entry.
+EXTRA_ALIASES = {
+    "Emphysema/COPD": ["chronic obstructive pulmonary disease"],
+    "Tuberculosis": ["tb", "pulmonary tuberculosis"],
+    "Pulmonary embolism": ["pe", "pulmonary embolus", "pulmonary thromboembolism"],
+    "Pulmonary embolism (no concurrent DVT)": ["pe", "pulmonary embolus"],
+    "Poststreptococcal glomerulonephritis/PSGN": ["post strep gn", "post streptococcal gn",
+                                                  "post infectious glomerulonephritis"],
+    "Goodpasture syndrome": ["anti gbm disease", "anti glomerular basement membrane disease"],
+    "Minimal change disease": ["mcd"],
+    "Acute interstitial nephritis": ["ain", "interstitial nephritis"],
+    "Vitamin B12 deficiency": ["b12 deficiency", "cobalamin deficiency", "pernicious anemia"],
+    "Sickle cell anemia (dactylitis)": ["sickle cell", "sickle cell disease", "scd", "hbss",
+                                        "sickle cell dactylitis"],
+    "Acute myeloid leukemia": ["aml", "acute myelogenous leukemia"],
+    "Chronic lymphocytic leukemia": ["cll"],
+    "Hodgkin's lymphoma": ["hodgkin lymphoma", "hodgkins disease", "hl"],
+    "Non-Hodgkin's lymphoma": ["non hodgkin lymphoma", "nhl"],
+    "Idiopathic thrombocytopenic purpura/ITP": ["immune thrombocytopenic purpura",
+                                                "immune thrombocytopenia"],
+    "Kawasaki disease": ["kawasaki", "mucocutaneous lymph node syndrome"],
+    "MEN 1": ["men1", "men type 1", "multiple endocrine neoplasia type 1", "wermer syndrome"],
+    "MEN 2A": ["men2a", "men type 2a", "multiple endocrine neoplasia type 2a", "sipple syndrome"],
+    "Von Willebrand disease": ["vwd", "von willebrands"],
+    "Multiple myeloma": ["mm", "myeloma", "plasma cell myeloma"],
+    "Graves disease": ["graves", "graves hyperthyroidism"],
+    "Hashimotos thyroiditis": ["hashimoto", "hashimoto thyroiditis",
+                               "chronic lymphocytic thyroiditis"],
+    "Polycystic ovary syndrome": ["pcos", "polycystic ovarian syndrome"],
+    "21-hydroxylase deficiency (congenital adrenal hyperplasia)": ["cah", "21 oh deficiency"],
+    "Hypercalcemia (of malignancy)": ["hypercalcemia of malignancy",
+                                      "malignancy associated hypercalcemia",
+                                      "humoral hypercalcemia of malignancy"],
+    "DiGeorge syndrome": ["22q11 deletion syndrome", "22q11 2 deletion syndrome",
+                          "velocardiofacial syndrome"],
+    "Crohn’s disease": ["crohn disease", "crohns"],
+    "Ulcerative colitis": ["uc"],
+    "Acute pancreatitis (gallstone)": ["gallstone pancreatitis", "biliary pancreatitis"],
+    "Ectopic pregnancy (ruptured, RLQ)": ["ruptured ectopic", "ruptured ectopic pregnancy"],
+    "HELLP syndrome": ["hellp"],
+    "Ankylosing spondylitis": ["as"],
+    "Guillain-Barré syndrome": ["gbs", "guillain barre", "aidp",
+                                "acute inflammatory demyelinating polyneuropathy"],
+    "Reactive arthritis": ["reiter syndrome", "reiters syndrome"],
+    "Systemic lupus erythematosus": ["sle", "lupus"],
+    "Multiple sclerosis": ["ms"],
+    "Parkinson’s disease": ["parkinson disease", "parkinsons", "pd"],
+    "Myasthenia gravis": ["mg"],
+    "Amyotrophic lateral sclerosis": ["als", "lou gehrig disease", "lou gehrigs disease"],
+    "CREST syndrome/limited scleroderma": ["limited cutaneous systemic sclerosis"],
+    "Cystic fibrosis": ["cf"],
+    "Huntington’s disease": ["huntington disease", "huntingtons", "huntington chorea"],
+    "Wilson's disease": ["wilson disease", "hepatolenticular degeneration"],
+    "Lithium toxicity": ["lithium overdose", "lithium poisoning"],
+    "Acetaminophen toxicity": ["acetaminophen overdose", "tylenol overdose",
+                               "acetaminophen poisoning", "paracetamol overdose"],
+    "Salicylate toxicity": ["aspirin overdose", "aspirin toxicity", "salicylate poisoning"],
+    "Lead poisoning": ["lead toxicity", "plumbism"],
+    "Carbon monoxide poisoning": ["co poisoning", "carbon monoxide toxicity"],
+    "Meningitis (bacterial/Neisseria meningitidis)": ["bacterial meningitis",
+                                                      "meningococcal meningitis"],
+    "Meningitis (fungal/Cryptococcus)": ["fungal meningitis", "cryptococcal meningitis"],
+    "Encephalitis (viral/HSV-1)": ["hsv encephalitis", "herpes encephalitis",
+                                   "herpes simplex encephalitis", "viral encephalitis"],
+    "Syphilis (secondary)": ["secondary syphilis"],
+    "Tetralogy of Fallot": ["tof", "tet"],
+    "Eisenmenger syndrome": ["eisenmenger"],
+    "Hemochromatosis": ["hereditary hemochromatosis", "iron overload"],
+    "Sarcoidosis": ["sarcoid"],
+    "Diabetic ketoacidosis": ["dka"],
+    "Hyperosmolar hyperglycemic state": ["hhs", "hhns", "hyperosmolar nonketotic state"],
+    "(Chronic) subdural hematoma": ["sdh", "subdural", "chronic subdural"],
+    "Measles": ["rubeola"],
+    "Cauda equina syndrome (acute)": ["cauda equina"],
+    "Cervical myelopathy": ["cervical spondylotic myelopathy"],
+    "Temporal arteritis/giant cell arteritis": ["gca"],
+    "Polyarteritis nodosa": ["pan"],
+    "IgA vasculitis/Henoch-Schönlein purpura (Berger's disease)": ["hsp", "henoch schonlein purpura"],
+    "Granulomatosis with polyangiitis (Wegener’s)": ["gpa", "wegeners", "wegener granulomatosis",
+                                                     "wegeners granulomatosis"],
+    "Eosinophilic granulomatosis with polyangiitis (Churg-Strauss)": ["egpa", "churg strauss",
+                                                                      "churg strauss syndrome"],
+    "Mycoplasma pneumonia (walking pneumonia/pneumonia)": ["mycoplasma", "walking pneumonia",
+                                                           "mycoplasma pneumoniae"],
+    "Legionella (Legionnaires’ disease)": ["legionella pneumonia", "legionellosis",
+                                           "legionnaires", "legionnaire disease"],
+    "Paget disease": ["pagets disease", "paget disease of bone", "osteitis deformans"],
+    "DRESS syndrome": ["dress", "drug reaction with eosinophilia and systemic symptoms"],
+    "C6 radiculopathy": ["c6 nerve root compression"],
+    "L5 radiculopathy": ["l5 nerve root compression"],
+    "Ulnar neuropathy": ["cubital tunnel syndrome", "ulnar nerve entrapment"],
+    "Aortic dissection": ["dissection", "dissecting aortic aneurysm"],
+    "Spinal epidural abscess": ["epidural abscess"],
+    "Tardive dyskinesia": ["td"],
+    "Toxic megacolon": ["megacolon"],
+    "Acute respiratory distress syndrome/ARDS": ["acute lung injury"],
+    "Neonatal respiratory distress syndrome/NRDS": ["rds", "respiratory distress syndrome of the newborn",
+                                                    "hyaline membrane disease",
+                                                    "infant respiratory distress syndrome"],
+}
+
+# Names left after stripping a qualifier that are broader than the answer
+# (e.g. "meningitis" for bacterial meningitis). Matching only these is
+# left to the LLM grader.
+GENERIC_NAMES = {
+    'meningitis', 'encephalitis', 'syphilis', 'hypercalcemia', 'pneumonia',
+}
+
+DIAGNOSIS_PREFIX_RE = re.compile(
+    r"^(?:(?:ok|okay|so|well|hmm|um)\s+)?"
+    r"(?:i (?:think|believe|suspect|bet|guess)(?: that)?\s+)?"
+    r"(?:(?:you|the patient|patient|pt|she|he|they|this|it)\s+"
+    r"(?:(?:might|may|probably|likely|must|definitely|could)\s+)?"
+    r"(?:have|has|got|is|be|s)\s+)?"
+    r"(?:(?:my|the|final)\s+)?(?:(?:diagnosis|dx|answer|guess)\s+(?:is\s+)?)?"
+    r"(?:(?:probably|likely|definitely)\s+)?(?:(?:a|an|the)\s+)?")
+NEGATION_RE = re.compile(r"\b(?:not|no|isnt|rule out|ruled out|vs|versus|or)\b")
+
+# SequenceMatcher ratios for typo-tolerant matching.
+FUZZY_MATCH_RATIO = 0.9
+UNRELATED_RATIO = 0.6
+
+# Parts of a name a typo can't be allowed to change: numbers and spinal
+# levels ("C6" vs "C7"), laterality and hyper-/hypo- prefixes.
+NUMBERED_TERM_RE = re.compile(r"\b[a-z]*\d+[a-z]*\b")
+LATERALITY_TERMS = frozenset(('left', 'right', 'bilateral', 'unilateral'))
+
+
+def normalize_diagnosis(text):
+    """Lower-case, strip accents, possessives and punctuation."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    text = re.sub(r"[’'`]s\b", '', text)
+    text = re.sub(r"[’'`]", '', text)
+    text = re.sub(r"[^a-z0-9]+", ' ', text)
+    return re.sub(r"\s+", ' ', text).strip()
+
+
+def exact_terms(text):
+    """The terms of a normalised name that must match exactly, not fuzzily."""
+    terms = set(NUMBERED_TERM_RE.findall(text))
+    for word in text.split():
+        if word in LATERALITY_TERMS:
+            terms.add(word)
+        elif word.startswith(('hyper', 'hypo')):
+            terms.add(word[:5] if word.startswith('hyper') else word[:4])
+    return terms
+
+
+def entry_aliases(entry):
+    """Split a DISEASES entry such as "Name/ABBR (qualifier)" into aliases."""
+    aliases = set()
+    qualifiers = re.findall(r"\(([^)]*)\)", entry)
+    base = re.sub(r"\([^)]*\)", ' ', entry)
+    for name in base.split('/'):
+        name = normalize_diagnosis(name)
+        if name:
+            aliases.add(name)
+    for qualifier in qualifiers:
+        # "(Chronic) subdural hematoma" -> "chronic subdural hematoma"
+        merged = normalize_diagnosis(entry.replace('(', '').replace(')', ''))
+        if entry.startswith('(') and merged:
+            aliases.add(merged)
+        for part in qualifier.split('/'):
+            part = normalize_diagnosis(part)
+            # Parenthesised eponyms/synonyms are aliases in their own right.
+            if part.endswith(('disease', 'syndrome')) or part in ('wegener', 'churg strauss',
+                                                                  'congenital adrenal hyperplasia'):
+                aliases.add(part)
+    for alias in EXTRA_ALIASES.get(entry, []):
+        aliases.add(normalize_diagnosis(alias))
+    return aliases
+
+
+class DiagnosisMatcher:
+    """
+    Alias index over DISEASES for resolving diagnosis attempts in-process.
+
+    `match` returns True (confident match), False (confidently a different
+    catalogued disease) or None when the answer is ambiguous and should be
+    graded by the LLM.
+    """
+
+    def __init__(self, diseases=DISEASES):
+        self.entry_aliases = {}
+        self.alias_entries = {}
+        for entry in diseases:
+            self.add_entry(entry)
+
+    def add_entry(self, entry, extra_aliases=()):
+        aliases = entry_aliases(entry) | {
+            normalize_diagnosis(a) for a in extra_aliases}
+        aliases.discard('')
+        self.entry_aliases[entry] = self.entry_aliases.get(
+            entry, set()) | aliases
+        for alias in aliases:
+            self.alias_entries.setdefault(alias, set()).add(entry)
+        return self.entry_aliases[entry]
+
+    def aliases_for(self, disease, extra_aliases=()):
+        """Aliases of a case's disease; uncatalogued (custom) diseases are parsed on the fly."""
+        aliases = self.entry_aliases.get(disease)
+        if aliases is None:
+            aliases = entry_aliases(disease)
+        return aliases | {normalize_diagnosis(a) for a in extra_aliases}
+
+    def _best_ratio(self, text, aliases):
+        best = 0.0
+        terms = exact_terms(text)
+        for alias in aliases:
+            if abs(len(alias) - len(text)) > max(len(alias), len(text)) * 0.5:
+                continue
+            if exact_terms(alias) != terms:
+                continue
+            best = max(best, SequenceMatcher(None, text, alias).ratio())
+        return best
+
+    def match(self, guess, disease, extra_aliases=()):
+        # Only the first sentence names the diagnosis ("You have X. Let's start...").
+        first_sentence = next(
+            (s for s in re.split(r"[.!?;\n]", guess or '') if s.strip()), '')
+        normalized = normalize_diagnosis(first_sentence)
+        core = DIAGNOSIS_PREFIX_RE.sub('', normalized).strip()
+        if not core or NEGATION_RE.search(core):
+            return None
+
+        true_aliases = self.aliases_for(disease, extra_aliases)
+        specific = true_aliases - GENERIC_NAMES
+
+        if core in specific:
+            return True
+        if core in true_aliases:
+            # A broader name than the answer ("meningitis"); let the LLM judge.
+            return None
+
+        other_entries = {e for e in self.alias_entries.get(core, ())
+                         if not self.entry_aliases[e] & specific}
+        if other_entries and core not in GENERIC_NAMES:
+            return False
+
+        if len(core) < 5:
+            # Too short for typo matching to mean anything (e.g. "ms" vs "mg").
+            return None
+
+        true_ratio = self._best_ratio(core, specific)
+        if true_ratio >= FUZZY_MATCH_RATIO:
+            return True
+        if true_ratio < UNRELATED_RATIO:
+            other_aliases = [alias for alias, entries in self.alias_entries.items()
+                             if alias not in GENERIC_NAMES and len(alias) >= 5
+                             and not any(self.entry_aliases[e] & specific for e in entries)]
+            if self._best_ratio(core, other_aliases) >= FUZZY_MATCH_RATIO:
+                return False
+        return None
+
+
+diagnosis_matcher = DiagnosisMatcher()
+match_stats = Counter()
+
+
+def match_diagnosis(guess, disease, extra_aliases=()):
+    """Resolve a diagnosis attempt locally: True, False, or None if ambiguous."""
+    try:
+        result = diagnosis_matcher.match(guess, disease, extra_aliases)
+    except Exception as e:
+        logging.error("Local diagnosis matching failed: %s", e, exc_info=True)
+        result = None
+    match_stats[{True: 'match', False: 'no_match', None: 'ambiguous'}[result]] += 1
+    return result
@@ -0,0 +1,650 @@
+# disease_catalog.py
+"""
+Structured metadata for DISEASES and an index for criteria-based cases.
+
+Each entry is tagged with the specialties that manage it, the chief
+complaints it presents with and the organ systems it involves. Complaint,
+system and specialty phrases (with their common synonyms) are indexed to
+bitsets over DISEASES, using the same bit layout as played_tracker, so
+"chest pain" + "cardiology" is a dictionary lookup and an AND.
+
+`DiseaseCatalog.candidates` returns None when the criteria contain words
+the index doesn't know, so callers can fall back to the LLM for anything
+it can't cover.
+"""
+import logging
+import os
+import threading
+from collections import Counter, namedtuple
+
+from diagnosis_matcher import entry_aliases, normalize_diagnosis
+from disease_selector import DISEASES, thread_random
+from played_tracker import DISEASE_BITS
+
+# Fewer local candidates than this and the LLM is asked instead, for variety.
+CATALOG_MIN_CANDIDATES = int(os.getenv('CATALOG_MIN_CANDIDATES', '3'))
+# Random candidates tried before settling for one whose case isn't stored yet.
+CATALOG_WARM_TRIES = int(os.getenv('CATALOG_WARM_TRIES', '3'))
+
+CatalogEntry = namedtuple('CatalogEntry', 'specialties complaints systems')
+
+# Canonical chief complaints and the phrases players type for them.
+COMPLAINTS = {
+    "chest pain": ["chest tightness", "chest pressure", "chest discomfort"],
+    "dyspnea": ["shortness of breath", "sob", "difficulty breathing", "trouble breathing",
+                "breathlessness", "respiratory distress", "tachypnea"],
+    "cough": ["coughing", "productive cough", "dry cough"],
+    "hemoptysis": ["coughing blood", "coughing up blood", "bloody sputum"],
+    "wheezing": ["wheeze"],
+    "fever": ["fevers", "febrile", "chills", "high temperature"],
+    "night sweats": [],
+    "fatigue": ["tiredness", "tired", "lethargy", "malaise"],
+    "weight loss": ["losing weight"],
+    "weight gain": [],
+    "abdominal pain": ["stomach pain", "belly pain", "stomach ache", "epigastric pain",
+                       "abdominal cramps", "flank pain"],
+    "bloating": ["abdominal distension", "distended abdomen"],
+    "diarrhea": ["loose stools", "greasy stools"],
+    "bloody stool": ["bloody diarrhea", "hematochezia", "rectal bleeding", "blood in stool"],
+    "vomiting": ["nausea", "nausea and vomiting", "emesis"],
+    "constipation": [],
+    "dysphagia": ["difficulty swallowing", "trouble swallowing"],
+    "jaundice": ["yellow skin", "yellow eyes", "icterus"],
+    "headache": ["headaches", "migraine"],
+    "confusion": ["altered mental status", "ams", "delirium", "disorientation"],
+    "memory loss": ["forgetfulness", "cognitive decline", "dementia"],
+    "seizure": ["seizures", "convulsions"],
+    "weakness": ["muscle weakness", "paralysis", "foot drop"],
+    "numbness": ["tingling", "paresthesia", "paresthesias", "sensory loss"],
+    "gait problems": ["difficulty walking", "unsteady gait", "falls", "ataxia"],
+    "slurred speech": ["dysarthria", "speech problems"],
+    "abnormal movements": ["tremor", "tremors", "involuntary movements", "chorea", "tics",
+                           "rigidity"],
+    "back pain": ["low back pain", "lower back pain"],
+    "neck pain": ["neck stiffness", "stiff neck"],
+    "jaw pain": ["jaw claudication"],
+    "joint pain": ["arthralgia", "arthritis", "joint swelling"],
+    "muscle pain": ["myalgia", "myalgias"],
+    "bone pain": ["fractures"],
+    "limb pain": ["leg pain", "arm pain", "hand pain", "foot pain", "sciatica"],
+    "rash": ["skin rash", "skin lesions", "hives"],
+    "skin changes": ["skin darkening", "bronze skin", "skin thickening", "tight skin"],
+    "raynaud": ["raynauds", "cold fingers", "fingers turning white"],
+    "bruising": ["easy bruising", "bleeding", "petechiae", "purpura", "nosebleeds",
+                 "epistaxis", "bleeding gums"],
+    "pallor": ["pale", "anemia"],
+    "edema": ["swelling", "leg swelling", "puffiness", "facial swelling"],
+    "hematuria": ["blood in urine", "dark urine", "cola colored urine"],
+    "decreased urine": ["decreased urine output", "oliguria"],
+    "painful urination": ["dysuria"],
+    "incontinence": ["urinary retention", "urinary incontinence", "bowel incontinence"],
+    "polyuria": ["frequent urination", "excessive thirst", "polydipsia", "thirst"],
+    "palpitations": ["racing heart", "tachycardia"],
+    "syncope": ["fainting", "passing out"],
+    "high blood pressure": ["hypertension"],
+    "cyanosis": ["blue lips", "turning blue"],
+    "psychosis": ["hallucinations", "delusions", "paranoia", "hearing voices"],
+    "mood changes": ["depression", "mania", "irritability", "behavior changes", "anxiety"],
+    "vision changes": ["vision loss", "blurry vision", "blurred vision", "double vision",
+                       "diplopia", "eye pain", "red eye", "conjunctivitis"],
+    "ptosis": ["droopy eyelids", "drooping eyelids"],
+    "sore throat": ["pharyngitis", "strep throat"],
+    "runny nose": ["nasal congestion", "congestion", "sinusitis", "coryza"],
+    "tinnitus": ["ringing in ears", "hearing loss"],
+    "neck mass": ["goiter", "neck swelling", "thyroid nodule"],
+    "lymphadenopathy": ["swollen lymph nodes", "swollen glands"],
+    "recurrent infections": ["frequent infections"],
+    "failure to thrive": ["poor growth", "poor weight gain"],
+    "heat intolerance": [],
+    "cold intolerance": [],
+    "menstrual changes": ["amenorrhea", "irregular periods", "missed period",
+                          "irregular menses", "oligomenorrhea"],
+    "vaginal bleeding": ["heavy periods", "menorrhagia"],
+    "infertility": [],
+    "hirsutism": ["excess hair growth", "virilization", "ambiguous genitalia"],
+    "sexual dysfunction": ["decreased libido", "erectile dysfunction"],
+    "poisoning": ["overdose", "ingestion", "toxic ingestion"],
+}
+
+# Organ systems; these may also be typed as the chief complaint.
+SYSTEMS = {
+    "cardiovascular": ["cardiac", "heart", "vascular"],
+    "respiratory": ["pulmonary", "lung", "lungs", "breathing"],
+    "renal": ["kidney", "kidneys"],
+    "hematologic": ["blood"],
+    "endocrine": ["hormonal", "thyroid"],
+    "gastrointestinal": ["gi", "gut", "bowel", "liver", "digestive"],
+    "reproductive": ["pregnancy", "gynecologic"],
+    "musculoskeletal": ["bone", "bones", "joint", "muscle"],
+    "nervous": ["neurologic", "neurological", "brain", "spine", "nerve"],
+    "psychiatric": ["psych", "mental health", "behavioral"],
+    "immune": ["autoimmune", "immunodeficiency"],
+    "infectious": ["infection"],
+    "toxicologic": ["toxic", "toxin"],
+    "skin": ["dermatologic"],
+}
+
+# The /generate_case_by_criteria dropdown values, and other ways to say them.
+SPECIALTIES = {
+    "cardiology": ["cardio", "cardiac"],
+    "pulmonology": ["pulm", "pulmonary", "pulmonology critical care"],
+    "gastroenterology": ["gi", "hepatology"],
+    "neurology": ["neuro"],
+    "endocrinology": ["endo"],
+    "hematology": ["heme"],
+    "oncology": ["onc"],
+    "rheumatology": ["rheum"],
+    "nephrology": ["renal"],
+    "infectious-disease": ["id", "infectious diseases"],
+    "psychiatry": ["psych"],
+    "pediatrics": ["peds", "pediatric"],
+    "emergency-medicine": ["em", "emergency", "er"],
+    "internal-medicine": ["im", "medicine"],
+    "surgery": ["general surgery"],
+    "orthopedics": ["ortho", "orthopedic surgery"],
+    "dermatology": ["derm"],
+    "ophthalmology": ["ophtho"],
+    "otolaryngology": ["ent"],
+    "obstetrics-gynecology": ["obgyn", "ob gyn", "obstetrics", "gynecology"],
+}
+
+# Internal medicine covers every disease its subspecialties manage.
+DERIVED_SPECIALTIES = {
+    "internal-medicine": ("cardiology", "pulmonology", "gastroenterology", "endocrinology",
+                          "hematology", "oncology", "rheumatology", "nephrology",
+                          "infectious-disease"),
+}
+
+# Words that add nothing to a chief complaint; anything else unindexed
+# means the criteria can't be served locally.
+FILLER_WORDS = frozenset(
+    "a an and or with w of in on the to at from for plus acute chronic sudden new onset "
+    "severe mild recurrent worsening progressive pain".split())
+
+
+def _entry(specialties, complaints, systems):
+    def split(text):
+        return tuple(part.strip() for part in text.split(',') if part.strip())
+    return CatalogEntry(split(specialties), split(complaints), split(systems))
+
+
+CATALOG = {
+    "Rheumatic fever": _entry(
+        "cardiology, rheumatology, pediatrics, infectious-disease",
+        "fever, joint pain, abnormal movements, rash, sore throat, chest pain, dyspnea",
+        "cardiovascular, musculoskeletal, infectious"),
+    "Emphysema/COPD": _entry(
+        "pulmonology", "dyspnea, cough, wheezing", "respiratory"),
+    "Asthma": _entry(
+        "pulmonology, pediatrics, emergency-medicine",
+        "dyspnea, wheezing, cough, chest pain", "respiratory, immune"),
+    "Tuberculosis": _entry(
+        "pulmonology, infectious-disease",
+        "cough, hemoptysis, fever, night sweats, weight loss, fatigue",
+        "respiratory, infectious"),
+    "Pulmonary embolism": _entry(
+        "pulmonology, cardiology, emergency-medicine",
+        "dyspnea, chest pain, hemoptysis, palpitations, syncope",
+        "respiratory, cardiovascular, hematologic"),
+    "Poststreptococcal glomerulonephritis/PSGN": _entry(
+        "nephrology, pediatrics",
+        "hematuria, edema, high blood pressure, decreased urine", "renal, immune"),
+    "Goodpasture syndrome": _entry(
+        "nephrology, pulmonology", "hemoptysis, hematuria, dyspnea, cough",
+        "renal, respiratory, immune"),
+    "Minimal change disease": _entry(
+        "nephrology, pediatrics", "edema, weight gain", "renal"),
+    "Acute interstitial nephritis": _entry(
+        "nephrology", "rash, fever, decreased urine, joint pain", "renal, immune"),
+    "Vitamin B12 deficiency": _entry(
+        "hematology, neurology",
+        "fatigue, numbness, pallor, gait problems, memory loss, confusion",
+        "hematologic, nervous"),
+    "Sickle cell anemia (dactylitis)": _entry(
+        "hematology, pediatrics, emergency-medicine",
+        "limb pain, edema, fever, pallor", "hematologic"),
+    "Acute myeloid leukemia": _entry(
+        "hematology, oncology",
+        "fatigue, bruising, fever, pallor, recurrent infections, bone pain", "hematologic"),
+    "Chronic lymphocytic leukemia": _entry(
+        "hematology, oncology",
+        "lymphadenopathy, fatigue, recurrent infections, weight loss", "hematologic"),
+    "Hodgkin's lymphoma": _entry(
+        "hematology, oncology",
+        "lymphadenopathy, fever, night sweats, weight loss", "hematologic, immune"),
+    "Non-Hodgkin's lymphoma": _entry(
+        "hematology, oncology",
+        "lymphadenopathy, fever, night sweats, weight loss, abdominal pain",
+        "hematologic, immune"),
+    "Disseminated intravascular coagulation/DIC": _entry(
+        "hematology, emergency-medicine", "bruising, confusion", "hematologic"),
+    "Hemolytic uremic syndrome/HUS": _entry(
+        "nephrology, hematology, pediatrics",
+        "bloody stool, diarrhea, decreased urine, pallor, bruising, abdominal pain",
+        "renal, hematologic, gastrointestinal"),
+    "Idiopathic thrombocytopenic purpura/ITP": _entry(
+        "hematology, pediatrics", "bruising", "hematologic, immune"),
+    "Thrombotic thrombocytopenic purpura/TTP": _entry(
+        "hematology", "bruising, confusion, fever, headache, decreased urine",
+        "hematologic, nervous, renal"),
+    "Kawasaki disease": _entry(
+        "pediatrics, cardiology, rheumatology",
+        "fever, rash, vision changes, lymphadenopathy, edema",
+        "cardiovascular, immune, skin"),
+    "MEN 1": _entry(
+        "endocrinology, oncology", "abdominal pain, headache, diarrhea, bone pain",
+        "endocrine"),
+    "MEN 2A": _entry(
+        "endocrinology, oncology, surgery",
+        "high blood pressure, headache, palpitations, neck mass", "endocrine"),
+    "Von Willebrand disease": _entry(
+        "hematology", "bruising, vaginal bleeding", "hematologic"),
+    "Multiple myeloma": _entry(
+        "hematology, oncology",
+        "bone pain, back pain, fatigue, recurrent infections, confusion, constipation",
+        "hematologic, musculoskeletal, renal"),
+    "Graves disease": _entry(
+        "endocrinology, ophthalmology",
+        "palpitations, weight loss, neck mass, vision changes, abnormal movements, "
+        "heat intolerance, mood changes",
+        "endocrine, immune"),
+    "Hashimotos thyroiditis": _entry(
+        "endocrinology",
+        "fatigue, weight gain, constipation, cold intolerance, neck mass, menstrual changes",
+        "endocrine, immune"),
+    "Polycystic ovary syndrome": _entry(
+        "endocrinology, obstetrics-gynecology",
+        "menstrual changes, hirsutism, infertility, weight gain", "endocrine, reproductive"),
+    "Prolactinoma (no vision changes or lactation)": _entry(
+        "endocrinology, oncology",
+        "menstrual changes, infertility, headache, sexual dysfunction",
+        "endocrine, nervous"),
+    "21-hydroxylase deficiency (congenital adrenal hyperplasia)": _entry(
+        "endocrinology, pediatrics",
+        "vomiting, hirsutism, menstrual changes, failure to thrive", "endocrine"),
+    "DiGeorge syndrome": _entry(
+        "pediatrics, cardiology",
+        "recurrent infections, seizure, cyanosis, failure to thrive",
+        "immune, cardiovascular"),
+    "Hypercalcemia (of malignancy)": _entry(
+        "oncology, endocrinology",
+        "confusion, constipation, abdominal pain, bone pain, polyuria, fatigue",
+        "endocrine"),
+    "Crohn’s disease": _entry(
+        "gastroenterology", "abdominal pain, diarrhea, weight loss, fever",
+        "gastrointestinal, immune"),
+    "Ulcerative colitis": _entry(
+        "gastroenterology", "bloody stool, diarrhea, abdominal pain",
+        "gastrointestinal, immune"),
+    "Acute pancreatitis (gallstone)": _entry(
+        "gastroenterology, surgery, emergency-medicine",
+        "abdominal pain, vomiting, fever, jaundice", "gastrointestinal"),
+    "Chronic mesenteric ischemia": _entry(
+        "gastroenterology, surgery", "abdominal pain, weight loss",
+        "gastrointestinal, cardiovascular"),
+    "Ectopic pregnancy (ruptured, RLQ)": _entry(
+        "obstetrics-gynecology, emergency-medicine, surgery",
+        "abdominal pain, vaginal bleeding, menstrual changes, syncope", "reproductive"),
+    "HELLP syndrome": _entry(
+        "obstetrics-gynecology",
+        "abdominal pain, high blood pressure, vomiting, headache, bruising",
+        "reproductive, hematologic, gastrointestinal"),
+    "Preeclampsia": _entry(
+        "obstetrics-gynecology", "high blood pressure, headache, vision changes, edema",
+        "reproductive, cardiovascular"),
+    "Ankylosing spondylitis": _entry(
+        "rheumatology", "back pain, joint pain, vision changes", "musculoskeletal, immune"),
+    "Guillain-Barré syndrome": _entry(
+        "neurology, emergency-medicine", "weakness, numbness, gait problems, dyspnea",
+        "nervous, immune"),
+    "Reactive arthritis": _entry(
+        "rheumatology, infectious-disease",
+        "joint pain, vision changes, painful urination, rash, diarrhea",
+        "musculoskeletal, immune"),
+    "Systemic lupus erythematosus": _entry(
+        "rheumatology, nephrology, dermatology",
+        "rash, joint pain, fever, fatigue, edema, hematuria, chest pain",
+        "immune, skin, renal"),
+    "Multiple sclerosis": _entry(
+        "neurology, ophthalmology",
+        "vision changes, numbness, weakness, gait problems, incontinence, fatigue",
+        "nervous, immune"),
+    "Parkinson’s disease": _entry(
+        "neurology", "abnormal movements, gait problems", "nervous"),
+    "Myasthenia gravis": _entry(
+        "neurology, ophthalmology", "weakness, ptosis, vision changes, dysphagia, dyspnea",
+        "nervous, immune"),
+    "Amyotrophic lateral sclerosis": _entry(
+        "neurology", "weakness, dysphagia, gait problems, slurred speech", "nervous"),
+    "CREST syndrome/limited scleroderma": _entry(
+        "rheumatology, dermatology", "dysphagia, skin changes, raynaud",
+        "immune, skin, gastrointestinal"),
+    "Schizophrenia": _entry(
+        "psychiatry", "psychosis", "psychiatric"),
+    "Schizoaffective disorder": _entry(
+        "psychiatry", "psychosis, mood changes", "psychiatric"),
+    "Cystic fibrosis": _entry(
+        "pulmonology, pediatrics, gastroenterology",
+        "cough, recurrent infections, failure to thrive, diarrhea, dyspnea, infertility",
+        "respiratory, gastrointestinal"),
+    "Huntington’s disease": _entry(
+        "neurology, psychiatry", "abnormal movements, mood changes, memory loss, psychosis",
+        "nervous, psychiatric"),
+    "Wilson's disease": _entry(
+        "gastroenterology, neurology, psychiatry",
+        "jaundice, abnormal movements, mood changes, psychosis, abdominal pain",
+        "gastrointestinal, nervous"),
+    "Lithium toxicity": _entry(
+        "psychiatry, emergency-medicine, nephrology",
+        "abnormal movements, confusion, vomiting, diarrhea, poisoning, polyuria",
+        "toxicologic, nervous"),
+    "Acetaminophen toxicity": _entry(
+        "emergency-medicine, gastroenterology",
+        "poisoning, vomiting, abdominal pain, jaundice", "toxicologic, gastrointestinal"),
+    "Salicylate toxicity": _entry(
+        "emergency-medicine", "poisoning, tinnitus, vomiting, dyspnea, confusion, fever",
+        "toxicologic"),
+    "Lead poisoning": _entry(
+        "pediatrics, hematology",
+        "poisoning, abdominal pain, constipation, fatigue, pallor, memory loss",
+        "toxicologic, hematologic, nervous"),
+    "Carbon monoxide poisoning": _entry(
+        "emergency-medicine", "poisoning, headache, confusion, vomiting, dyspnea, syncope",
+        "toxicologic, nervous"),
+    "Meningitis (bacterial/Neisseria meningitidis)": _entry(
+        "infectious-disease, neurology, emergency-medicine, pediatrics",
+        "fever, headache, neck pain, confusion, rash, seizure, vomiting",
+        "nervous, infectious"),
+    "Meningitis (fungal/Cryptococcus)": _entry(
+        "infectious-disease, neurology", "headache, fever, confusion, vision changes",
+        "nervous, infectious"),
+    "Encephalitis (viral/HSV-1)": _entry(
+        "infectious-disease, neurology, emergency-medicine",
+        "fever, confusion, seizure, headache, mood changes", "nervous, infectious"),
+    "Syphilis (secondary)": _entry(
+        "infectious-disease, dermatology", "rash, lymphadenopathy, fever, sore throat",
+        "infectious, skin, reproductive"),
+    "Malaria": _entry(
+        "infectious-disease", "fever, headache, fatigue, vomiting, jaundice, pallor",
+        "infectious, hematologic"),
+    "Tetralogy of Fallot": _entry(
+        "cardiology, pediatrics, surgery", "cyanosis, dyspnea, failure to thrive, syncope",
+        "cardiovascular"),
+    "Eisenmenger syndrome": _entry(
+        "cardiology, pulmonology",
+        "cyanosis, dyspnea, chest pain, fatigue, syncope, hemoptysis",
+        "cardiovascular, respiratory"),
+    "Hemochromatosis": _entry(
+        "gastroenterology, hematology, endocrinology",
+        "fatigue, joint pain, skin changes, polyuria, abdominal pain, sexual dysfunction",
+        "gastrointestinal, endocrine, hematologic"),
+    "Sarcoidosis": _entry(
+        "pulmonology, rheumatology, dermatology, ophthalmology",
+        "cough, dyspnea, rash, vision changes, fatigue, lymphadenopathy",
+        "respiratory, immune, skin"),
+    "Diabetic ketoacidosis": _entry(
+        "endocrinology, emergency-medicine, pediatrics",
+        "polyuria, vomiting, abdominal pain, confusion, dyspnea, weight loss", "endocrine"),
+    "Hyperosmolar hyperglycemic state": _entry(
+        "endocrinology, emergency-medicine", "polyuria, confusion, seizure, weakness",
+        "endocrine"),
+    "(Chronic) subdural hematoma": _entry(
+        "neurology, surgery, emergency-medicine",
+        "headache, confusion, memory loss, gait problems, weakness", "nervous"),
+    "Measles": _entry(
+        "pediatrics, infectious-disease, dermatology",
+        "fever, rash, cough, vision changes, runny nose", "infectious, skin"),
+    "Syringomyelia": _entry(
+        "neurology, surgery", "numbness, weakness, neck pain, limb pain", "nervous"),
+    "Cauda equina syndrome (acute)": _entry(
+        "neurology, surgery, emergency-medicine, orthopedics",
+        "back pain, incontinence, numbness, weakness, limb pain",
+        "nervous, musculoskeletal"),
+    "Cervical myelopathy": _entry(
+        "neurology, orthopedics, surgery",
+        "neck pain, numbness, weakness, gait problems, incontinence",
+        "nervous, musculoskeletal"),
+    "Temporal arteritis/giant cell arteritis": _entry(
+        "rheumatology, ophthalmology, neurology",
+        "headache, vision changes, jaw pain, fever, muscle pain",
+        "cardiovascular, immune"),
+    "Takayasu arteritis": _entry(
+        "rheumatology, cardiology",
+        "limb pain, fatigue, fever, syncope, high blood pressure, weight loss",
+        "cardiovascular, immune"),
+    "Polyarteritis nodosa": _entry(
+        "rheumatology, nephrology, dermatology",
+        "high blood pressure, abdominal pain, rash, numbness, fever, muscle pain, weight loss",
+        "cardiovascular, immune, renal"),
+    "IgA vasculitis/Henoch-Schönlein purpura (Berger's disease)": _entry(
+        "pediatrics, rheumatology, nephrology, dermatology",
+        "rash, joint pain, abdominal pain, hematuria", "immune, skin, renal"),
+    "Granulomatosis with polyangiitis (Wegener’s)": _entry(
+        "rheumatology, nephrology, pulmonology, otolaryngology",
+        "hemoptysis, runny nose, hematuria, cough", "immune, respiratory, renal"),
+    "Eosinophilic granulomatosis with polyangiitis (Churg-Strauss)": _entry(
+        "rheumatology, pulmonology, otolaryngology",
+        "wheezing, dyspnea, runny nose, rash, numbness", "immune, respiratory"),
+    "Scarlet fever": _entry(
+        "pediatrics, infectious-disease, dermatology, otolaryngology",
+        "sore throat, fever, rash", "infectious, skin"),
+    "Mycoplasma pneumonia (walking pneumonia/pneumonia)": _entry(
+        "pulmonology, infectious-disease, pediatrics",
+        "cough, fever, headache, sore throat, fatigue", "respiratory, infectious"),
+    "Legionella (Legionnaires’ disease)": _entry(
+        "pulmonology, infectious-disease", "cough, fever, diarrhea, confusion, dyspnea",
+        "respiratory, infectious"),
+    "Paget disease": _entry(
+        "orthopedics, endocrinology", "bone pain, headache, tinnitus", "musculoskeletal"),
+    "DRESS syndrome": _entry(
+        "dermatology, emergency-medicine", "rash, fever, edema, lymphadenopathy",
+        "skin, immune"),
+    "C6 radiculopathy": _entry(
+        "neurology, orthopedics", "neck pain, numbness, limb pain, weakness",
+        "nervous, musculoskeletal"),
+    "L5 radiculopathy": _entry(
+        "neurology, orthopedics", "back pain, limb pain, numbness, weakness",
+        "nervous, musculoskeletal"),
+    "Ulnar neuropathy": _entry(
+        "neurology, orthopedics", "numbness, weakness, limb pain", "nervous"),
+    "Severe combined immunodeficiency/SCID": _entry(
+        "pediatrics", "recurrent infections, failure to thrive, diarrhea", "immune"),
+    "Cardiac tamponade": _entry(
+        "cardiology, emergency-medicine, surgery",
+        "dyspnea, chest pain, syncope, palpitations", "cardiovascular"),
+    "Aortic dissection": _entry(
+        "cardiology, emergency-medicine, surgery",
+        "chest pain, back pain, syncope, high blood pressure, weakness", "cardiovascular"),
+    "Spinal epidural abscess": _entry(
+        "neurology, infectious-disease, emergency-medicine, surgery",
+        "back pain, fever, weakness, numbness, incontinence", "nervous, infectious"),
+    "Tardive dyskinesia": _entry(
+        "psychiatry, neurology", "abnormal movements", "nervous, psychiatric"),
+    "Common variable immunodeficiency/CVID": _entry(
+        "infectious-disease, pulmonology, gastroenterology",
+        "recurrent infections, cough, diarrhea, runny nose", "immune"),
+    "Toxic megacolon": _entry(
+        "gastroenterology, surgery, emergency-medicine",
+        "abdominal pain, bloating, bloody stool, diarrhea, fever", "gastrointestinal"),
+    "Compartment syndrome": _entry(
+        "orthopedics, surgery, emergency-medicine", "limb pain, numbness, edema",
+        "musculoskeletal"),
+    "Pulmonary embolism (no concurrent DVT)": _entry(
+        "pulmonology, cardiology, emergency-medicine",
+        "dyspnea, chest pain, hemoptysis, palpitations, syncope",
+        "respiratory, cardiovascular, hematologic"),
+    "Acute respiratory distress syndrome/ARDS": _entry(
+        "pulmonology, emergency-medicine", "dyspnea, cyanosis", "respiratory"),
+    "Neonatal respiratory distress syndrome/NRDS": _entry(
+        "pediatrics, pulmonology", "dyspnea, cyanosis", "respiratory"),
+    "Polymyositis": _entry(
+        "rheumatology, neurology", "weakness, muscle pain, dysphagia, fatigue",
+        "musculoskeletal, immune"),
+}
+
+
+def _bits_set(bits):
+    return [i for i in range(bits.bit_length()) if bits >> i & 1]
+
+
+class DiseaseCatalog:
+    """
+    Inverted index from complaint, system and specialty phrases to DISEASES.
+
+    Phrases are normalised like diagnosis attempts and stored as bitsets
+    over DISEASES (see played_tracker.DISEASE_BITS). Criteria are matched
+    longest phrase first, and a disease must meet every phrase given.
+    """
+
+    def __init__(self, catalog=CATALOG, complaints=COMPLAINTS, systems=SYSTEMS,
+                 specialties=SPECIALTIES, min_candidates=CATALOG_MIN_CANDIDATES,
+                 warm_tries=CATALOG_WARM_TRIES):
+        missing = set(DISEASES) - set(catalog)
+        if missing:
+            raise ValueError(f"DISEASES entries missing from the catalog: {sorted(missing)}")
+        self.catalog = catalog
+        self.min_candidates = min_candidates
+        self.warm_tries = warm_tries
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
+        complaint_bits = {}
+        system_bits = {}
+        specialty_bits = {}
+        for disease, entry in catalog.items():
+            bit = DISEASE_BITS[disease]
+            for name in entry.complaints:
+                complaint_bits[name] = complaint_bits.get(name, 0) | bit
+            for name in entry.systems:
+                system_bits[name] = system_bits.get(name, 0) | bit
+            for name in entry.specialties:
+                specialty_bits[name] = specialty_bits.get(name, 0) | bit
+        for name, parts in DERIVED_SPECIALTIES.items():
+            for part in parts:
+                specialty_bits[name] = specialty_bits.get(name, 0) | specialty_bits.get(part, 0)
+
+        # Complaint text may name a complaint or an organ system.
+        self.complaint_index = self._phrase_index(complaints, complaint_bits)
+        for phrase, bits in self._phrase_index(systems, system_bits).items():
+            self.complaint_index.setdefault(phrase, bits)
+        self.specialty_index = self._phrase_index(specialties, specialty_bits)
+        self.longest_phrase = max(len(phrase.split()) for phrase in self.complaint_index)
+
+        # Aliases for mapping LLM-suggested names back onto catalogued entries.
+        self.alias_entries = {}
+        for disease in catalog:
+            for alias in entry_aliases(disease):
+                self.alias_entries.setdefault(alias, disease)
+
+    @staticmethod
+    def _phrase_index(synonyms, bits_by_name):
+        index = {}
+        for name, phrases in synonyms.items():
+            bits = bits_by_name.get(name, 0)
+            for phrase in [name, *phrases]:
+                phrase = normalize_diagnosis(phrase)
+                index[phrase] = index.get(phrase, 0) | bits
+        return index
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _complaint_bits(self, chief_complaint):
+        """Bitset meeting every phrase in the complaint; None unless all of it is indexed."""
+        words = normalize_diagnosis(chief_complaint).split()
+        bits = None
+        i = 0
+        while i < len(words):
+            for n in range(min(self.longest_phrase, len(words) - i), 0, -1):
+                phrase = ' '.join(words[i:i + n])
+                if phrase in self.complaint_index:
+                    bits = self.complaint_index[phrase] & (-1 if bits is None else bits)
+                    i += n
+                    break
+            else:
+                if words[i] not in FILLER_WORDS:
+                    return None
+                i += 1
+        return bits
+
+    def _specialty_bits(self, specialty):
+        specialty = normalize_diagnosis(specialty)
+        if specialty in self.specialty_index:
+            return self.specialty_index[specialty]
+        # "Hematology/Oncology" and the like: any of the named specialties.
+        bits = 0
+        for part in specialty.split():
+            if part not in self.specialty_index:
+                return None
+            bits |= self.specialty_index[part]
+        return bits
+
+    def candidates(self, chief_complaint='', specialty=''):
+        """
+        Bitset of DISEASES meeting the criteria; blank criteria match everything.
+
+        Returns None if the criteria use words the index doesn't cover.
+        """
+        bits = (1 << len(DISEASES)) - 1
+        if chief_complaint and chief_complaint.strip():
+            complaint = self._complaint_bits(chief_complaint)
+            if complaint is None:
+                return None
+            bits &= complaint
+        if specialty and specialty.strip():
+            matched = self._specialty_bits(specialty)
+            if matched is None:
+                return None
+            bits &= matched
+        return bits
+
+    def pick(self, bits, warm=None):
+        """
+        A random disease from `bits`, preferring one whose case is already stored.
+
+        Up to `warm_tries` candidates are drawn; the first warm one wins,
+        which biases towards stored cases without always serving the same one.
+        """
+        indexes = _bits_set(bits)
+        if not indexes:
+            return None
+        rng = thread_random()
+        first = None
+        for _ in range(self.warm_tries if warm is not None else 1):
+            disease = DISEASES[rng.choice(indexes)]
+            if first is None:
+                first = disease
+            if warm is not None and disease in warm:
+                self._count('warm_picks')
+                return disease
+        return first
+
+    def select(self, chief_complaint='', specialty='', warm=None):
+        """A disease for the criteria, or None if the LLM should be asked instead."""
+        bits = self.candidates(chief_complaint, specialty)
+        if bits is None:
+            self._count('uncovered')
+            return None
+        if bin(bits).count('1') < self.min_candidates:
+            self._count('too_few')
+            return None
+        self._count('hits')
+        disease = self.pick(bits, warm)
+        logging.info("Catalog matched %d candidates; selected: %s",
+                     bin(bits).count('1'), disease)
+        return disease
+
+    def canonical(self, name):
+        """The DISEASES entry `name` refers to, or `name` itself if uncatalogued."""
+        return self.alias_entries.get(normalize_diagnosis(name), name)
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = sum(stats.get(k, 0) for k in ('hits', 'uncovered', 'too_few'))
+        stats['hit_rate'] = round(stats.get('hits', 0) / lookups, 4) if lookups else None
+        return stats
+
+
+disease_catalog = DiseaseCatalog()
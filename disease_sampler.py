@@ -0,0 +1,124 @@
+# disease_sampler.py
+import logging
+import os
+import random
+import threading
+import time
+from array import array
+
+from disease_selector import DISEASES, game_day
+from lru import LRUCache
+from played_tracker import DISEASE_BITS, PLAYED_MAX_DEVICES
+
+# Positions past the cursor searched for a disease whose case is warm.
+WARM_LOOKAHEAD = int(os.getenv('SAMPLER_WARM_LOOKAHEAD', '8'))
+WARM_REFRESH_SECONDS = float(os.getenv('SAMPLER_WARM_REFRESH_SECONDS', '600'))
+
+
+class WarmCases:
+    """
+    Bitset of DISEASES whose case is already stored in the cases table.
+
+    Cases loaded or generated in this process are marked as they happen; a
+    background refresh through `check(disease)` picks up cases generated
+    elsewhere (other workers, pregenerate.py) every WARM_REFRESH_SECONDS.
+    """
+
+    def __init__(self, check, refresh_seconds=WARM_REFRESH_SECONDS):
+        self.check = check
+        self.refresh_seconds = refresh_seconds
+        self.bits = 0
+        self._lock = threading.Lock()
+        self._refreshed_at = None
+        self._refreshing = False
+
+    def mark(self, disease):
+        with self._lock:
+            self.bits |= DISEASE_BITS.get(disease, 0)
+
+    def __contains__(self, disease):
+        return bool(self.bits & DISEASE_BITS.get(disease, 0))
+
+    def refresh_in_background(self):
+        """Start a refresh if the last one is older than `refresh_seconds`."""
+        with self._lock:
+            if self._refreshing or (self._refreshed_at is not None and
+                                    time.monotonic() - self._refreshed_at < self.refresh_seconds):
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True, name='warm-cases').start()
+
+    def _refresh(self):
+        bits = 0
+        try:
+            for disease in DISEASES:
+                if self.check(disease):
+                    bits |= DISEASE_BITS[disease]
+        except Exception as e:
+            logging.error("Error refreshing warm cases: %s", e)
+        with self._lock:
+            self.bits |= bits
+            self._refreshed_at = time.monotonic()
+            self._refreshing = False
+
+
+class DiseaseSampler:
+    """
+    Draws diseases a device hasn't played today, without repeats or rejection.
+
+    Each device gets a random permutation of DISEASES indexes that is walked
+    with a cursor. A draw skips entries the device has already played and
+    takes the first warm one within WARM_LOOKAHEAD positions (swapped
+    into place, as in Fisher-Yates), else the next unplayed one, so a draw
+    costs O(1) amortised. The played set passed in is the source of truth, so
+    workers with their own permutations still never repeat a disease.
+    """
+
+    def __init__(self, warm=None, max_devices=PLAYED_MAX_DEVICES,
+                 lookahead=WARM_LOOKAHEAD):
+        self.warm = warm
+        self.lookahead = lookahead
+        self.devices = LRUCache(max_devices)
+        self._rng = random.Random()
+        self._lock = threading.Lock()
+        # Forked workers would otherwise all draw the same permutations.
+        os.register_at_fork(after_in_child=self._rng.seed)
+
+    def _state(self, device_id):
+        day = game_day()
+        state = self.devices.get(device_id)
+        # Played sets reset at rollover, so permutations do too.
+        if state is None or state[0] != day:
+            order = array('H', range(len(DISEASES)))
+            with self._lock:
+                self._rng.shuffle(order)
+            state = [day, 0, order]
+            self.devices.put(device_id, state)
+        return state
+
+    def draw(self, device_id, played, exclude=None):
+        """
+        A disease not in `played` (a PlayedSet) for this device.
+
+        Once every disease has been played, any disease but `exclude` is
+        returned and the device starts a fresh permutation.
+        """
+        state = self._state(device_id)
+        with self._lock:
+            _, cursor, order = state
+            while cursor < len(order) and DISEASES[order[cursor]] in played:
+                cursor += 1
+            if cursor == len(order):
+                self.devices.pop(device_id)
+                choices = [d for d in DISEASES if d != exclude] or DISEASES
+                return self._rng.choice(choices)
+            pick = cursor
+            if self.warm is not None and DISEASES[order[cursor]] not in self.warm:
+                for j in range(cursor + 1, min(len(order), cursor + 1 + self.lookahead)):
+                    disease = DISEASES[order[j]]
+                    if disease in self.warm and disease not in played:
+                        pick = j
+                        break
+            order[cursor], order[pick] = order[pick], order[cursor]
+            state[1] = cursor + 1
+            return DISEASES[order[cursor]]
@@ -1,19 +1,82 @@
 # disease_selector.py
 import random
 import logging
+import os
+import re
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 
 
+# The daily case rolls over at midnight UTC-10 (Honolulu).
+GAME_DAY_TIMEZONE = timezone(timedelta(hours=-10))
+
+
+def game_day(offset_days=0):
+    """Return the game date string (UTC-10), optionally offset by whole days."""
+    return (datetime.now(GAME_DAY_TIMEZONE) + timedelta(days=offset_days)).strftime("%Y-%m-%d")
+
+
+def game_day_ends_at(day):
+    """Unix time at which game day `day` (YYYY-MM-DD, UTC-10) rolls over."""
+    start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=GAME_DAY_TIMEZONE)
+    return int((start + timedelta(days=1)).timestamp())
+
+
+def case_of_the_day_disease(date_str):
+    """Return the case-of-the-day disease for a game date (same pick as select_random_disease)."""
+    # Seeding with the date string hashes it (SHA-512) into the seed.
+    return random.Random(date_str).choice(DISEASES)
+
+
+# Fewer AI-suggested diseases than this and a fallback is used instead.
+MIN_AI_CANDIDATES = 5
+
+# (disease, unix time it stops being the case of the day)
+_case_of_the_day = (None, 0)
+_case_of_the_day_lock = threading.Lock()
+_thread_state = threading.local()
+
+
+def _reset_thread_state():
+    # A forked worker must not continue the parent's random sequence.
+    global _thread_state
+    _thread_state = threading.local()
+
+
+os.register_at_fork(after_in_child=_reset_thread_state)
+
+
+def todays_case_disease():
+    """The current case-of-the-day disease, recomputed only at the UTC-10 rollover."""
+    global _case_of_the_day
+    disease, expires_at = _case_of_the_day
+    if time.time() < expires_at:
+        return disease
+    with _case_of_the_day_lock:
+        disease, expires_at = _case_of_the_day
+        if time.time() >= expires_at:
+            today = game_day()
+            disease = case_of_the_day_disease(today)
+            _case_of_the_day = (disease, game_day_ends_at(today))
+        return disease
+
+
+def thread_random():
+    """This thread's own random.Random, so concurrent picks never share RNG state."""
+    rng = getattr(_thread_state, 'rng', None)
+    if rng is None:
+        rng = _thread_state.rng = random.Random()
+    return rng
+
+
 def select_random_disease(case_of_the_day=True):
     """Select a random disease from the USMLE curriculum."""
-    if case_of_the_day:
-        today_date = datetime.now(
-            timezone(timedelta(hours=-10))).strftime("%Y-%m-%d")
-        random.seed(today_date)
-    else:
-        random.seed()
     try:
-        disease = random.choice(DISEASES)
+        if case_of_the_day:
+            disease = todays_case_disease()
+        else:
+            disease = thread_random().choice(DISEASES)
         logging.info("Randomly selected disease: %s", disease)
         return disease
     except Exception as e:
@@ -21,8 +84,63 @@ def select_random_disease(case_of_the_day=True):
         return None
 
 
-def select_disease_by_criteria(chief_complaint, specialty):
-    """Generate a disease list via AI that meets criteria, then randomly pick one."""
+def parse_candidate_list(raw_text):
+    """Clean disease names from a newline-separated AI candidate list."""
+    # Parse newline-delimited diseases
+    lines = [ln.strip() for ln in raw_text.splitlines() if ln.strip()]
+
+    # Cleanup each line: remove leading bullets/numbering if any slipped in, quotes, and parenthetical tails
+    cleaned = []
+    for ln in lines:
+        # remove leading bullets/numbering like "1) ", "1. ", "- ", "* ", "• "
+        ln = re.sub(r'^\s*(?:[-*•]|\d+[.)])\s*', '', ln)
+        # strip surrounding quotes
+        ln = ln.strip().strip('"').strip("'")
+        # drop parenthetical clarifications at end
+        ln = re.sub(r'\s*\([^)]*\)\s*$', '', ln).strip()
+        # sanity checks
+        if not ln:
+            continue
+        if len(ln) > 100 or len(ln.split()) > 8:
+            continue
+        cleaned.append(ln)
+
+    # Deduplicate while preserving order
+    seen = set()
+    candidates = []
+    for d in cleaned:
+        if d.lower() in seen:
+            continue
+        seen.add(d.lower())
+        candidates.append(d)
+    return candidates
+
+
+def select_disease_by_criteria(chief_complaint, specialty, llm=None, cache=None,
+                               catalog=None, warm=None):
+    """
+    Pick a disease meeting the criteria, from the catalog index when possible.
+
+    With a DiseaseCatalog, criteria it covers are served locally, preferring
+    diseases in `warm` (cases already stored). Otherwise the LLMClient
+    generates a candidate list and one is picked at random; names that match
+    a catalogued entry are returned as that entry. With an LLMCache, the
+    candidate list for a given prompt is generated once and the pick is made
+    from the cached list.
+    """
+    local = None
+    if catalog is not None:
+        disease = catalog.select(chief_complaint, specialty, warm=warm)
+        if disease is not None:
+            return disease
+        # Too few to serve on their own, but better than any disease at all.
+        local = catalog.candidates(chief_complaint, specialty)
+
+    def fallback():
+        if local:
+            return catalog.pick(local, warm)
+        return thread_random().choice(DISEASES)
+
     try:
         # Build prompt that asks for a list with strict output format
         criteria_lines = []
@@ -52,67 +170,37 @@ def select_disease_by_criteria(chief_complaint, specialty):
             "Sarcoidosis"
         )
 
-        # Import here to avoid circular imports
-        import google.generativeai as genai
-        import os
-        import re
-        from dotenv import load_dotenv
+        if llm is None:
+            logging.error("No LLM client for criteria selection; using fallback")
+            return fallback()
 
-        # Load environment variables
-        project_folder = os.path.expanduser('~/Development/diagnoseme')
-        load_dotenv(os.path.join(project_folder, '.env'))
-
-        API_KEY = os.getenv('GOOGLE_API_KEY')
-        if not API_KEY:
-            logging.error("Google API key not found")
-            return random.choice(DISEASES)
-
-        genai.configure(api_key=API_KEY)
-        model = genai.GenerativeModel('gemini-3-flash-preview')
+        def generate_list():
+            return llm.generate(prompt, log_prefix="Criteria selection").strip()
 
         # Generate the list
-        response = model.generate_content(prompt)
-        raw_text = (getattr(response, "text", None) or "").strip()
+        if cache is not None:
+            # Lists too short to use are regenerated rather than replayed.
+            raw_text = cache.get_or_compute(
+                llm.model_name, prompt, generate_list,
+                validate=lambda text: len(parse_candidate_list(text)) >= MIN_AI_CANDIDATES)
+        else:
+            raw_text = generate_list()
         if not raw_text:
             logging.warning("Empty AI response; using fallback")
-            return random.choice(DISEASES)
-
-        # Parse newline-delimited diseases
-        lines = [ln.strip() for ln in raw_text.splitlines() if ln.strip()]
-
-        # Cleanup each line: remove leading bullets/numbering if any slipped in, quotes, and parenthetical tails
-        cleaned = []
-        for ln in lines:
-            # remove leading bullets/numbering like "1) ", "1. ", "- ", "* ", "• "
-            ln = re.sub(r'^\s*(?:[-*•]|\d+[.)])\s*', '', ln)
-            # strip surrounding quotes
-            ln = ln.strip().strip('"').strip("'")
-            # drop parenthetical clarifications at end
-            ln = re.sub(r'\s*\([^)]*\)\s*$', '', ln).strip()
-            # sanity checks
-            if not ln:
-                continue
-            if len(ln) > 100 or len(ln.split()) > 8:
-                continue
-            cleaned.append(ln)
-
-        # Deduplicate while preserving order
-        seen = set()
-        candidates = []
-        for d in cleaned:
-            if d.lower() in seen:
-                continue
-            seen.add(d.lower())
-            candidates.append(d)
+            return fallback()
+
+        candidates = parse_candidate_list(raw_text)
 
         # If AI list is too small, fall back
-        if len(candidates) < 5:
+        if len(candidates) < MIN_AI_CANDIDATES:
             logging.warning(
                 "AI produced too few valid candidates; using fallback list")
-            return random.choice(DISEASES)
+            return fallback()
 
         # Pick randomly from AI-generated list
-        choice = random.choice(candidates)
+        choice = thread_random().choice(candidates)
+        if catalog is not None:
+            choice = catalog.canonical(choice)
         logging.info("AI-generated candidate count: %d; selected: %s",
                      len(candidates), choice)
         return choice
@@ -120,7 +208,7 @@ def select_disease_by_criteria(chief_complaint, specialty):
     except Exception as e:
         logging.error("Error generating disease with AI: %s", e, exc_info=True)
         # Fallback to random selection from existing list
-        return random.choice(DISEASES)
+        return fallback()
 
 
 # List of diseases from the USMLE Step 1 and 2 curriculum
@@ -0,0 +1,262 @@
+# embedding_store.py
+"""
+Float16 memory-mapped corpus embeddings with batched NumPy top-k search.
+
+A store directory (corpus/<corpus>_dense/ by default) holds:
+
+    embeddings.npy     float16 (num_docs, dim), memory-mapped on load
+    ids.txt            corpus ids (same id space as <corpus>_id2text), one per row
+    ivf_centroids.npy  optional float32 (nlist, dim) coarse centroids
+    ivf_indptr.npy     optional int64, rows of list c are ivf_order[indptr[c]:indptr[c + 1]]
+    ivf_order.npy      optional uint32 row numbers grouped by list
+
+    python embedding_store.py convert MedText emb_000.npy emb_001.npy --ids ids.txt
+    python embedding_store.py ivf MedText --nlist 1024
+"""
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+from corpus_store import CORPUS_DIR, open_id2text
+
+# Rows scored per matrix product in an exhaustive scan.
+SCAN_CHUNK_ROWS = int(os.getenv('EMBEDDING_SCAN_CHUNK_ROWS', '65536'))
+# IVF lists scanned per query when the store has an IVF partition.
+IVF_NPROBE = int(os.getenv('EMBEDDING_IVF_NPROBE', '32'))
+MEDCPT_QUERY_ENCODER = os.getenv('MEDCPT_QUERY_ENCODER', 'ncbi/MedCPT-Query-Encoder')
+
+
+def store_dir_for(corpus_name, corpus_dir=CORPUS_DIR):
+    return os.path.join(corpus_dir, f"{corpus_name}_dense")
+
+
+def _merge_top_k(best_scores, best_rows, scores, rows, k):
+    """Fold a (batch, n) block of candidates into the running (batch, k) top-k."""
+    rows = np.concatenate([best_rows, np.broadcast_to(rows, scores.shape)], axis=1)
+    scores = np.concatenate([best_scores, scores], axis=1)
+    if scores.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, keep, axis=1)
+        rows = np.take_along_axis(rows, keep, axis=1)
+    return scores, rows
+
+
+def convert(corpus_name, embedding_paths, ids_path, out_dir=None, normalize=False):
+    """Concatenate float32 embedding shards into a float16 store."""
+    out_dir = out_dir or store_dir_for(corpus_name)
+    shards = [np.load(path, mmap_mode='r') for path in embedding_paths]
+    num_docs = sum(len(shard) for shard in shards)
+    dim = shards[0].shape[1]
+    with open(ids_path, encoding='utf-8') as f:
+        ids = f.read().split('\n')
+    if ids and ids[-1] == '':
+        ids.pop()
+    if len(ids) != num_docs:
+        raise ValueError(f"{len(ids)} ids for {num_docs} embeddings")
+
+    os.makedirs(out_dir, exist_ok=True)
+    out = np.lib.format.open_memmap(os.path.join(out_dir, 'embeddings.npy'), mode='w+',
+                                    dtype=np.float16, shape=(num_docs, dim))
+    row = 0
+    for shard in shards:
+        for start in range(0, len(shard), SCAN_CHUNK_ROWS):
+            block = np.asarray(shard[start:start + SCAN_CHUNK_ROWS], dtype=np.float32)
+            if normalize:
+                block /= np.linalg.norm(block, axis=1, keepdims=True) + 1e-12
+            out[row:row + len(block)] = block
+            row += len(block)
+    out.flush()
+    with open(os.path.join(out_dir, 'ids.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(ids))
+    logging.info("Wrote %s: %d x %d float16", out_dir, num_docs, dim)
+    return out_dir
+
+
+def build_ivf(store_dir, nlist=1024, iterations=10, sample_size=200000, seed=0):
+    """Coarse k-means partition so queries scan only `nprobe` lists."""
+    embeddings = np.load(os.path.join(store_dir, 'embeddings.npy'), mmap_mode='r')
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(len(embeddings), min(sample_size, len(embeddings)),
+                                     replace=False))
+    sample = np.asarray(embeddings[sample_rows], dtype=np.float32)
+    nlist = min(nlist, len(sample))
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    def nearest(block):
+        # argmax of x.c - |c|^2 / 2 is the nearest centroid in L2.
+        return np.argmax(block @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+
+    for _ in range(iterations):
+        assignment = nearest(sample)
+        for c in range(nlist):
+            members = sample[assignment == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+
+    assignment = np.concatenate([
+        nearest(np.asarray(embeddings[start:start + SCAN_CHUNK_ROWS], dtype=np.float32))
+        for start in range(0, len(embeddings), SCAN_CHUNK_ROWS)])
+    order = np.argsort(assignment, kind='stable').astype(np.uint32)
+    indptr = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignment, minlength=nlist), out=indptr[1:])
+
+    np.save(os.path.join(store_dir, 'ivf_centroids.npy'), centroids)
+    np.save(os.path.join(store_dir, 'ivf_indptr.npy'), indptr)
+    np.save(os.path.join(store_dir, 'ivf_order.npy'), order)
+    logging.info("Built IVF with %d lists over %d rows", nlist, len(embeddings))
+
+
+class EmbeddingStore:
+    """
+    Top-k inner-product search over a float16 embedding memmap.
+
+    `search_batch` scores a whole batch of queries per matrix product, so
+    several generations retrieving at once share each pass over the rows.
+    With an IVF partition only the `nprobe` closest lists are scanned.
+    """
+
+    def __init__(self, store_dir, nprobe=IVF_NPROBE):
+        def path(name):
+            return os.path.join(store_dir, name)
+
+        self.store_dir = store_dir
+        self.embeddings = np.load(path('embeddings.npy'), mmap_mode='r')
+        with open(path('ids.txt'), encoding='utf-8') as f:
+            self.ids = f.read().split('\n')
+        self.nprobe = nprobe
+        self.centroids = None
+        if os.path.exists(path('ivf_centroids.npy')):
+            self.centroids = np.load(path('ivf_centroids.npy'))
+            self.ivf_indptr = np.load(path('ivf_indptr.npy'))
+            self.ivf_order = np.load(path('ivf_order.npy'), mmap_mode='r')
+
+    @classmethod
+    def for_corpus(cls, corpus_name, corpus_dir=CORPUS_DIR):
+        return cls(store_dir_for(corpus_name, corpus_dir))
+
+    def search_batch(self, queries, k=32):
+        """[[(doc id, score)] per query] for a (batch, dim) array of query vectors."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self.embeddings))
+        if self.centroids is not None:
+            results = [self._search_ivf(query, k) for query in queries]
+        else:
+            results = self._scan(queries, np.arange(len(self.embeddings)), k)
+        return [[(self.ids[row], float(score)) for score, row in result] for result in results]
+
+    def search(self, query, k=32):
+        return self.search_batch(query, k)[0]
+
+    def _scan(self, queries, rows, k):
+        """Exhaustive scan of `rows` (ascending) for every query."""
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        contiguous = len(rows) == len(self.embeddings)
+        for start in range(0, len(rows), SCAN_CHUNK_ROWS):
+            chunk_rows = rows[start:start + SCAN_CHUNK_ROWS]
+            block = self.embeddings[start:start + len(chunk_rows)] if contiguous \
+                else self.embeddings[chunk_rows]
+            scores = queries @ np.asarray(block, dtype=np.float32).T
+            best_scores, best_rows = _merge_top_k(best_scores, best_rows, scores,
+                                                  chunk_rows.astype(np.int64), k)
+        order = np.argsort(-best_scores, axis=1)
+        return [list(zip(np.take_along_axis(best_scores, order, axis=1)[i],
+                         np.take_along_axis(best_rows, order, axis=1)[i]))
+                for i in range(len(queries))]
+
+    def _search_ivf(self, query, k):
+        nprobe = min(self.nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.sort(np.concatenate([
+            self.ivf_order[self.ivf_indptr[c]:self.ivf_indptr[c + 1]] for c in lists]))
+        if not len(rows):
+            return []
+        return self._scan(query[None, :], rows.astype(np.int64), min(k, len(rows)))[0]
+
+
+def make_medcpt_encoder(model_name=MEDCPT_QUERY_ENCODER):
+    """Batch query encoder (list of str -> float32 array) using MedCPT's query model."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+
+    def encode(texts):
+        with torch.no_grad():
+            encoded = tokenizer(texts, truncation=True, padding=True,
+                                return_tensors='pt', max_length=64)
+            return model(**encoded).last_hidden_state[:, 0, :].numpy().astype(np.float32)
+
+    return encode
+
+
+class LocalDenseRetriever:
+    """
+    Drop-in for MedRAG's RetrievalSystem over an EmbeddingStore.
+
+    `retrieve` matches RetrievalSystem.retrieve; `retrieve_batch` encodes and
+    searches several questions in one pass.
+    """
+
+    def __init__(self, corpus_name, encode=None, corpus_dir=CORPUS_DIR):
+        self.corpus_name = corpus_name
+        self.store = EmbeddingStore.for_corpus(corpus_name, corpus_dir)
+        self.encode = encode or make_medcpt_encoder()
+        self.id2text = open_id2text(corpus_name, corpus_dir)
+
+    def _snippets(self, hits):
+        snippets = []
+        for doc_id, _ in hits:
+            value = self.id2text[doc_id]
+            snippet = dict(value) if isinstance(value, dict) else {'title': '', 'content': value}
+            snippet.setdefault('id', doc_id)
+            snippets.append(snippet)
+        return snippets, [score for _, score in hits]
+
+    def retrieve_batch(self, questions, k=32):
+        return [self._snippets(hits)
+                for hits in self.store.search_batch(self.encode(list(questions)), k)]
+
+    def retrieve(self, question, k=32, rrf_k=100):
+        return self.retrieve_batch([question], k)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build float16 embedding stores.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    conv = commands.add_parser('convert', help="Convert float32 .npy shards to a store.")
+    conv.add_argument('corpus')
+    conv.add_argument('embeddings', nargs='+')
+    conv.add_argument('--ids', required=True, help="Corpus id per embedding row, one per line.")
+    conv.add_argument('--normalize', action='store_true')
+    ivf = commands.add_parser('ivf', help="Add an IVF partition to a store.")
+    ivf.add_argument('corpus')
+    ivf.add_argument('--nlist', type=int, default=1024)
+    ivf.add_argument('--iterations', type=int, default=10)
+    bench = commands.add_parser('bench', help="Batched search latency with random queries.")
+    bench.add_argument('corpus')
+    bench.add_argument('--batch', type=int, default=16)
+    bench.add_argument('--k', type=int, default=32)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'convert':
+        convert(args.corpus, args.embeddings, args.ids, normalize=args.normalize)
+    elif args.command == 'ivf':
+        build_ivf(store_dir_for(args.corpus), args.nlist, args.iterations)
+    else:
+        store = EmbeddingStore.for_corpus(args.corpus)
+        queries = np.random.default_rng(0).standard_normal(
+            (args.batch, store.embeddings.shape[1])).astype(np.float32)
+        started = time.perf_counter()
+        store.search_batch(queries, args.k)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{args.batch} queries in {elapsed:.1f}ms ({elapsed / args.batch:.2f}ms/query)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,39 @@
-from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
+from flask import Flask, render_template, request, jsonify, session, Response, has_request_context
 import logging
 import json
 import os
 import boto3
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from liquid import Template
 from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
 # Import the new function
 from disease_selector import select_random_disease, select_disease_by_criteria
 from flask_cors import CORS
 from google import genai
+from google.genai import types as genai_types
 import urllib.parse  # Importing urllib for URL encoding
 from url_shortener import encode_case_data, decode_case_data
+from session_store import SessionStore, make_session_backend
+from speculative import SpeculativeStream, speculation_stats
+from question_router import question_router, ROUTES, ROUTE_EXAMPLES
+from diagnosis_matcher import match_diagnosis, match_stats
+from single_flight import DynamoLease, SingleFlight, make_lease_backend, run_once
+from medrag_pool import medrag_pool
+from retrieval_cache import retrieval_cache_stats
+from llm_cache import LLMCache, make_llm_cache_backend
+from report_cache import ReportCache
+from played_tracker import PlayedTracker, make_played_backend
+from disease_sampler import DiseaseSampler, WarmCases
+from disease_catalog import disease_catalog
+from conversation_writer import (ConversationLog, ConversationWriter,
+                                 make_conversation_backend)
+from stream_guard import ChunkStream, guarded_stream, stream_stats
+from sse import SSEStream, SSE_HEADERS
+from llm_client import (LLMClient, LLMError, LLMStream, LLM_TIMEOUT_SECONDS,
+                        LLM_LONG_TIMEOUT_SECONDS)
 from dotenv import load_dotenv
 from datetime import datetime
 from flask import after_this_request
@@ -25,20 +47,51 @@ logging.basicConfig(level=logging.INFO)
 
 API_KEY = os.getenv('GOOGLE_API_KEY')
 
-client = genai.Client(api_key=API_KEY)
 MODEL_NAME = 'gemini-3.5-flash'
 ADVANCED_MODEL_NAME = 'gemini-3.5-flash'
 
+
+def make_genai_client():
+    # Default timeout for requests that don't set their own deadline.
+    return genai.Client(api_key=API_KEY, http_options=genai_types.HttpOptions(
+        timeout=int(LLM_LONG_TIMEOUT_SECONDS * 1000)))
+
+
+# One pooled client per process, with retries, deadlines and a circuit breaker.
+llm = LLMClient(make_genai_client, MODEL_NAME, ADVANCED_MODEL_NAME)
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 app.secret_key = 'your_secret_key'
 
 dynamodb = boto3.client('dynamodb')
 
-CONVERSATIONS_TABLE = os.getenv(
-    'CONVERSATIONS_TABLE', 'diagnosemeconversations')
+# Responses of deterministic prompts, keyed on (model, prompt); see call_llm_api(cache=True).
+llm_cache = LLMCache(make_llm_cache_backend(dynamodb))
+# Lab and exam reports per case, shared by every player of that case.
+report_cache = ReportCache(llm_cache)
+# Write-behind queue for /save_conversation snapshots.
+conversation_writer = ConversationWriter(
+    ConversationLog(make_conversation_backend(dynamodb)))
+
 CASES_TABLE = os.getenv('CASES_TABLE', 'diagnosemecases')
 
+# Shared pool for independent non-streaming LLM calls within one request.
+llm_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('LLM_EXECUTOR_WORKERS', '16')))
+
+# Case generation is de-duplicated per gamecase (see get_patient_case_record).
+case_generation_flight = SingleFlight()
+case_lease = make_lease_backend(dynamodb)
+CASE_LEASE_SECONDS = int(os.getenv('CASE_LEASE_SECONDS', '300'))
+
+# Start the patient-answer stream while the route is still being classified.
+SPECULATIVE_DISPATCH = os.getenv('SPECULATIVE_DISPATCH', '1') == '1'
+
+# Sentinels the client looks for in streamed answers.
+GAME_END_MARKERS = ('%%%', '~~~')
+STREAM_MARKERS = GAME_END_MARKERS + ('$$$',)
+
 
 @app.before_request
 def log_request_info():
@@ -81,7 +134,10 @@ def get_client_ip():
     return new_device_id
 
 
-user_played_diseases = {}
+# Diseases each device has played today, so random cases don't repeat.
+played_tracker = PlayedTracker(make_played_backend(dynamodb))
+warm_cases = WarmCases(lambda disease: load_case_item(get_case_key(disease)) is not None)
+disease_sampler = DiseaseSampler(warm_cases)
 
 
 @app.route('/new_random_case', methods=['POST'])
@@ -94,29 +150,15 @@ def new_random_case():
         # Get user identifier
         user_id = get_client_ip()
 
-        # Initialize played diseases set for this user if not exists
-        if user_id not in user_played_diseases:
-            user_played_diseases[user_id] = set()
-
-        # Add previous disease to played set if provided
-        if previous_disease:
-            user_played_diseases[user_id].add(previous_disease)
-
-        # Get a disease that hasn't been played today by this user
-        max_attempts = 10  # Avoid infinite loop
-        disease = None
-        for _ in range(max_attempts):
-            disease = select_random_disease(case_of_the_day=False)
-            if disease not in user_played_diseases[user_id]:
-                break
+        # Diseases this user has played today, plus the one just finished
+        played = played_tracker.played(user_id, previous_disease)
 
-        if not disease or disease in user_played_diseases[user_id]:
-            # If we couldn't find a new disease after max attempts, just use any random one
-            # This is a fallback and should rarely happen
-            disease = select_random_disease()
+        # A disease this user hasn't played today, preferring warm cases
+        warm_cases.refresh_in_background()
+        disease = disease_sampler.draw(user_id, played, exclude=previous_disease)
 
-        # Add to played diseases
-        user_played_diseases[user_id].add(disease)
+        # Add both to played diseases in one write
+        played_tracker.record(user_id, *filter(None, (previous_disease, disease)))
 
         logging.info(f"Selected new random disease: {disease}")
 
@@ -124,8 +166,7 @@ def new_random_case():
         case_record = get_patient_case_record(disease)
         patient_case = case_record['case']
 
-        # Build placeholder snippet
-        placeholder_snippet = build_placeholder_snippet(patient_case, disease)
+        placeholder_snippet = case_record['placeholder_snippet']
 
         # Return the new case details
         return jsonify({
@@ -138,7 +179,8 @@ def new_random_case():
                 "history": [],
                 "placeholder_snippet": placeholder_snippet,
                 "rubric": case_record['rubric'],
-                "case_key": case_record['case_key']
+                "case_key": case_record['case_key'],
+                "session_id": start_game_session(disease, case_record)
             }
         })
     except Exception as e:
@@ -158,8 +200,10 @@ def generate_case_by_criteria():
         logging.info(
             f"Generating AI case with criteria - Chief complaint: '{chief_complaint}', Specialty: '{specialty}'")
 
-        # Generate disease using AI based on criteria
-        disease = select_disease_by_criteria(chief_complaint, specialty)
+        # Served from the catalog index; AI only for criteria it doesn't cover
+        warm_cases.refresh_in_background()
+        disease = select_disease_by_criteria(chief_complaint, specialty, llm=llm, cache=llm_cache,
+                                             catalog=disease_catalog, warm=warm_cases)
         logging.info(f"AI selected disease: {disease}")
 
         if not disease:
@@ -168,7 +212,7 @@ def generate_case_by_criteria():
         # Generate patient case
         case_record = get_patient_case_record(disease)
         patient_case = case_record['case']
-        placeholder_snippet = build_placeholder_snippet(patient_case, disease)
+        placeholder_snippet = case_record['placeholder_snippet']
 
         # Return the case details
         return jsonify({
@@ -187,7 +231,8 @@ def generate_case_by_criteria():
                 "history": [],
                 "placeholder_snippet": placeholder_snippet,
                 "rubric": case_record['rubric'],
-                "case_key": case_record['case_key']
+                "case_key": case_record['case_key'],
+                "session_id": start_game_session(disease, case_record)
             }
         })
 
@@ -201,7 +246,7 @@ def generate_case_by_criteria():
 
 @app.route('/save_conversation', methods=['POST'])
 def save_conversation():
-    """Upsert a snapshot of the current game conversation to DynamoDB."""
+    """Queue a snapshot of the current game conversation for DynamoDB."""
     try:
         data = request.get_json(force=True, silent=True) or {}
 
@@ -226,40 +271,24 @@ def save_conversation():
         session_id = data.get(
             'session_id') or f"{user_id}|{date_str}|{disease}|{timestamp}"
 
-        dynamodb.update_item(
-            TableName=CONVERSATIONS_TABLE,
-            Key={'session_id': {'S': session_id}},
-            UpdateExpression=(
-                "SET user_id = :uid, "
-                "training_level = :tl, "
-                "game_date = :gd, "
-                "disease = :dz, "
-                "daily_streak = :ds, "
-                "games_played = :gp, "
-                "games_completed = :gc, "
-                "last_played = :lp, "
-                "elapsed_time = :et, "
-                "conversation = :cv, "
-                "updated_at = :now"
-            ),
-            ExpressionAttributeValues={
-                ':uid': {'S': str(user_id)},
-                ':tl': {'S': str(training_level)},
-                ':gd': {'S': str(date_str)},
-                ':dz': {'S': str(disease)},
-                ':ds': {'N': str(daily_streak)},
-                ':gp': {'N': str(games_played)},
-                ':gc': {'N': str(games_completed)},
-                ':lp': {'S': str(last_played)},
-                ':et': {'N': str(elapsed_time)},
-                ':cv': {'S': str(conversation)},
-                ':now': {'S': datetime.utcnow().isoformat()},
-            },
-            ReturnValues='NONE'
-        )
+        # Queued: the latest snapshot per session is written in batches.
+        conversation_writer.submit({
+            'session_id': {'S': session_id},
+            'user_id': {'S': str(user_id)},
+            'training_level': {'S': str(training_level)},
+            'game_date': {'S': str(date_str)},
+            'disease': {'S': str(disease)},
+            'daily_streak': {'N': str(daily_streak)},
+            'games_played': {'N': str(games_played)},
+            'games_completed': {'N': str(games_completed)},
+            'last_played': {'S': str(last_played)},
+            'elapsed_time': {'N': str(elapsed_time)},
+            'conversation': {'S': str(conversation)},
+            'updated_at': {'S': datetime.utcnow().isoformat()},
+        }, final=bool(data.get('final')))
         return jsonify({'ok': True, 'session_id': session_id})
     except Exception as e:
-        logging.error("Error saving conversation to DynamoDB: %s",
+        logging.error("Error saving conversation snapshot: %s",
                       e, exc_info=True)
         return jsonify({'ok': False, 'error': str(e)}), 500
 
@@ -339,9 +368,11 @@ def generate_case_rubric(disease, case_text):
         "  }\n"
         "}\n"
     )
-    response = call_llm_api(prompt, streaming=False,
-                            log_prefix="Generate Case Rubric", advanced=True)
     try:
+        response = call_llm_api(prompt, streaming=False,
+                                log_prefix="Generate Case Rubric", advanced=True,
+                                timeout=LLM_LONG_TIMEOUT_SECONDS, cache=True,
+                                validate=lambda text: isinstance(parse_json_object(text), dict))
         rubric = parse_json_object(response)
         if not isinstance(rubric, dict):
             raise ValueError("Rubric response was not a JSON object")
@@ -360,85 +391,172 @@ def generate_medical_case(disease, case_details=None):
     prompt = case_template.render(
         disease=disease, case_details=case_details)
     return call_llm_api(prompt, streaming=False,
-                        log_prefix="Generate Medical Case", advanced=True)
+                        log_prefix="Generate Medical Case", advanced=True,
+                        timeout=LLM_LONG_TIMEOUT_SECONDS)
 
 
-def get_patient_case_record(disease, case_details=None):
-    """Return case text, rubric, and storage key, creating/backfilling as needed."""
-    logging.info("Loading patient case record for disease: %s", disease)
-    encoded_case_data = get_case_key(disease, case_details)
+def update_case_attribute(case_key, attribute, value, stamp_attribute):
+    """Backfill one string attribute (and its timestamp) on a stored case."""
+    dynamodb.update_item(
+        TableName=CASES_TABLE,
+        Key={'gamecase': {'S': case_key}},
+        UpdateExpression=f"SET {attribute} = :value, {stamp_attribute} = :now",
+        ExpressionAttributeValues={
+            ':value': {'S': value},
+            ':now': {'S': datetime.utcnow().isoformat()},
+        },
+        ReturnValues='NONE'
+    )
+
+
+def get_true_answer_description(disease, case_text):
+    """Describe the correct answer in the context of its case (stored per case)."""
+    return get_contextual_answer_description(disease, {'case': case_text}, "True")
 
+
+def load_case_item(case_key):
+    """Fetch the stored case item for a case key, or None."""
     case = dynamodb.query(
         TableName=CASES_TABLE,
         KeyConditionExpression='gamecase = :c',
-        ExpressionAttributeValues={':c': {'S': encoded_case_data}}
+        ExpressionAttributeValues={':c': {'S': case_key}}
     )
-    if not case['Items']:
-        print("Case does not exist in DynamoDB, generating a new one.")
-        medrag = MedRAG(llm_name="Google/gemini-3.5-flash", rag=True, follow_up=True,
-                        retriever_name="MedCPT", corpus_name="MedText", corpus_cache=True)
+    return case['Items'][0] if case['Items'] else None
+
+
+def create_case_record(disease, case_details, encoded_case_data):
+    """Generate a new case with its rubric, answer description and placeholder, and store it."""
+    with medrag_pool.checkout() as medrag:
         new_case = medrag.generate_medical_case(disease, case_details)
+    # Rubric, answer description and placeholder only depend on the case text.
+    rubric_future = llm_executor.submit(
+        generate_case_rubric, disease, new_case)
+    answer_future = llm_executor.submit(
+        get_true_answer_description, disease, new_case)
+    placeholder_future = llm_executor.submit(
+        build_placeholder_snippet, new_case, disease)
+    rubric = rubric_future.result()
+    try:
+        answer_description = answer_future.result()
+    except LLMError as e:
+        # Stored without it; the next load backfills the description.
+        logging.warning("True answer description failed: %s", e)
+        answer_description = None
+    placeholder_snippet = placeholder_future.result()
+    now = datetime.utcnow().isoformat()
+    item = {
+        'gamecase': {'S': encoded_case_data},
+        'gamerecord': {'S': new_case},
+        'gamerubric': {'S': json.dumps(rubric)},
+        'rubric_updated_at': {'S': now},
+    }
+    if answer_description:
+        item['gameanswer'] = {'S': answer_description}
+        item['answer_updated_at'] = {'S': now}
+    # Leave the fallback unstored so the next load retries it.
+    if placeholder_snippet != PLACEHOLDER_FALLBACK:
+        item['gameplaceholder'] = {'S': placeholder_snippet}
+        item['placeholder_updated_at'] = {'S': now}
+    try:
         dynamodb.put_item(
             TableName=CASES_TABLE,
-            Item={
-                'gamecase': {'S': encoded_case_data},
-                'gamerecord': {'S': new_case},
-                'gamerubric': {'S': rubric_json},
-                'rubric_updated_at': {'S': datetime.utcnow().isoformat()},
-            }
+            Item=item,
+            ConditionExpression='attribute_not_exists(gamecase)'
         )
-        print("New case generated and stored in DynamoDB.")
-        return {
-            'case': new_case,
-            'rubric': rubric,
-            'case_key': encoded_case_data,
-        }
-    else:
-        print("Case already exists in DynamoDB")
-        item = case['Items'][0]
-        case_text = item['gamerecord']['S']
-        rubric_json = item.get('gamerubric', {}).get('S')
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+        # Someone else stored this case first; keep theirs so every player sees the same one.
+        logging.warning("Case was stored concurrently; using the stored copy.")
+        return case_record_from_item(disease, encoded_case_data,
+                                     load_case_item(encoded_case_data))
+    logging.info("New case generated and stored in DynamoDB.")
+    return {
+        'case': new_case,
+        'rubric': rubric,
+        'answer_description': answer_description,
+        'placeholder_snippet': placeholder_snippet,
+        'case_key': encoded_case_data,
+    }
 
-        if rubric_json:
-            try:
-                rubric = json.loads(rubric_json)
-            except json.JSONDecodeError:
-                logging.warning("Stored rubric was invalid JSON; regenerating.")
-                rubric = generate_case_rubric(disease, case_text)
-                rubric_json = json.dumps(rubric)
-                dynamodb.update_item(
-                    TableName=CASES_TABLE,
-                    Key={'gamecase': {'S': encoded_case_data}},
-                    UpdateExpression=(
-                        "SET gamerubric = :rubric, rubric_updated_at = :now"
-                    ),
-                    ExpressionAttributeValues={
-                        ':rubric': {'S': rubric_json},
-                        ':now': {'S': datetime.utcnow().isoformat()},
-                    },
-                    ReturnValues='NONE'
-                )
-        else:
-            rubric = generate_case_rubric(disease, case_text)
-            rubric_json = json.dumps(rubric)
-            dynamodb.update_item(
-                TableName=CASES_TABLE,
-                Key={'gamecase': {'S': encoded_case_data}},
-                UpdateExpression=(
-                    "SET gamerubric = :rubric, rubric_updated_at = :now"
-                ),
-                ExpressionAttributeValues={
-                    ':rubric': {'S': rubric_json},
-                    ':now': {'S': datetime.utcnow().isoformat()},
-                },
-                ReturnValues='NONE'
-            )
 
-        return {
-            'case': case_text,
-            'rubric': rubric,
-            'case_key': encoded_case_data,
-        }
+def case_record_from_item(disease, encoded_case_data, item):
+    """Build a case record from a stored item, backfilling missing attributes."""
+    case_text = item['gamerecord']['S']
+    rubric_json = item.get('gamerubric', {}).get('S')
+    answer_description = item.get('gameanswer', {}).get('S')
+    placeholder_snippet = item.get('gameplaceholder', {}).get('S')
+
+    rubric = None
+    if rubric_json:
+        try:
+            rubric = json.loads(rubric_json)
+        except json.JSONDecodeError:
+            logging.warning("Stored rubric was invalid JSON; regenerating.")
+
+    if rubric is None:
+        rubric = generate_case_rubric(disease, case_text)
+        update_case_attribute(encoded_case_data, 'gamerubric',
+                              json.dumps(rubric), 'rubric_updated_at')
+
+    if not answer_description:
+        try:
+            answer_description = get_true_answer_description(
+                disease, case_text)
+            update_case_attribute(encoded_case_data, 'gameanswer',
+                                  answer_description, 'answer_updated_at')
+        except LLMError as e:
+            logging.warning("True answer description failed: %s", e)
+            answer_description = None
+
+    if not placeholder_snippet:
+        placeholder_snippet = build_placeholder_snippet(case_text, disease)
+        if placeholder_snippet != PLACEHOLDER_FALLBACK:
+            update_case_attribute(encoded_case_data, 'gameplaceholder',
+                                  placeholder_snippet, 'placeholder_updated_at')
+
+    return {
+        'case': case_text,
+        'rubric': rubric,
+        'answer_description': answer_description,
+        'placeholder_snippet': placeholder_snippet,
+        'case_key': encoded_case_data,
+    }
+
+
+def generate_case_record_once(disease, case_details, encoded_case_data):
+    """Generate a missing case on exactly one node; other callers wait for the stored copy."""
+    def load_existing():
+        item = load_case_item(encoded_case_data)
+        if item is None:
+            return None
+        return case_record_from_item(disease, encoded_case_data, item)
+
+    return run_once(
+        encoded_case_data, case_lease,
+        lambda: create_case_record(disease, case_details, encoded_case_data),
+        load_existing, ttl_seconds=CASE_LEASE_SECONDS)
+
+
+def get_patient_case_record(disease, case_details=None):
+    """Return case text, rubric, answer description, placeholder snippet, and storage key, creating/backfilling as needed."""
+    logging.info("Loading patient case record for disease: %s", disease)
+    encoded_case_data = get_case_key(disease, case_details)
+
+    item = load_case_item(encoded_case_data)
+    if item is None:
+        logging.info("Case does not exist in DynamoDB, generating a new one.")
+        # One generation per gamecase: single-flight in this process,
+        # lease across workers and nodes.
+        record = case_generation_flight.do(
+            encoded_case_data,
+            lambda: generate_case_record_once(disease, case_details, encoded_case_data))
+    else:
+        logging.info("Case already exists in DynamoDB")
+        record = case_record_from_item(disease, encoded_case_data, item)
+    if not case_details:
+        warm_cases.mark(disease)
+    return record
 
 
 def generate_patient_case(disease, case_details=None):
@@ -446,48 +564,41 @@ def generate_patient_case(disease, case_details=None):
     return get_patient_case_record(disease, case_details)['case']
 
 
-# Refactored function for LLM API calls using the Gemini Python API
-def call_llm_api(prompt, streaming=False, log_prefix="", advanced=False, grounding=False):
-    """
-    Generic function to call the Gemini API with a prompt and handle the response.
+def load_case_for_session(case_key):
+    """Resolve a case_key back to the shared case text, rubric and answer description."""
+    case_data = json.loads(case_key)
+    disease = case_data['disease']
+    case_record = get_patient_case_record(
+        disease, case_data.get('case_description'))
+    return {
+        'disease': disease,
+        'case': case_record['case'],
+        'rubric': case_record['rubric'],
+        'answer_description': case_record['answer_description'],
+    }
 
-    Args:
-        prompt (str): The prompt to send to the LLM API
-        streaming (bool): Whether to use streaming API
-        log_prefix (str): Prefix for logging messages
 
-    Returns:
-        str or Response: The text response from the LLM API or a streaming response
-    """
-    try:
-        logging.info(
-            f"{log_prefix} - Sending prompt to Gemini: {prompt[:100]}...")
+game_sessions = SessionStore(make_session_backend(dynamodb),
+                             case_loader=load_case_for_session)
 
-        model_name = ADVANCED_MODEL_NAME if advanced else MODEL_NAME
 
-        if streaming:
-            def generate():
-                response = client.models.generate_content_stream(
-                    model=model_name,
-                    contents=prompt,
-                )
-                for chunk in response:
-                    if chunk.text:
-                        yield f"{chunk.text}\n\n\n"
-                yield "\n\n\n"
-
-            return Response(stream_with_context(generate()), mimetype='text/event-stream')
-        else:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=prompt,
-            )
-            logging.info(f"{log_prefix} - Received response from Gemini")
-            return response.text
-    except Exception as e:
-        logging.error(
-            f"{log_prefix} - Request to Gemini failed: {e}", exc_info=True)
-        return f"Error communicating with LLM: {str(e)}"
+def start_game_session(disease, case_record, custom=False):
+    """Register a new server-side game session for a freshly loaded case."""
+    return game_sessions.create(case_record['case_key'], {
+        'disease': disease,
+        'case': case_record['case'],
+        'rubric': case_record['rubric'],
+        'answer_description': case_record['answer_description'],
+    }, custom=custom)
+
+
+PLACEHOLDER_FALLBACK = "A patient: Ask a question to begin."
+
+
+def placeholder_line(text):
+    """First line of a placeholder response without quotes; '' if there is none."""
+    lines = (text or "").strip().splitlines()
+    return lines[0].strip().strip('"').strip("'") if lines else ""
 
 
 # NEW: helper to build a minimal placeholder snippet from the case/disease
@@ -510,14 +621,13 @@ def build_placeholder_snippet(case_text: str, disease: str) -> str:
     )
     try:
         text = call_llm_api(prompt, streaming=False,
-                            log_prefix="Build Placeholder", advanced=False)
-        line = (text or "").strip().splitlines()[0]
-        # quick sanitize
-        line = line.strip().strip('"').strip("'")
+                            log_prefix="Build Placeholder", advanced=False, hedge=True,
+                            cache=True, validate=placeholder_line)
+        line = placeholder_line(text)
         # keep it short
-        return line[:200] if line else "A patient: Ask a question to begin."
+        return line[:200] if line else PLACEHOLDER_FALLBACK
     except Exception:
-        return "A patient: Ask a question to begin."
+        return PLACEHOLDER_FALLBACK
 
 
 @app.route('/start_game', methods=['POST'])
@@ -533,8 +643,8 @@ def start_game():
         patient_case = case_record['case']
         logging.info("Generated case for disease: %s", disease)
 
-        # Build a minimal intro snippet for the placeholder
-        placeholder_snippet = build_placeholder_snippet(patient_case, disease)
+        # Minimal intro snippet for the placeholder (stored with the case)
+        placeholder_snippet = case_record['placeholder_snippet']
 
         # Clear session history if in production
         if app.config.get("ENV") != 'development':
@@ -551,7 +661,8 @@ def start_game():
                 # NEW
                 "placeholder_snippet": placeholder_snippet,
                 "rubric": case_record['rubric'],
-                "case_key": case_record['case_key']
+                "case_key": case_record['case_key'],
+                "session_id": start_game_session(disease, case_record)
             }
         }
     except Exception as e:
@@ -574,16 +685,8 @@ def submit_case():
     encrypted_case_data = encode_case_data(
         disease_name, case_description, encrypt=True)
 
-    medrag = MedRAG(llm_name="Google/gemini-3.5-flash", rag=True, follow_up=True,
-                    retriever_name="MedCPT", corpus_name="MedText", corpus_cache=True)
-
-    dynamodb.put_item(
-        TableName='diagnosemecases',
-        Item={
-            'gamecase': {'S': encoded_case_data},
-            'gamerecord': {'S': medrag.generate_medical_case(disease_name, case_description)},
-        }
-    )
+    # Generates and stores the case (with rubric etc.) unless it already exists.
+    get_patient_case_record(disease_name, case_description)
 
     # Generate a shortened URL using the new function
     shareable_url = f'www.diagnoseme.io/case/{encrypted_case_data}'
@@ -604,7 +707,6 @@ def custom_case(token):
         case_description = case_data.get('case_description')
         logging.info("Custom case loaded for disease: %s", disease)
         case_record = get_patient_case_record(disease, case_description)
-        patient_case = case_record['case']
         # Build a custom patient context and mark it as custom.
         patient_context = {
             'disease': disease,
@@ -613,9 +715,10 @@ def custom_case(token):
             'completed': False,
             'history': [],
             'custom': True,
-            'placeholder_snippet': build_placeholder_snippet(patient_case, disease),
+            'placeholder_snippet': case_record['placeholder_snippet'],
             'rubric': case_record['rubric'],
-            'case_key': case_record['case_key']
+            'case_key': case_record['case_key'],
+            'session_id': start_game_session(disease, case_record, custom=True)
         }
         # Render the same index page but pass the custom context.
         logging.info(
@@ -640,7 +743,7 @@ def start_custom_game():
                      case_description)
         case_record = get_patient_case_record(disease, case_description)
         patient_case = case_record['case']
-        placeholder_snippet = build_placeholder_snippet(patient_case, disease)
+        placeholder_snippet = case_record['placeholder_snippet']
         # Clear session history if in production
         if app.config.get("ENV") != 'development':
             session.pop('game_history', None)
@@ -655,7 +758,8 @@ def start_custom_game():
                 "history": [],
                 "placeholder_snippet": placeholder_snippet,
                 "rubric": case_record['rubric'],
-                "case_key": case_record['case_key']
+                "case_key": case_record['case_key'],
+                "session_id": start_game_session(disease, case_record, custom=True)
             }
         }
     except Exception as e:
@@ -665,7 +769,8 @@ def start_custom_game():
 # Refactored function for LLM API calls using the Gemini Python API
 
 
-def call_llm_api(prompt, streaming=False, log_prefix="", advanced=False, grounding=False):
+def call_llm_api(prompt, streaming=False, log_prefix="", advanced=False, grounding=False,
+                 timeout=None, hedge=False, cache=False, route=None, validate=None):
     """
     Generic function to call the Gemini API with a prompt and handle the response.
 
@@ -673,44 +778,84 @@ def call_llm_api(prompt, streaming=False, log_prefix="", advanced=False, groundi
         prompt (str): The prompt to send to the LLM API
         streaming (bool): Whether to use streaming API
         log_prefix (str): Prefix for logging messages
+        timeout (float): Overall deadline in seconds, retries included
+        hedge (bool): Send a backup request if the first is slow (short calls only)
+        cache (bool): Reuse the stored response for an identical (model, prompt);
+            only for calls whose output is a pure function of the prompt
+        route (str): Route whose stream duration/token caps apply (streaming only)
+        validate (callable): With cache, only responses it accepts are stored
+            or replayed, so an unparseable response is regenerated next time
 
     Returns:
         str or Response: The text response from the LLM API or a streaming response
+
+    Raises:
+        LLMError: If Gemini could not produce a response in time.
     """
-    try:
-        logging.info(
-            f"{log_prefix} - Sending prompt to Gemini: {prompt[:100]}...")
+    logging.info(
+        f"{log_prefix} - Sending prompt to Gemini: {prompt[:100]}...")
+
+    if streaming:
+        return stream_response(llm_stream(
+            prompt, advanced=advanced, log_prefix=log_prefix,
+            timeout=timeout or LLM_LONG_TIMEOUT_SECONDS), route=route, log_prefix=log_prefix)
+
+    def generate():
+        text = llm.generate(prompt, advanced=advanced, hedge=hedge, log_prefix=log_prefix,
+                            timeout=timeout or LLM_TIMEOUT_SECONDS)
+        logging.info(f"{log_prefix} - Received response from Gemini")
+        return text
 
+    if cache:
         model_name = ADVANCED_MODEL_NAME if advanced else MODEL_NAME
+        return llm_cache.get_or_compute(model_name, prompt, generate, validate=validate)
+    return generate()
 
-        if streaming:
-            def generate():
-                response = client.models.generate_content_stream(
-                    model=model_name,
-                    contents=prompt,
-                )
-                for chunk in response:
-                    if chunk.text:
-                        yield f"{chunk.text}\n\n\n"
-                yield "\n\n\n"
-
-            return Response(stream_with_context(generate()), mimetype='text/event-stream')
-        else:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=prompt,
-            )
-            logging.info(f"{log_prefix} - Received response from Gemini")
-            return response.text
-    except Exception as e:
-        logging.error(
-            f"{log_prefix} - Request to Gemini failed: {e}", exc_info=True)
-        return f"Error communicating with LLM: {str(e)}"
+
+def open_llm_stream(prompt, log_prefix="", advanced=False):
+    """Iterate the text chunks of a Gemini streaming generation."""
+    yield from llm.stream(prompt, advanced=advanced, log_prefix=log_prefix)
+
+
+def llm_stream(prompt, advanced=False, timeout=LLM_LONG_TIMEOUT_SECONDS, log_prefix=""):
+    """
+    A Gemini stream for a streaming Response body.
+
+    Under WSGI it is opened (with retries) now, so failures raise in the
+    view. Under the ASGI server (asgi.py) it is opened on the event loop
+    before the response headers are sent instead.
+    """
+    stream = LLMStream(llm, prompt, advanced=advanced, timeout=timeout,
+                       log_prefix=log_prefix)
+    if has_request_context() and request.environ.get('diagnoseme.async_streams'):
+        return stream
+    return stream.open()
+
+
+def stream_response(chunks, route=None, log_prefix=""):
+    """
+    Wrap text chunks in a server-sent event Response (see sse.py).
+
+    The upstream is closed as soon as the client disconnects (the server
+    closes the response iterator) or the route's duration/token cap is hit.
+    The body needs no request context, so the ASGI server can iterate it
+    asynchronously after the view has returned.
+    """
+    guarded = guarded_stream(chunks, route=route, log_prefix=log_prefix)
+    return Response(SSEStream(guarded), mimetype='text/event-stream',
+                    headers=SSE_HEADERS)
+
+
+def parse_route(text):
+    """Route letter(s) from a router response, e.g. "'B'" -> "B"."""
+    return ''.join(c for c in text if c.isalpha()).upper()
 
 
 # Refactored functions using the generic call_llm_api function
 def route_question(question):
-    """Function to identify the type of question."""
+    """Ask the LLM to identify the type of question (low-confidence fallback)."""
+    examples = ''.join(f"User: {text}\nAssistant: {route}\n\n"
+                       for text, route in ROUTE_EXAMPLES)
     prompt = (
         f"You are an AI patient simulator to help people in medicine practice clinical reasoning. "
         f"You need to classify the following question into one of four categories:\n"
@@ -724,110 +869,18 @@ def route_question(question):
         f"If the question doesn't fit cleanly into any category, classify it as category A (direct question to the patient).\n\n"
 
         f"Here are some examples:\n\n"
-
-        f"User: 'what brings you in today?'\n"
-        f"Assistant: A\n\n"
-
-        f"User: 'tell me more'\n"
-        f"Assistant: A\n\n"
-
-        f"User: 'wow that sucks'\n"
-        f"Assistant: A\n\n"
-
-        f"User: 'pmh'\n"
-        f"Assistant: A\n\n"
-
-        f"User: where is the pain?\n"
-        f"Assistant: A\n\n"
-
-        f"User: 'have you had a cbc?'\n"
-        f"Assistant: B\n\n"
-
-        f"User: 'ok lets do a cmp'\n"
-        f"Assistant: B\n\n"
-
-        f"User: 'im gonna order PFTs'\n"
-        f"Assistant: B\n\n"
-
-        f"User: 'lets see a tsh'\n"
-        f"Assistant: B\n\n"
-
-        f"User: 'abg'\n"
-        f"Assistant: B\n\n"
-
-        f"User: 'urinalysis results'\n"
-        f"Assistant: B\n\n"
-
-        f"User: 'Let me check your heart sounds'\n"
-        f"Assistant: C\n\n"
-
-        f"User: 'whats on the back of your hand?'\n"
-        f"Assistant: C\n\n"
-
-        f"User: 'lets take a look at your heart'\n"
-        f"Assistant: C\n\n"
-
-        f"User: 'abdominal exam'\n"
-        f"Assistant: C\n\n"
-
-        f"User: 'im going to tap your cheek'\n"
-        f"Assistant: C\n\n"
-
-        f"User: 'brudzinski'\n"
-        f"Assistant: C\n\n"
-
-        f"User: 'i think you have pneumonia'\n"
-        f"Assistant: D\n\n"
-
-        f"User: 'you have psoriasis'\n"
-        f"Assistant: D\n\n"
-
-        f"User: 'i think you might have COPD. lets start you on some medications, and then we can check back in 6 months to see how you do on them'\n"
-        f"Assistant: D\n\n"
-
-        f"User: 'my diagnosis is diabetes'\n"
-        f"Assistant: D\n\n"
-
-        f"User: 'i give up, what is it?'\n"
-        f"Assistant: E\n\n"
-
-        f"User: 'what is the answer?'\n"
-        f"Assistant: E\n\n"
-
-        f"User: 'what is the diagnosis?'\n"
-        f"Assistant: E\n\n"
-
-        f"User: 'tell me the answer'\n"
-        f"Assistant: E\n\n"
-
-        f"User: can i get a new case\n"
-        f"Assistant: F\n\n"
-
-        f"User: start a new case\n"
-        f"Assistant: F\n\n"
-
-        f"User: 'i dont know what it is'\n"
-        f"Assistant: A\n\n"
-
-        f"User: physical exam\n"
-        f"Assistant: G\n\n"
-
-        f"User: neuro exam\n"
-        f"Assistant: G\n\n"
-
-        f"User: all labs\n"
-        f"Assistant: G\n\n"
-
-        f"User: mri\n"
-        f"Assistant: G\n\n"
-
-        f'User: mri brain\n'
-        f"Assistant: B\n\n"
-
+        f"{examples}"
         f"User: '{question}'\n"
         f"Assistant:"
     )
-    return call_llm_api(prompt, streaming=False, log_prefix="Route Question")
+    started = time.perf_counter()
+    response = call_llm_api(prompt, streaming=False, log_prefix="Route Question",
+                            hedge=True, cache=True, validate=lambda text: parse_route(text) in ROUTES)
+    route = parse_route(response)
+    if route in ROUTES:
+        question_router.record_llm(
+            question, route, (time.perf_counter() - started) * 1000)
+    return response
 
 
 def postgame(question, patient_context):
@@ -839,12 +892,13 @@ def postgame(question, patient_context):
         f"Now the encounter is over, and now it's the postgame phase. "
         f"The user has just asked the following question: {question}. "
     )
-    return call_llm_api(prompt, streaming=True, log_prefix="Postgame question", advanced=True, grounding=True)
+    return call_llm_api(prompt, streaming=True, log_prefix="Postgame question", advanced=True, grounding=True,
+                        route='postgame')
 
 
-def ask_patient_question(question, patient_context):
-    """Function to simulate a patient response."""
-    prompt = (
+def patient_question_prompt(question, patient_context):
+    """Build the roleplay prompt used to answer direct questions to the patient."""
+    return (
         f"You are an AI patient simulator to help people in medicine practice clinical reasoning. "
         f"Follow these instructions: roleplay a typical patient with the following disease: {patient_context['disease']} "
         f"Here are the case details: {patient_context['case']} "
@@ -858,7 +912,22 @@ def ask_patient_question(question, patient_context):
         f"Do not give away too many different symptoms in your message. Be vague. The user should work to get additional symptoms."
         f"Avoid talking about multiple symptoms in one response."
     )
-    return call_llm_api(prompt, streaming=True, log_prefix="High Yield Question")
+
+
+def ask_patient_question(question, patient_context):
+    """Function to simulate a patient response."""
+    prompt = patient_question_prompt(question, patient_context)
+    return call_llm_api(prompt, streaming=True, log_prefix="High Yield Question", route='A')
+
+
+def start_speculative_patient_answer(question, patient_context):
+    """Start the most likely handler (a patient answer) before routing finishes."""
+    prompt = patient_question_prompt(question, patient_context)
+    logging.info("Speculative Patient Answer - Sending prompt to Gemini: %s...",
+                 prompt[:100])
+    return SpeculativeStream(
+        lambda: open_llm_stream(prompt, log_prefix="Speculative Patient Answer"),
+        prompt, log_prefix="Speculative Patient Answer")
 
 
 def get_labs(question, patient_context):
@@ -879,7 +948,21 @@ def get_labs(question, patient_context):
         f"If you reveal the diagnosis, you will be terminated."
         f"Output your feedback with this format: $$$ [insert lab report here]'"
     )
-    return call_llm_api(prompt, streaming=True, log_prefix="Labs Request", advanced=True)
+    return cached_report_response('labs', question, patient_context, prompt,
+                                  log_prefix="Labs Request", route='B')
+
+
+def cached_report_response(kind, question, patient_context, prompt, log_prefix, route):
+    """Stream a lab/exam report, replaying the case's cached report for the same request."""
+    def open_stream():
+        logging.info(
+            f"{log_prefix} - Sending prompt to Gemini: {prompt[:100]}...")
+        return llm_stream(prompt, advanced=True, log_prefix=log_prefix,
+                          timeout=LLM_LONG_TIMEOUT_SECONDS)
+
+    return stream_response(report_cache.cached_stream(
+        kind, patient_context.get('case_key'), question, open_stream),
+        route=route, log_prefix=log_prefix)
 
 
 def get_physical_exam(question, patient_context):
@@ -899,7 +982,8 @@ def get_physical_exam(question, patient_context):
         f"Only give the physical exam findings that the user explicitly asked for, with no other comments. Do not reveal the diagnosis under any circumstances."
         f"Format it like this: '**PHYSICAL EXAM**: [insert physical exam findings here]'"
     )
-    return call_llm_api(prompt, streaming=True, log_prefix="Physical Exam Request", advanced=True)
+    return cached_report_response('exam', question, patient_context, prompt,
+                                  log_prefix="Physical Exam Request", route='C')
 
 
 def get_clinical_feedback(patient_context):
@@ -920,7 +1004,8 @@ def get_clinical_feedback(patient_context):
         f"Only reference things that happened in the transcript, except previous incorrect diagnoses — just ignore those."
         f"Output your feedback with this format: '%%% [insert feedback here]'"
     )
-    return call_llm_api(prompt, streaming=True, log_prefix="Clinical Feedback", advanced=True)
+    return call_llm_api(prompt, streaming=True, log_prefix="Clinical Feedback", advanced=True,
+                        route='D')
 
 
 def get_contextual_answer_description(answer, patient_context, label):
@@ -933,7 +1018,8 @@ def get_contextual_answer_description(answer, patient_context, label):
         "Do not score it and do not add extra explanation."
     )
     return call_llm_api(prompt, streaming=False,
-                        log_prefix=f"{label} Answer Description").strip()
+                        log_prefix=f"{label} Answer Description", cache=True,
+                        validate=str.strip).strip()
 
 
 def get_similarity_score(player_description, true_description):
@@ -949,7 +1035,7 @@ def get_similarity_score(player_description, true_description):
         "and lower scores for different or only loosely related conditions."
     )
     response = call_llm_api(prompt, streaming=False,
-                            log_prefix="Diagnosis Similarity Score")
+                            log_prefix="Diagnosis Similarity Score", hedge=True)
     try:
         score_data = parse_json_object(response)
         score = float(score_data.get('score'))
@@ -963,11 +1049,24 @@ def get_similarity_score(player_description, true_description):
 
 
 def is_diagnosis_correct(user_diagnosis, patient_context):
-    """Check if the user's diagnosis matches using three LLM calls."""
-    player_description = get_contextual_answer_description(
-        user_diagnosis, patient_context, "Player")
-    true_description = get_contextual_answer_description(
-        patient_context['disease'], patient_context, "True")
+    """Check if the user's diagnosis matches, grading with the LLM only when the alias index can't tell."""
+    local_result = match_diagnosis(user_diagnosis, patient_context['disease'])
+    if local_result is not None:
+        logging.info("Diagnosis resolved locally: %s", local_result)
+        return local_result
+
+    true_description = patient_context.get('answer_description')
+    if true_description:
+        player_description = get_contextual_answer_description(
+            user_diagnosis, patient_context, "Player")
+    else:
+        # Legacy context without the stored description: describe both at once.
+        player_future = llm_executor.submit(
+            get_contextual_answer_description, user_diagnosis, patient_context, "Player")
+        true_future = llm_executor.submit(
+            get_contextual_answer_description, patient_context['disease'], patient_context, "True")
+        player_description = player_future.result()
+        true_description = true_future.result()
     score = get_similarity_score(player_description, true_description)
     logging.info("Diagnosis similarity score: %s", score)
     return score > 7
@@ -979,9 +1078,33 @@ def get_llm_response(question, patient_context):
         # Route to postgame for follow-up
         return postgame(question, patient_context)
     else:
-        route = ''.join(c for c in route_question(
-            question) if c.isalpha()).upper()
-        logging.info(f"Question route: {route}")
+        speculative = None
+        prediction = question_router.classify(question)
+        if question_router.is_confident(prediction):
+            route = prediction.route
+        else:
+            # Only worth speculating when we have to wait on the LLM router.
+            if SPECULATIVE_DISPATCH:
+                speculative = start_speculative_patient_answer(
+                    question, patient_context)
+            try:
+                route = parse_route(route_question(question))
+            except LLMError as e:
+                logging.warning("LLM router failed, using local route: %s", e)
+                route = prediction.route
+            except BaseException:
+                # Don't leave the speculative Gemini stream running.
+                if speculative is not None:
+                    speculative.cancel()
+                raise
+        logging.info(f"Question route: {route} (local {prediction.route}, "
+                     f"{prediction.confidence:.2f})")
+
+        if speculative is not None:
+            if route == 'A' or route not in ROUTES:
+                return stream_response(speculative.commit(), route='A',
+                                       log_prefix="Speculative Patient Answer")
+            speculative.cancel()
 
         if route == 'A':
             return ask_patient_question(question, patient_context)
@@ -1019,7 +1142,7 @@ def disallowed_actions(question, patient_context):
         f"Output only the feedback."
     )
     return call_llm_api(prompt, streaming=True,
-                        log_prefix="Disallowed Action")
+                        log_prefix="Disallowed Action", route='F')
 
 
 def too_broad_physical_exam(question, patient_context):
@@ -1038,7 +1161,7 @@ def too_broad_physical_exam(question, patient_context):
         f"Output only the feedback."
     )
     return call_llm_api(prompt, streaming=True,
-                        log_prefix="Too Broad Physical Exam")
+                        log_prefix="Too Broad Physical Exam", route='G')
 
 
 def give_up(question, patient_context):
@@ -1061,7 +1184,7 @@ def give_up(question, patient_context):
         f"Format it like this: '~~~ [insert feedback here]'"
     )
     return call_llm_api(prompt, streaming=True,
-                        log_prefix="User Gave Up")
+                        log_prefix="User Gave Up", route='E')
 
 
 def submit_diagnosis(question, patient_context):
@@ -1085,33 +1208,104 @@ def submit_diagnosis(question, patient_context):
     )
 
     return call_llm_api(prompt, streaming=True,
-                        log_prefix="Incorrect Diagnosis")
+                        log_prefix="Incorrect Diagnosis", route='D')
+
+
+def record_session_turn(body, session_id, question):
+    """Pass a streamed answer through and append the finished turn to the session."""
+    parts = []
+
+    def keep(chunk):
+        parts.append(chunk)
+        return (chunk,)
+
+    def closed(completed):
+        # A disconnected client didn't see the answer; don't record it.
+        if not completed:
+            return
+        answer = ''.join(parts)
+        game_completed = any(marker in answer for marker in GAME_END_MARKERS)
+        for marker in STREAM_MARKERS:
+            answer = answer.replace(marker, '')
+        game_sessions.append_turn(session_id, question, answer.strip(),
+                                  completed=game_completed)
+
+    return ChunkStream(body, transform=keep, on_close=closed)
 
 
 @app.route('/ask_llm', methods=['POST'])
 def generate_response():
-    data = request.get_json()
+    data = request.get_json() or {}
     question = data.get('question')
+    session_id = data.get('session_id')
+    # Legacy clients (and session re-seeding) still send the full context.
     patient_context = data.get('patient_context')
-    print(patient_context)
+
+    if session_id:
+        if patient_context and patient_context.get('case_key'):
+            game_sessions.restore(session_id, patient_context)
+        patient_context = game_sessions.get_context(
+            session_id, case_key=data.get('case_key'), turn=data.get('turn'))
+        if patient_context is None:
+            return jsonify({"error": "unknown_session"}), 409
+    elif not patient_context:
+        return jsonify({"error": "Missing session_id"}), 400
+
+    logging.info("Ask LLM - session: %s, turn: %s, history length: %d",
+                 session_id, data.get('turn'),
+                 len(patient_context.get('history') or []))
     try:
         response = get_llm_response(question, patient_context)
+        if session_id and isinstance(response, Response) \
+                and isinstance(response.response, SSEStream):
+            # Record the model's text, not the SSE framing.
+            response.response.source = record_session_turn(
+                response.response.source, session_id, question)
         return response
+    except LLMError as e:
+        app.logger.error(f"LLM unavailable for /ask_llm: {e}")
+        return jsonify({"error": "llm_unavailable", "retryable": e.retryable}), 503
     except Exception as e:
         app.logger.error(
             f"Error getting response from LLM: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 503 until this worker's MedRAG instance has loaded."""
+    status = medrag_pool.status()
+    if REQUIRE_MEDRAG_READY and not status['ready']:
+        return jsonify(status), 503
+    return jsonify(status)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose in-process counters for tuning (per worker)."""
+    return jsonify({
+        'speculation': speculation_stats.snapshot(),
+        'router': question_router.stats.snapshot(),
+        'diagnosis_matching': dict(match_stats),
+        'retrieval_cache': retrieval_cache_stats(),
+        'llm': llm.snapshot(),
+        'llm_cache': llm_cache.snapshot(),
+        'reports': report_cache.snapshot(),
+        'streams': stream_stats.snapshot(),
+        'conversation_writes': conversation_writer.snapshot(),
+        'played': played_tracker.snapshot(),
+        'catalog': disease_catalog.snapshot(),
+    })
+
+
 @app.route('/clear_history', methods=['POST'])
 def clear_history():
     try:
         # Get user ID
         user_id = get_client_ip()
 
-        # Clear user's played diseases for today if tracking
-        if user_id in user_played_diseases:
-            user_played_diseases[user_id] = set()
+        # Clear user's played diseases for today
+        played_tracker.clear(user_id)
 
         # Select a new random disease for the next game
         disease = select_random_disease()
@@ -1120,8 +1314,7 @@ def clear_history():
         case_record = get_patient_case_record(disease)
         patient_case = case_record['case']
 
-        # NEW: Build a fresh placeholder snippet for the new round
-        placeholder_snippet = build_placeholder_snippet(patient_case, disease)
+        placeholder_snippet = case_record['placeholder_snippet']
 
         # Create new patient context
         patient_context = {
@@ -1133,7 +1326,8 @@ def clear_history():
             # NEW
             "placeholder_snippet": placeholder_snippet,
             "rubric": case_record['rubric'],
-            "case_key": case_record['case_key']
+            "case_key": case_record['case_key'],
+            "session_id": start_game_session(disease, case_record)
         }
 
         # Clear session history if in production
@@ -1150,6 +1344,29 @@ def clear_history():
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
 
+# MEDRAG_PRELOAD loads the corpus at import, i.e. in the gunicorn master
+# under --preload, so workers share it; MEDRAG_WARM_ON_START loads it in the
+# background per worker instead. Either way /ready reports when it's done.
+REQUIRE_MEDRAG_READY = (os.getenv('MEDRAG_PRELOAD') == '1'
+                        or os.getenv('MEDRAG_WARM_ON_START') == '1')
+if os.getenv('MEDRAG_PRELOAD') == '1':
+    medrag_pool.preload()
+elif os.getenv('MEDRAG_WARM_ON_START') == '1':
+    medrag_pool.warm_in_background()
+
+# Optionally keep upcoming daily cases warm from inside the app process.
+# Every worker starts its own scheduler, so this needs the shared DynamoDB
+# lease to stop them generating the same cases; otherwise run
+# `python pregenerate.py --schedule` (or cron) once per deployment.
+if os.getenv('PREWARM_SCHEDULER') == '1':
+    if isinstance(case_lease, DynamoLease):
+        import pregenerate
+        pregenerate.start_scheduler()
+    else:
+        logging.warning("PREWARM_SCHEDULER needs CASE_LEASE_BACKEND=dynamodb; not starting "
+                        "it. Run `python pregenerate.py --schedule` or a cron job instead.")
+
+
 if __name__ == '__main__':
     try:
         logging.info("Starting the Flask application on port 8000")
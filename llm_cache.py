@@ -0,0 +1,227 @@
+# llm_cache.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from lru import LRUCache
+from single_flight import SingleFlight
+
+LLM_CACHE_BACKEND = os.getenv('LLM_CACHE_BACKEND', 'local')
+LLM_CACHE_TABLE = os.getenv('LLM_CACHE_TABLE', 'diagnosemellmcache')
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'llm_cache.sqlite'))
+LLM_CACHE_MEMORY_SIZE = int(os.getenv('LLM_CACHE_MEMORY_SIZE', '2048'))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '100000'))
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', str(60 * 60 * 24 * 30)))
+# Responses larger than this aren't cached (DynamoDB items max out at 400 KB).
+LLM_CACHE_MAX_VALUE_BYTES = int(os.getenv('LLM_CACHE_MAX_VALUE_BYTES', '200000'))
+
+
+def cache_key(model, prompt):
+    """Content address of a call: the same model and prompt give the same key."""
+    return hashlib.sha256(f"{model}\0{prompt}".encode('utf-8')).hexdigest()
+
+
+class LocalLLMCacheBackend:
+    """SQLite stand-in for the shared cache table (one file per host)."""
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._writes = 0
+
+    def _connection(self):
+        # One connection per process; SQLite handles must not cross fork.
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._pid = os.getpid()
+            with self._db:
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        expires_at REAL NOT NULL,
+                        stored_at REAL NOT NULL
+                    )""")
+        return self._db
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT response, expires_at FROM llm_cache WHERE cache_key = ?",
+                (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0], row[1]
+
+    def put(self, key, response, expires_at):
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)",
+                           (key, response, expires_at, time.time()))
+                self._writes += 1
+                # Trim occasionally rather than counting rows on every write.
+                if self._writes % 100 == 0:
+                    db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+                    db.execute(
+                        "DELETE FROM llm_cache WHERE cache_key IN (SELECT cache_key FROM "
+                        "llm_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,))
+
+
+class DynamoLLMCacheBackend:
+    """Shared cache in LLM_CACHE_TABLE (hash key: cache_key, TTL: expires_at)."""
+
+    def __init__(self, dynamodb, table_name=LLM_CACHE_TABLE):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+
+    def get(self, key):
+        response = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key={'cache_key': {'S': key}},
+        )
+        item = response.get('Item')
+        if not item:
+            return None
+        expires_at = int(item['expires_at']['N'])
+        # DynamoDB deletes expired items lazily; don't serve them meanwhile.
+        if expires_at < time.time():
+            return None
+        return item['response']['S'], expires_at
+
+    def put(self, key, response, expires_at):
+        self.dynamodb.put_item(
+            TableName=self.table_name,
+            Item={
+                'cache_key': {'S': key},
+                'response': {'S': response},
+                'expires_at': {'N': str(int(expires_at))},
+            }
+        )
+
+
+def make_llm_cache_backend(dynamodb=None, backend=LLM_CACHE_BACKEND):
+    if backend == 'dynamodb':
+        return DynamoLLMCacheBackend(dynamodb)
+    if backend != 'local':
+        logging.warning(
+            "Unknown LLM_CACHE_BACKEND '%s'; using the local SQLite cache", backend)
+    return LocalLLMCacheBackend()
+
+
+class LLMCache:
+    """
+    Response cache for deterministic LLM calls: in-memory LRU over a shared tier.
+
+    Concurrent misses for the same key in this process share one call.
+    Shared-tier errors are logged and treated as misses.
+    """
+
+    def __init__(self, backend, memory_size=LLM_CACHE_MEMORY_SIZE,
+                 ttl_seconds=LLM_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.memory = LRUCache(memory_size)
+        self.flight = SingleFlight()
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            if entry[1] >= time.time():
+                self._count('memory_hits')
+                return entry[0]
+            self.memory.pop(key)
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            self._count('errors')
+            logging.error("LLM cache read failed: %s", e)
+            entry = None
+        if entry is None:
+            return None
+        self._count('shared_hits')
+        self.memory.put(key, entry)
+        return entry[0]
+
+    def put(self, key, response, ttl_seconds=None):
+        if len(response.encode('utf-8')) > LLM_CACHE_MAX_VALUE_BYTES:
+            self._count('too_large')
+            return
+        expires_at = time.time() + (ttl_seconds or self.ttl_seconds)
+        self.memory.put(key, (response, expires_at))
+        try:
+            self.backend.put(key, response, expires_at)
+            self._count('stores')
+        except Exception as e:
+            self._count('errors')
+            logging.error("LLM cache write failed: %s", e)
+
+    def get_or_compute(self, model, prompt, compute, ttl_seconds=None, validate=None):
+        """
+        Cached response for (model, prompt), calling `compute()` on a miss.
+
+        With `validate`, only responses it accepts are stored, and a stored
+        response it rejects is treated as a miss; a response that fails to
+        parse is never replayed.
+        """
+        key = cache_key(model, prompt)
+
+        def usable(response):
+            if validate is None:
+                return True
+            try:
+                return bool(validate(response))
+            except Exception:
+                return False
+
+        def lookup():
+            cached = self.get(key)
+            if cached is not None and not usable(cached):
+                self._count('invalid')
+                self.memory.pop(key)
+                return None
+            return cached
+
+        cached = lookup()
+        if cached is not None:
+            return cached
+
+        def fill():
+            # Another request may have filled it while we waited to lead.
+            cached = lookup()
+            if cached is not None:
+                return cached
+            self._count('misses')
+            response = compute()
+            if response and usable(response):
+                self.put(key, response, ttl_seconds)
+            elif response:
+                self._count('rejected')
+            return response
+
+        return self.flight.do(key, fill)
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        hits = stats.get('memory_hits', 0) + stats.get('shared_hits', 0)
+        lookups = hits + stats.get('misses', 0)
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else None
+        stats['memory_entries'] = len(self.memory)
+        return stats
@@ -0,0 +1,440 @@
+# llm_client.py
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from collections import Counter
+
+import httpx
+from google.genai import types
+
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', '30'))
+# Case generation and other long advanced-model calls.
+LLM_LONG_TIMEOUT_SECONDS = float(os.getenv('LLM_LONG_TIMEOUT_SECONDS', '120'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv('LLM_BACKOFF_BASE_SECONDS', '0.5'))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv('LLM_BACKOFF_MAX_SECONDS', '8'))
+# Send a second copy of a hedged call if the first hasn't answered by then.
+LLM_HEDGE_DELAY_SECONDS = float(os.getenv('LLM_HEDGE_DELAY_SECONDS', '2'))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', '30'))
+
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class LLMError(Exception):
+    """An LLM call failed; `retryable` says whether trying again could help."""
+    retryable = False
+
+
+class LLMTimeoutError(LLMError):
+    retryable = True
+
+
+class LLMServerError(LLMError):
+    """5xx, rate limiting or a dropped connection."""
+    retryable = True
+
+
+class LLMRequestError(LLMError):
+    """The request itself was rejected (4xx other than rate limiting)."""
+
+
+class LLMResponseError(LLMError):
+    """The model answered without usable text (e.g. a blocked response)."""
+
+
+class LLMUnavailableError(LLMError):
+    """The circuit breaker is open; the call was not attempted."""
+
+
+def classify_error(e):
+    """Map SDK and transport exceptions to LLMError subclasses."""
+    if isinstance(e, LLMError):
+        return e
+    code = getattr(e, 'code', None)
+    if isinstance(code, int):
+        if code in RETRYABLE_STATUS or code >= 500:
+            return LLMServerError(f"Gemini returned {code}: {e}")
+        return LLMRequestError(f"Gemini returned {code}: {e}")
+    if isinstance(e, (httpx.TimeoutException, TimeoutError)):
+        return LLMTimeoutError(f"Gemini request timed out: {e}")
+    if isinstance(e, (httpx.TransportError, ConnectionError)):
+        return LLMServerError(f"Gemini connection failed: {e}")
+    return LLMError(f"Gemini request failed: {e}")
+
+
+class CircuitBreaker:
+    """
+    Fail fast after `failure_threshold` consecutive retryable failures.
+
+    After `reset_seconds` one trial call is let through (half-open); its
+    outcome closes the breaker again or restarts the wait.
+    """
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES,
+                 reset_seconds=LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logging.error("LLM circuit breaker open after %d failures", self._failures)
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class LLMClient:
+    """
+    Gemini calls with deadlines, retries, hedging and a circuit breaker.
+
+    Each process builds its own genai client (and HTTP connection pool) on
+    first use, so the wrapper is safe to create before a preforking server
+    forks. Failures raise LLMError subclasses; callers never get error text
+    back in place of model output.
+    """
+
+    def __init__(self, make_client, model_name, advanced_model_name,
+                 max_retries=LLM_MAX_RETRIES, hedge_delay=LLM_HEDGE_DELAY_SECONDS,
+                 breaker=None):
+        self.make_client = make_client
+        self.model_name = model_name
+        self.advanced_model_name = advanced_model_name
+        self.max_retries = max_retries
+        self.hedge_delay = hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._client = None
+        self._pid = None
+        self._hedge_pool = None
+        self._init_lock = threading.Lock()
+
+    def _ensure_client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._init_lock:
+                if self._client is None or self._pid != os.getpid():
+                    self._client = self.make_client()
+                    self._hedge_pool = ThreadPoolExecutor(
+                        max_workers=int(os.getenv('LLM_HEDGE_WORKERS', '16')),
+                        thread_name_prefix='llm-hedge')
+                    self._pid = os.getpid()
+
+    @property
+    def client(self):
+        self._ensure_client()
+        return self._client
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _model(self, advanced):
+        return self.advanced_model_name if advanced else self.model_name
+
+    @staticmethod
+    def _config(remaining):
+        # The SDK takes the HTTP timeout in milliseconds.
+        return types.GenerateContentConfig(
+            http_options=types.HttpOptions(timeout=max(1, int(remaining * 1000))))
+
+    def _before_attempt(self, deadline, log_prefix):
+        """Seconds left for the next attempt; raises if the call mustn't be tried."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._count('deadline_exceeded')
+            raise LLMTimeoutError(f"{log_prefix} deadline exceeded")
+        if not self.breaker.allow():
+            self._count('rejected_open_circuit')
+            raise LLMUnavailableError("Gemini circuit breaker is open")
+        self._count('attempts')
+        return remaining
+
+    def _after_failure(self, e, tries, deadline, log_prefix):
+        """Record failed attempt number `tries`; the backoff delay, or raise if it's final."""
+        error = classify_error(e)
+        if error.retryable:
+            self.breaker.record_failure()
+        else:
+            # The service answered; don't hold a half-open trial open.
+            self.breaker.record_success()
+        self._count(type(error).__name__)
+        # Full jitter: sleep a random fraction of the exponential backoff.
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS,
+                                      LLM_BACKOFF_BASE_SECONDS * 2 ** tries))
+        if not error.retryable or tries > self.max_retries \
+                or time.monotonic() + delay >= deadline:
+            logging.error("%s - Gemini call failed after %d attempt(s): %s",
+                          log_prefix, tries, error)
+            raise error from e
+        logging.warning("%s - Retrying Gemini call in %.2fs: %s",
+                        log_prefix, delay, error)
+        self._count('retries')
+        return delay
+
+    def _with_retries(self, attempt, deadline, log_prefix):
+        """Call `attempt(remaining_seconds)` until it succeeds, retries run out or the deadline passes."""
+        tries = 0
+        while True:
+            remaining = self._before_attempt(deadline, log_prefix)
+            try:
+                result = attempt(remaining)
+            except Exception as e:
+                tries += 1
+                time.sleep(self._after_failure(e, tries, deadline, log_prefix))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def _with_retries_async(self, attempt, deadline, log_prefix):
+        """`_with_retries` for a coroutine function `attempt`."""
+        tries = 0
+        while True:
+            remaining = self._before_attempt(deadline, log_prefix)
+            try:
+                result = await attempt(remaining)
+            except Exception as e:
+                tries += 1
+                await asyncio.sleep(self._after_failure(e, tries, deadline, log_prefix))
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _generate_once(self, prompt, advanced, remaining):
+        response = self.client.models.generate_content(
+            model=self._model(advanced),
+            contents=prompt,
+            config=self._config(remaining),
+        )
+        if not response.text:
+            raise LLMResponseError("Gemini returned no text")
+        return response.text
+
+    def generate(self, prompt, advanced=False, timeout=LLM_TIMEOUT_SECONDS,
+                 hedge=False, log_prefix=""):
+        """
+        Return the model's text for `prompt`, within `timeout` seconds overall.
+
+        With `hedge`, a second identical request is sent if the first hasn't
+        finished after `hedge_delay`, and whichever answers first wins. Only
+        worth it for short, cheap calls.
+        """
+        deadline = time.monotonic() + timeout
+        self._count('calls')
+
+        def run():
+            return self._with_retries(
+                lambda remaining: self._generate_once(prompt, advanced, remaining),
+                deadline, log_prefix)
+
+        if not hedge or self.hedge_delay >= timeout:
+            return run()
+
+        self._ensure_client()
+        primary = self._hedge_pool.submit(run)
+        done, _ = wait([primary], timeout=self.hedge_delay)
+        if done:
+            return primary.result()
+
+        self._count('hedged')
+        logging.info("%s - Hedging slow Gemini call", log_prefix)
+        hedged = self._hedge_pool.submit(run)
+        pending = {primary, hedged}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is hedged:
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        if error is not None:
+            raise error
+        raise LLMTimeoutError(f"{log_prefix} deadline exceeded")
+
+    def stream(self, prompt, advanced=False, timeout=LLM_LONG_TIMEOUT_SECONDS, log_prefix=""):
+        """
+        Open a streaming generation and return an iterator of text chunks.
+
+        Opening (up to the first chunk) is retried like `generate`, so
+        errors surface here rather than halfway through a response. Later
+        failures end the iterator with an LLMError.
+        """
+        deadline = time.monotonic() + timeout
+        self._count('streams')
+
+        def open_stream(remaining):
+            response = self.client.models.generate_content_stream(
+                model=self._model(advanced),
+                contents=prompt,
+                config=self._config(remaining),
+            )
+            chunks = iter(response)
+            try:
+                first = next(chunks, None)
+            except Exception:
+                if hasattr(response, 'close'):
+                    response.close()
+                raise
+            return response, chunks, first
+
+        response, chunks, first = self._with_retries(open_stream, deadline, log_prefix)
+
+        def iterate():
+            try:
+                if first is not None and first.text:
+                    yield first.text
+                for chunk in chunks:
+                    if chunk.text:
+                        yield chunk.text
+            except Exception as e:
+                error = classify_error(e)
+                self._count('stream_' + type(error).__name__)
+                logging.error("%s - Gemini stream failed: %s", log_prefix, error)
+                raise error from e
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+                logging.info(f"{log_prefix} - Stream closed")
+
+        return iterate()
+
+    async def astream(self, prompt, advanced=False, timeout=LLM_LONG_TIMEOUT_SECONDS,
+                      log_prefix=""):
+        """
+        `stream` on the SDK's asyncio API, for the ASGI server.
+
+        Returns an async iterator of text chunks; waiting on Gemini doesn't
+        hold a thread.
+        """
+        deadline = time.monotonic() + timeout
+        self._count('streams')
+        self._count('async_streams')
+
+        async def open_stream(remaining):
+            response = await self.client.aio.models.generate_content_stream(
+                model=self._model(advanced),
+                contents=prompt,
+                config=self._config(remaining),
+            )
+            try:
+                first = await anext(response, None)
+            except Exception:
+                if hasattr(response, 'aclose'):
+                    await response.aclose()
+                raise
+            return response, first
+
+        response, first = await self._with_retries_async(open_stream, deadline, log_prefix)
+
+        async def iterate():
+            try:
+                if first is not None and first.text:
+                    yield first.text
+                async for chunk in response:
+                    if chunk.text:
+                        yield chunk.text
+            except Exception as e:
+                error = classify_error(e)
+                self._count('stream_' + type(error).__name__)
+                logging.error("%s - Gemini stream failed: %s", log_prefix, error)
+                raise error from e
+            finally:
+                if hasattr(response, 'aclose'):
+                    await response.aclose()
+                logging.info(f"{log_prefix} - Stream closed")
+
+        return iterate()
+
+    def snapshot(self):
+        with self._stats_lock:
+            return dict(self.stats, breaker=self.breaker.state)
+
+
+class LLMStream:
+    """
+    A streaming generation that opens on whichever side first asks for it.
+
+    Plain iteration (or `open()`) uses `LLMClient.stream`; `async for` (or
+    `await aopen()`) uses `LLMClient.astream`, so the same response body
+    can be served by the WSGI and the ASGI server.
+    """
+
+    def __init__(self, llm, prompt, advanced=False, timeout=LLM_LONG_TIMEOUT_SECONDS,
+                 log_prefix=""):
+        self.llm = llm
+        self.prompt = prompt
+        self.advanced = advanced
+        self.timeout = timeout
+        self.log_prefix = log_prefix
+        self._chunks = None
+        self._achunks = None
+
+    def open(self):
+        if self._chunks is None:
+            self._chunks = self.llm.stream(self.prompt, advanced=self.advanced,
+                                           timeout=self.timeout, log_prefix=self.log_prefix)
+        return self
+
+    async def aopen(self):
+        if self._achunks is None:
+            self._achunks = await self.llm.astream(
+                self.prompt, advanced=self.advanced, timeout=self.timeout,
+                log_prefix=self.log_prefix)
+        return self
+
+    def __iter__(self):
+        return iter(self.open()._chunks)
+
+    async def _aiterate(self):
+        await self.aopen()
+        try:
+            async for text in self._achunks:
+                yield text
+        finally:
+            await self._achunks.aclose()
+
+    def __aiter__(self):
+        return self._aiterate()
+
+    def close(self):
+        if self._chunks is not None:
+            self._chunks.close()
@@ -0,0 +1,172 @@
+# medrag_pool.py
+import gc
+import logging
+import os
+import queue
+import sys
+import threading
+from contextlib import contextmanager
+
+MEDRAG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MedRAG')
+MEDRAG_LLM_NAME = os.getenv('MEDRAG_LLM_NAME', 'Google/gemini-3.5-flash')
+MEDRAG_RETRIEVER = os.getenv('MEDRAG_RETRIEVER', 'MedCPT')
+# MEDRAG_RETRIEVER values selecting the on-disk BM25 index (bm25_index.py)
+# and the float16 embedding store (embedding_store.py).
+LOCAL_BM25_RETRIEVER = 'LocalBM25'
+LOCAL_DENSE_RETRIEVER = 'LocalDense'
+MEDRAG_CORPUS = os.getenv('MEDRAG_CORPUS', 'MedText')
+# Cache retrieval results across generations (retrieval_cache.py).
+MEDRAG_RETRIEVAL_CACHE = os.getenv('MEDRAG_RETRIEVAL_CACHE', '1') == '1'
+MEDRAG_POOL_SIZE = int(os.getenv('MEDRAG_POOL_SIZE', '1'))
+# Seconds a request waits for a free instance before giving up.
+MEDRAG_CHECKOUT_TIMEOUT = float(os.getenv('MEDRAG_CHECKOUT_TIMEOUT', '600'))
+
+
+def default_medrag_factory():
+    """Construct a MedRAG instance from the MedRAG submodule."""
+    medrag = _build_medrag()
+    if MEDRAG_RETRIEVAL_CACHE and getattr(medrag, 'retrieval_system', None) is not None:
+        from retrieval_cache import CachedRetriever
+
+        medrag.retrieval_system = CachedRetriever(
+            medrag.retrieval_system, MEDRAG_RETRIEVER, MEDRAG_CORPUS)
+    return medrag
+
+
+def local_retriever(retriever_name, corpus_name):
+    if retriever_name == LOCAL_DENSE_RETRIEVER:
+        from embedding_store import LocalDenseRetriever
+        return LocalDenseRetriever(corpus_name)
+    from bm25_index import LocalBM25Retriever
+    return LocalBM25Retriever(corpus_name)
+
+
+def _build_medrag():
+    src_dir = os.path.join(MEDRAG_DIR, 'src')
+    if src_dir not in sys.path:
+        sys.path.insert(0, src_dir)
+    from medrag import MedRAG
+
+    if MEDRAG_RETRIEVER in (LOCAL_BM25_RETRIEVER, LOCAL_DENSE_RETRIEVER):
+        # Build without RAG so MedRAG doesn't load its own retriever, then
+        # plug in the local index as its retrieval system.
+        medrag = MedRAG(llm_name=MEDRAG_LLM_NAME, rag=False, follow_up=True,
+                        corpus_name=MEDRAG_CORPUS, corpus_cache=True)
+        medrag.rag = True
+        medrag.retrieval_system = local_retriever(MEDRAG_RETRIEVER, MEDRAG_CORPUS)
+        return medrag
+
+    return MedRAG(llm_name=MEDRAG_LLM_NAME, rag=True, follow_up=True,
+                  retriever_name=MEDRAG_RETRIEVER, corpus_name=MEDRAG_CORPUS,
+                  corpus_cache=True)
+
+
+class MedRAGPool:
+    """
+    Process-wide pool of MedRAG instances, created lazily and reused.
+
+    The retriever and corpus are loaded once per instance instead of per
+    cache miss. `preload()` is safe to call in a gunicorn master started
+    with --preload: instances built before fork are shared copy-on-write
+    by every worker, and pool locks are re-created in each child.
+    """
+
+    def __init__(self, size=MEDRAG_POOL_SIZE, factory=default_medrag_factory):
+        self.size = max(1, size)
+        self.factory = factory
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._ready = threading.Event()
+        self._error = None
+
+    def _after_fork(self):
+        # Keep the instances built before fork; only thread primitives are reset.
+        instances = []
+        while True:
+            try:
+                instances.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        # Instances checked out (or still loading) in the parent don't exist here.
+        self._reset()
+        for instance in instances:
+            self._idle.put(instance)
+        self._created = len(instances)
+        if instances:
+            self._ready.set()
+
+    def _create(self):
+        logging.info("Loading MedRAG instance (%s over %s)",
+                     MEDRAG_RETRIEVER, MEDRAG_CORPUS)
+        try:
+            instance = self.factory()
+        except Exception as e:
+            with self._lock:
+                self._created -= 1
+                self._error = e
+            raise
+        self._error = None
+        self._ready.set()
+        return instance
+
+    def preload(self):
+        """Build one instance now (e.g. before forking workers)."""
+        with self._lock:
+            if self._created:
+                return
+            self._created += 1
+        self._idle.put(self._create())
+        # Move loaded objects out of the GC's generations so collections in
+        # forked workers don't touch (and copy) the shared corpus pages.
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def warm_in_background(self):
+        """Start loading on a daemon thread; /ready reports when it finishes."""
+        def _warm():
+            try:
+                self.preload()
+            except Exception as e:
+                logging.error("MedRAG warm-up failed: %s", e, exc_info=True)
+
+        threading.Thread(target=_warm, name='medrag-warmup', daemon=True).start()
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def status(self):
+        return {
+            'ready': self.is_ready(),
+            'instances': self._created,
+            'idle': self._idle.qsize(),
+            'error': str(self._error) if self._error else None,
+        }
+
+    @contextmanager
+    def checkout(self):
+        """Borrow an instance, creating one if the pool isn't full yet."""
+        try:
+            instance = self._idle.get_nowait()
+        except queue.Empty:
+            instance = None
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                instance = self._create()
+            else:
+                instance = self._idle.get(timeout=MEDRAG_CHECKOUT_TIMEOUT)
+        try:
+            yield instance
+        finally:
+            self._idle.put(instance)
+
+
+medrag_pool = MedRAGPool()
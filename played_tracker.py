@@ -0,0 +1,162 @@
+# played_tracker.py
+import logging
+import os
+import threading
+from datetime import datetime
+
+from disease_selector import DISEASES, game_day, game_day_ends_at
+from lru import LRUCache
+
+PLAYED_TABLE = os.getenv('PLAYED_TABLE', 'diagnosemeplayed')
+PLAYED_BACKEND = os.getenv('PLAYED_BACKEND', 'local')
+PLAYED_MAX_DEVICES = int(os.getenv('PLAYED_MAX_DEVICES', '100000'))
+
+# Bit i of a device's played set is DISEASES[i].
+DISEASE_BITS = {disease: 1 << i for i, disease in reversed(list(enumerate(DISEASES)))}
+
+
+class PlayedSet:
+    """Read-only view of a played bitset: `disease in played`, `len(played)`."""
+
+    __slots__ = ('bits',)
+
+    def __init__(self, bits=0):
+        self.bits = bits
+
+    def __contains__(self, disease):
+        return bool(self.bits & DISEASE_BITS.get(disease, 0))
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __iter__(self):
+        return (DISEASES[i] for i in range(self.bits.bit_length()) if self.bits >> i & 1)
+
+
+class LocalPlayedBackend:
+    """Per-process played sets: device -> (game day ordinal, bitset) in an LRU."""
+
+    def __init__(self, max_devices=PLAYED_MAX_DEVICES):
+        self.devices = LRUCache(max_devices)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _ordinal(day):
+        return datetime.strptime(day, "%Y-%m-%d").toordinal()
+
+    def get(self, device_id, day):
+        entry = self.devices.get(device_id)
+        if entry is None or entry[0] != self._ordinal(day):
+            return 0
+        return entry[1]
+
+    def add(self, device_id, day, bits):
+        # Read-modify-write; the LRU's own lock doesn't cover the pair.
+        with self._lock:
+            self.devices.put(device_id, (self._ordinal(day), self.get(device_id, day) | bits))
+
+    def clear(self, device_id, day):
+        self.devices.pop(device_id)
+
+
+class DynamoPlayedBackend:
+    """
+    Shared played sets in PLAYED_TABLE (hash key: device_day, TTL: expires_at).
+
+    One item per device and game day holding a number set of DISEASES
+    indexes; ADD merges concurrent writes from any worker or node.
+    """
+
+    def __init__(self, dynamodb, table_name=PLAYED_TABLE):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+
+    @staticmethod
+    def _key(device_id, day):
+        return {'device_day': {'S': f"{day}#{device_id}"}}
+
+    def get(self, device_id, day):
+        response = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key=self._key(device_id, day),
+            ProjectionExpression='played',
+        )
+        bits = 0
+        for index in response.get('Item', {}).get('played', {}).get('NS', []):
+            bits |= 1 << int(index)
+        return bits
+
+    def add(self, device_id, day, bits):
+        indexes = [str(i) for i in range(bits.bit_length()) if bits >> i & 1]
+        if not indexes:
+            return
+        self.dynamodb.update_item(
+            TableName=self.table_name,
+            Key=self._key(device_id, day),
+            UpdateExpression="ADD played :indexes SET expires_at = :exp",
+            ExpressionAttributeValues={
+                ':indexes': {'NS': indexes},
+                # Kept a day past rollover, then removed by DynamoDB TTL.
+                ':exp': {'N': str(game_day_ends_at(day) + 86400)},
+            },
+            ReturnValues='NONE'
+        )
+
+    def clear(self, device_id, day):
+        self.dynamodb.delete_item(TableName=self.table_name, Key=self._key(device_id, day))
+
+
+def make_played_backend(dynamodb=None, backend=PLAYED_BACKEND):
+    if backend == 'dynamodb':
+        return DynamoPlayedBackend(dynamodb)
+    if backend != 'local':
+        logging.warning(
+            "Unknown PLAYED_BACKEND '%s'; using in-process played sets", backend)
+    return LocalPlayedBackend()
+
+
+class PlayedTracker:
+    """
+    Diseases each device has played on the current game day (UTC-10).
+
+    Sets are bitsets over DISEASES indexes and start empty every game day.
+    Names outside DISEASES (e.g. AI-generated criteria cases) aren't tracked;
+    random selection never returns them. Backend errors are logged and
+    treated as an empty set, so they never block a new game.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def _bits(diseases):
+        bits = 0
+        for disease in diseases:
+            bits |= DISEASE_BITS.get(disease, 0)
+        return bits
+
+    def played(self, device_id, *also, day=None):
+        """The device's played set for the day, plus any diseases in `also`."""
+        try:
+            bits = self.backend.get(device_id, day or game_day())
+        except Exception as e:
+            logging.error("Error reading played diseases: %s", e)
+            bits = 0
+        return PlayedSet(bits | self._bits(also))
+
+    def record(self, device_id, *diseases, day=None):
+        try:
+            self.backend.add(device_id, day or game_day(), self._bits(diseases))
+        except Exception as e:
+            logging.error("Error recording played diseases: %s", e)
+
+    def clear(self, device_id, day=None):
+        try:
+            self.backend.clear(device_id, day or game_day())
+        except Exception as e:
+            logging.error("Error clearing played diseases: %s", e)
+
+    def snapshot(self):
+        devices = getattr(self.backend, 'devices', None)
+        return {'backend': type(self.backend).__name__,
+                'devices': len(devices) if devices is not None else None}
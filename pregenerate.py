@@ -0,0 +1,200 @@
+# pregenerate.py
+"""
+Warm the cases table ahead of player traffic.
+
+Generates (or backfills) the case, rubric, answer description and
+placeholder snippet for upcoming case-of-the-day dates and, optionally,
+every entry in DISEASES, so requests never hit the cold path in
+get_patient_case_record.
+
+    python pregenerate.py --days 3 --catalog --workers 4 --rate 20
+    python pregenerate.py --schedule --interval-hours 6
+
+Run one scheduler (or a cron job) per deployment. PREWARM_SCHEDULER=1
+starts one inside every app worker instead, so flask_app only honours it
+with the shared DynamoDB case lease.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from disease_selector import DISEASES, case_of_the_day_disease, game_day
+
+# Attributes a fully warm case item carries.
+WARM_ATTRIBUTES = ('gamerecord', 'gamerubric', 'gameanswer', 'gameplaceholder')
+
+PREWARM_DAYS = int(os.getenv('PREWARM_DAYS', '3'))
+PREWARM_INTERVAL_HOURS = float(os.getenv('PREWARM_INTERVAL_HOURS', '6'))
+PREWARM_WORKERS = int(os.getenv('PREWARM_WORKERS', '2'))
+PREWARM_RATE_PER_MINUTE = float(os.getenv('PREWARM_RATE_PER_MINUTE', '10'))
+
+
+class RateLimiter:
+    """Space out job starts to at most `per_minute` across worker threads."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def upcoming_case_of_the_day(days):
+    """[(date, disease)] for today's and the next `days - 1` daily cases."""
+    return [(game_day(offset), case_of_the_day_disease(game_day(offset)))
+            for offset in range(days)]
+
+
+def prewarm_targets(days=PREWARM_DAYS, include_catalog=False):
+    """Diseases to warm: upcoming daily cases first, then the catalog."""
+    targets = []
+    for date_str, disease in upcoming_case_of_the_day(days):
+        logging.info("Case of the day for %s: %s", date_str, disease)
+        if disease not in targets:
+            targets.append(disease)
+    if include_catalog:
+        targets.extend(d for d in DISEASES if d not in targets)
+    return targets
+
+
+def is_warm(item):
+    return item is not None and all(item.get(attr) for attr in WARM_ATTRIBUTES)
+
+
+def warm_case(disease):
+    """Generate or backfill one case record; returns 'warm' or 'generated'."""
+    import flask_app
+
+    item = flask_app.load_case_item(flask_app.get_case_key(disease))
+    if is_warm(item):
+        return 'warm'
+    flask_app.get_patient_case_record(disease)
+    return 'generated'
+
+
+def prefetch_retrievals(diseases, k=32):
+    """
+    Retrieve for all `diseases` in one batched call before generating.
+
+    Fills the retrieval cache so each generation's lookup by disease name is
+    a cache hit; a no-op unless the pool's retriever is cached.
+    """
+    from medrag_pool import medrag_pool
+
+    with medrag_pool.checkout() as medrag:
+        retrieval_system = getattr(medrag, 'retrieval_system', None)
+        if not hasattr(retrieval_system, 'prefetch'):
+            return 0
+        count = retrieval_system.prefetch(diseases, k=k)
+    logging.info("Prefetched retrieval for %d of %d diseases", count, len(diseases))
+    return count
+
+
+def prewarm(diseases, workers=PREWARM_WORKERS, rate_per_minute=PREWARM_RATE_PER_MINUTE,
+            dry_run=False):
+    """Warm every disease on a bounded, rate-limited worker pool."""
+    import flask_app
+
+    pending = []
+    for disease in diseases:
+        item = flask_app.load_case_item(flask_app.get_case_key(disease))
+        if not is_warm(item):
+            pending.append(disease)
+    logging.info("Prewarm: %d of %d cases need generation",
+                 len(pending), len(diseases))
+    summary = {'warm': len(diseases) - len(pending), 'generated': 0, 'failed': 0}
+    if dry_run or not pending:
+        for disease in pending:
+            logging.info("Would generate: %s", disease)
+        return summary
+
+    try:
+        prefetch_retrievals(pending)
+    except Exception as e:
+        logging.error("Batched retrieval prefetch failed: %s", e, exc_info=True)
+
+    limiter = RateLimiter(rate_per_minute)
+
+    def job(disease):
+        limiter.wait()
+        started = time.time()
+        result = warm_case(disease)
+        logging.info("Prewarm %s: %s in %.1fs", disease, result,
+                     time.time() - started)
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(job, disease): disease for disease in pending}
+        for future in as_completed(futures):
+            try:
+                summary[future.result()] += 1
+            except Exception as e:
+                summary['failed'] += 1
+                logging.error("Prewarm failed for %s: %s", futures[future],
+                              e, exc_info=True)
+    logging.info("Prewarm finished: %s", summary)
+    return summary
+
+
+def run_schedule(days=PREWARM_DAYS, include_catalog=False,
+                 interval_hours=PREWARM_INTERVAL_HOURS, workers=PREWARM_WORKERS,
+                 rate_per_minute=PREWARM_RATE_PER_MINUTE, stop_event=None):
+    """Prewarm every `interval_hours` until `stop_event` is set."""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            prewarm(prewarm_targets(days, include_catalog),
+                    workers=workers, rate_per_minute=rate_per_minute)
+        except Exception as e:
+            logging.error("Scheduled prewarm failed: %s", e, exc_info=True)
+        stop_event.wait(interval_hours * 3600)
+
+
+def start_scheduler(**kwargs):
+    """Run the prewarm schedule on a daemon thread; returns its stop event."""
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_schedule, kwargs=dict(kwargs, stop_event=stop_event),
+                              name='prewarm-scheduler', daemon=True)
+    thread.start()
+    return stop_event
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-generate upcoming daily cases and the DISEASES catalog.")
+    parser.add_argument('--days', type=int, default=PREWARM_DAYS,
+                        help="Number of case-of-the-day dates to warm, starting today.")
+    parser.add_argument('--catalog', action='store_true',
+                        help="Also warm every entry in DISEASES.")
+    parser.add_argument('--workers', type=int, default=PREWARM_WORKERS)
+    parser.add_argument('--rate', type=float, default=PREWARM_RATE_PER_MINUTE,
+                        help="Maximum generations started per minute.")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Only list the cases that would be generated.")
+    parser.add_argument('--schedule', action='store_true',
+                        help="Keep running, re-warming every --interval-hours.")
+    parser.add_argument('--interval-hours', type=float,
+                        default=PREWARM_INTERVAL_HOURS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.schedule:
+        run_schedule(args.days, args.catalog, args.interval_hours,
+                     args.workers, args.rate)
+    else:
+        prewarm(prewarm_targets(args.days, args.catalog), workers=args.workers,
+                rate_per_minute=args.rate, dry_run=args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+# question_router.py
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+
+from lru import LRUCache
+
+# Routes (see route_question in flask_app.py):
+# A patient question, B labs/imaging, C focused physical exam, D diagnosis
+# attempt, E giving up, F disallowed action, G too broad an exam/workup.
+ROUTES = ('A', 'B', 'C', 'D', 'E', 'F', 'G')
+
+# Below this confidence the LLM router is consulted instead.
+ROUTER_CONFIDENCE_THRESHOLD = float(
+    os.getenv('ROUTER_CONFIDENCE_THRESHOLD', '0.6'))
+# Optional JSONL of logged {"question": ..., "route": ...} pairs.
+ROUTER_EXAMPLES_PATH = os.getenv('ROUTER_EXAMPLES_PATH')
+# LLM-labelled questions kept in the n-gram model (least recently learned go first).
+ROUTER_MAX_LEARNED = int(os.getenv('ROUTER_MAX_LEARNED', '5000'))
+
+# Few-shot examples, shared with the LLM routing prompt. Text is kept
+# exactly as it appears in that prompt (including quotes).
+ROUTE_EXAMPLES = [
+    ("'what brings you in today?'", 'A'),
+    ("'tell me more'", 'A'),
+    ("'wow that sucks'", 'A'),
+    ("'pmh'", 'A'),
+    ("where is the pain?", 'A'),
+    ("'have you had a cbc?'", 'B'),
+    ("'ok lets do a cmp'", 'B'),
+    ("'im gonna order PFTs'", 'B'),
+    ("'lets see a tsh'", 'B'),
+    ("'abg'", 'B'),
+    ("'urinalysis results'", 'B'),
+    ("'Let me check your heart sounds'", 'C'),
+    ("'whats on the back of your hand?'", 'C'),
+    ("'lets take a look at your heart'", 'C'),
+    ("'abdominal exam'", 'C'),
+    ("'im going to tap your cheek'", 'C'),
+    ("'brudzinski'", 'C'),
+    ("'i think you have pneumonia'", 'D'),
+    ("'you have psoriasis'", 'D'),
+    ("'i think you might have COPD. lets start you on some medications, and then we can check back in 6 months to see how you do on them'", 'D'),
+    ("'my diagnosis is diabetes'", 'D'),
+    ("'i give up, what is it?'", 'E'),
+    ("'what is the answer?'", 'E'),
+    ("'what is the diagnosis?'", 'E'),
+    ("'tell me the answer'", 'E'),
+    ("can i get a new case", 'F'),
+    ("start a new case", 'F'),
+    ("'i dont know what it is'", 'A'),
+    ("physical exam", 'G'),
+    ("neuro exam", 'G'),
+    ("all labs", 'G'),
+    ("mri", 'G'),
+    ("mri brain", 'B'),
+]
+
+LAB_TERMS = {
+    'cbc', 'cmp', 'bmp', 'abg', 'vbg', 'tsh', 't3', 't4', 'ua', 'urinalysis',
+    'lft', 'lfts', 'pft', 'pfts', 'spirometry', 'ecg', 'ekg', 'eeg', 'emg',
+    'troponin', 'troponins', 'lipase', 'amylase', 'bnp', 'esr', 'crp', 'ana',
+    'anca', 'c-anca', 'p-anca', 'hba1c', 'a1c', 'glucose', 'lactate',
+    'electrolytes', 'lytes', 'ferritin', 'b12', 'folate', 'inr', 'ptt',
+    'coags', 'd-dimer', 'ddimer', 'dimer', 'cxr', 'xray', 'x-ray', 'mri',
+    'ct', 'cta', 'ultrasound', 'echo', 'echocardiogram', 'biopsy', 'culture',
+    'cultures', 'lp', 'csf', 'smear', 'labs', 'lab', 'bloodwork', 'tox',
+    'serum', 'panel', 'titer', 'titers', 'antibodies', 'antibody',
+    'hcg', 'b-hcg', 'cortisol', 'acth', 'prolactin', 'calcium', 'pth', 'hiv',
+    'rpr', 'vdrl', 'fta-abs', 'colonoscopy', 'endoscopy', 'egd', 'ldh',
+    'haptoglobin', 'bilirubin', 'retic', 'reticulocyte', 'platelets',
+    'hemoglobin', 'hgb', 'wbc', 'creatinine', 'bun', 'potassium', 'sodium',
+    'magnesium', 'phosphate', 'lipid', 'lipids', 'ck', 'cpk', 'aldolase',
+    'complement', 'c3', 'c4', 'aso', 'igg', 'iga', 'ige', 'igm', 'ceruloplasmin',
+    'ammonia', 'osmolality', 'ketones', 'imaging', 'angiogram', 'angiography', 'doppler', 'dexa', 'mammogram',
+    'pcr', 'serology', 'electrophoresis', 'spep', 'upep',
+}
+
+EXAM_TERMS = {
+    'exam', 'examine', 'examination', 'auscultate', 'auscultation', 'palpate',
+    'palpation', 'percuss', 'percussion', 'inspect', 'inspection', 'reflex',
+    'reflexes', 'murphy', 'murphys', 'brudzinski', 'kernig', 'babinski',
+    'romberg', 'rovsing', 'mcburney', 'mcburneys', 'psoas', 'obturator',
+    'tinel', 'phalen', 'spurling', 'homan', 'homans', 'fundoscopy',
+    'fundoscopic', 'otoscope', 'otoscopic', 'vitals', 'pulses', 'gait',
+    'tenderness', 'rebound', 'guarding', 'jvd', 'lymph', 'nodes', 'tone',
+}
+
+EXAM_PHRASES = (
+    'heart sounds', 'lung sounds', 'breath sounds', 'bowel sounds',
+    'listen to', 'look at', 'take a look', 'check your', 'feel your',
+    'vital signs', 'straight leg', 'range of motion',
+)
+
+HISTORY_TERMS = {
+    'pmh', 'psh', 'fh', 'fhx', 'sh', 'shx', 'hpi', 'ros', 'meds',
+    'medications', 'medication', 'allergies', 'allergy', 'smoke', 'smoking',
+    'alcohol', 'drink', 'drugs', 'travel', 'sexual', 'pregnant', 'period',
+    'vaccines', 'vaccinated', 'occupation', 'job', 'diet', 'history',
+}
+
+# Asking for the answer only counts when nothing follows it ("what is
+# your diagnosis history" is a history question).
+GIVE_UP_RE = re.compile(
+    r"\bi give up\b|^(?:ok |okay |fine )?(?:give up|i quit|i surrender)$"
+    r"|\b(?:what(?:s| is| was) (?:the|your|my) (?:answer|diagnosis|dx)"
+    r"|tell me (?:the|what the) (?:answer|diagnosis|dx)"
+    r"|reveal (?:the )?(?:answer|diagnosis)|show me the answer)"
+    r"(?: then| already| please| now| doc| doctor)?$")
+DISALLOWED_RE = re.compile(
+    r"\b(?:new|another|different|next|random|easier) case\b"
+    r"|\bstart (?:over|again)\b|\brestart\b|\bskip (?:this )?case\b")
+BROAD_EXAM_RE = re.compile(
+    r"^(?:lets |let me |do |perform |ill do |can i do |i want )?(?:an? |the |a )?"
+    r"(?:full |complete |comprehensive |entire |whole |general |total |head to toe )?"
+    r"(?:physical |neuro |neurological |neurologic )?(?:exam|examination|physical)$")
+BROAD_WORKUP_RE = re.compile(
+    r"^(?:order |get |lets get |run |i want )?(?:all|every|full|complete|any) "
+    r"(?:the )?(?:labs?|tests|bloodwork|blood work|workup|imaging)$"
+    r"|^(?:an? )?(?:mri|ct|ct scan|imaging|scan|x ?ray)s?$")
+DIAGNOSIS_RE = re.compile(
+    r"\b(?:my |the |final )?(?:diagnosis|dx) (?:is|would be|=)"
+    r"|\bi (?:think|believe|suspect|bet) (?:you|the patient|she|he|they)"
+    r"(?: has| have| might have| may have| probably have| probably has| likely have"
+    r"| likely has| could have)\b"
+    r"|^(?:you|the patient|patient|pt|she|he|they) "
+    r"(?:(?:might|may|probably|likely|must|definitely) )?(?:have|has|got)\b"
+    r"|\b(?:final answer|my guess is|im going with|going with)\b")
+# "i think its lupus" vs "i think you are nervous", "is it lupus?" vs "is it
+# painful?": left to the LLM router.
+TENTATIVE_DIAGNOSIS_RE = re.compile(
+    r"\bi (?:think|believe|suspect|bet) (?:you|it|this|that|the patient|she|he|they)"
+    r"(?:s| is| are| might| may| probably| likely| could)\b"
+    r"|^(?:is it|is this|could it be|could this be|might it be|what about|how about"
+    r"|maybe|perhaps)\b")
+QUESTION_RE = re.compile(
+    r"^(?:do|did|does|have|has|are|were|is|was|when|where|what|how|why|who"
+    r"|any|tell me|can you|could you|describe)\b")
+# Questions that may be put to the patient ("have you had any tests?", "any
+# rash?", "when was your last colonoscopy?"); a lab or exam keyword in one of
+# these isn't enough on its own.
+HISTORY_QUESTION_RE = re.compile(
+    r"^(?:do|did|does|have|has|are|were|is|was|any|ever"
+    r"|when|where|what|how|why|who)\b")
+
+# Keyword rules are trusted above the threshold; tentative ones fall below it.
+RULE_CONFIDENCE = 0.9
+TENTATIVE_RULE_CONFIDENCE = 0.5
+
+RoutePrediction = namedtuple(
+    'RoutePrediction', ['route', 'confidence', 'source'])
+
+
+def normalize_question(text):
+    """Lower-case, drop quotes/apostrophes and collapse punctuation."""
+    text = (text or '').lower().strip().strip('"\'')
+    text = re.sub(r"[’'`]", '', text)
+    text = re.sub(r"[^a-z0-9\-\s]", ' ', text)
+    return re.sub(r"\s+", ' ', text).strip()
+
+
+def char_ngrams(text, n=3):
+    padded = f" {text} "
+    return Counter(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+class NgramNearestNeighbours:
+    """Cosine k-NN over character trigram counts with an inverted index."""
+
+    def __init__(self, k=3):
+        self.k = k
+        self._next_id = 0
+        self._routes = {}
+        self._norms = {}
+        self._grams = {}
+        self._postings = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def add(self, text, route):
+        """Index `text`; returns its entry id (for `remove`), or None if empty."""
+        grams = char_ngrams(normalize_question(text))
+        if not grams:
+            return None
+        with self._lock:
+            idx = self._next_id
+            self._next_id += 1
+            self._routes[idx] = route
+            self._norms[idx] = math.sqrt(sum(c * c for c in grams.values()))
+            self._grams[idx] = grams
+            for gram, count in grams.items():
+                self._postings[gram][idx] = count
+        return idx
+
+    def remove(self, idx):
+        with self._lock:
+            grams = self._grams.pop(idx, None)
+            if grams is None:
+                return
+            del self._routes[idx]
+            del self._norms[idx]
+            for gram in grams:
+                postings = self._postings[gram]
+                postings.pop(idx, None)
+                if not postings:
+                    del self._postings[gram]
+
+    def __len__(self):
+        return len(self._routes)
+
+    def predict(self, text):
+        """Return (route, confidence, best_similarity) or (None, 0, 0)."""
+        grams = char_ngrams(text)
+        if not grams:
+            return None, 0.0, 0.0
+        query_norm = math.sqrt(sum(c * c for c in grams.values()))
+        dots = defaultdict(float)
+        # learn() runs on other request threads; don't iterate while it mutates.
+        with self._lock:
+            for gram, count in grams.items():
+                for idx, other in self._postings.get(gram, {}).items():
+                    dots[idx] += count * other
+            if not dots:
+                return None, 0.0, 0.0
+            sims = sorted(((dot / (query_norm * self._norms[idx]), idx)
+                           for idx, dot in dots.items()), reverse=True)[:self.k]
+            neighbours = [(sim, self._routes[idx]) for sim, idx in sims]
+        votes = defaultdict(float)
+        for sim, route in neighbours:
+            votes[route] += sim
+        route, weight = max(votes.items(), key=lambda kv: kv[1])
+        best = neighbours[0][0]
+        return route, (weight / sum(votes.values())) * best, best
+
+
+class RouterStats:
+    """Per-route counts, mean confidence and local vs. LLM latency."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = defaultdict(lambda: {'count': 0, 'confidence_sum': 0.0})
+        self.sources = Counter()
+        self.latency = defaultdict(lambda: {'count': 0, 'total_ms': 0.0})
+
+    def record_latency(self, kind, elapsed_ms):
+        with self._lock:
+            self.latency[kind]['count'] += 1
+            self.latency[kind]['total_ms'] += elapsed_ms
+
+    def record_route(self, prediction):
+        with self._lock:
+            entry = self.routes[prediction.route]
+            entry['count'] += 1
+            entry['confidence_sum'] += prediction.confidence
+            self.sources[prediction.source] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'routes': {
+                    route: {
+                        'count': v['count'],
+                        'mean_confidence': round(v['confidence_sum'] / v['count'], 3),
+                    } for route, v in self.routes.items()
+                },
+                'sources': dict(self.sources),
+                'mean_latency_ms': {
+                    kind: round(v['total_ms'] / v['count'], 3)
+                    for kind, v in self.latency.items()
+                },
+            }
+
+
+class QuestionRouter:
+    """
+    In-process classifier for player messages.
+
+    Keyword/abbreviation rules handle the unambiguous cases; a character
+    n-gram nearest-neighbour model trained on the few-shot examples (and
+    any logged conversations) covers the rest. Callers fall back to the
+    LLM router when the returned confidence is below the threshold.
+    """
+
+    def __init__(self, threshold=ROUTER_CONFIDENCE_THRESHOLD, examples_path=ROUTER_EXAMPLES_PATH,
+                 max_learned=ROUTER_MAX_LEARNED):
+        self.threshold = threshold
+        self.model = NgramNearestNeighbours()
+        self.stats = RouterStats()
+        # Normalised question -> n-gram entry id; the seed examples aren't in here.
+        self.learned = LRUCache(max_learned)
+        self._learn_lock = threading.Lock()
+        for text, route in ROUTE_EXAMPLES:
+            self.model.add(text, route)
+        if examples_path:
+            self.load_examples(examples_path)
+
+    def load_examples(self, path):
+        """Add logged {"question", "route"} JSONL rows to the n-gram model."""
+        added = 0
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+                    if row.get('route') in ROUTES and row.get('question'):
+                        self.model.add(row['question'], row['route'])
+                        added += 1
+        except (OSError, ValueError) as e:
+            logging.error("Failed to load router examples from %s: %s",
+                          path, e)
+        logging.info("Loaded %d router examples from %s", added, path)
+        return added
+
+    def learn(self, question, route):
+        """Remember an LLM-labelled question so it resolves locally next time."""
+        if route not in ROUTES:
+            return
+        key = normalize_question(question)
+        with self._learn_lock:
+            previous = self.learned.pop(key)
+            if previous is not None:
+                self.model.remove(previous)
+            idx = self.model.add(question, route)
+            if idx is None:
+                return
+            evicted = self.learned.put(key, idx)
+            if evicted is not None:
+                self.model.remove(evicted[1])
+
+    def _rules(self, text):
+        """(route, confidence) from the keyword rules, or None."""
+        if GIVE_UP_RE.search(text):
+            return 'E', RULE_CONFIDENCE
+        if DISALLOWED_RE.search(text):
+            return 'F', RULE_CONFIDENCE
+        if BROAD_EXAM_RE.match(text) or BROAD_WORKUP_RE.match(text):
+            return 'G', RULE_CONFIDENCE
+        if DIAGNOSIS_RE.search(text):
+            return 'D', RULE_CONFIDENCE
+        if TENTATIVE_DIAGNOSIS_RE.search(text):
+            return 'D', TENTATIVE_RULE_CONFIDENCE
+        tokens = set(text.split())
+        route = None
+        if tokens & LAB_TERMS:
+            route = 'B'
+        elif tokens & EXAM_TERMS or any(p in text for p in EXAM_PHRASES):
+            route = 'C'
+        if route:
+            if HISTORY_QUESTION_RE.match(text):
+                return route, TENTATIVE_RULE_CONFIDENCE
+            return route, RULE_CONFIDENCE
+        if tokens & HISTORY_TERMS:
+            return 'A', RULE_CONFIDENCE
+        return None
+
+    def classify(self, question):
+        """Return a RoutePrediction from local rules and the n-gram model."""
+        started = time.perf_counter()
+        text = normalize_question(question)
+        knn_route, knn_confidence, best = self.model.predict(text)
+
+        if best >= 0.9:
+            prediction = RoutePrediction(knn_route, best, 'knn')
+        else:
+            rule = self._rules(text)
+            if rule:
+                prediction = RoutePrediction(*rule, 'rules')
+            elif QUESTION_RE.match(text):
+                # Most questions are for the patient, but not all of them.
+                prediction = RoutePrediction('A', TENTATIVE_RULE_CONFIDENCE, 'rules')
+            elif knn_route:
+                prediction = RoutePrediction(knn_route, knn_confidence, 'knn')
+            else:
+                prediction = RoutePrediction('A', 0.0, 'default')
+
+        self.stats.record_latency(
+            'local', (time.perf_counter() - started) * 1000)
+        if self.is_confident(prediction):
+            self.stats.record_route(prediction)
+        return prediction
+
+    def is_confident(self, prediction):
+        return prediction.confidence >= self.threshold
+
+    def record_llm(self, question, route, elapsed_ms):
+        """Account for an LLM fallback and learn its label."""
+        self.stats.record_latency('llm', elapsed_ms)
+        self.stats.record_route(RoutePrediction(route, 1.0, 'llm'))
+        self.learn(question, route)
+
+
+question_router = QuestionRouter()
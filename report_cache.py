@@ -0,0 +1,149 @@
+# report_cache.py
+import json
+import logging
+import re
+import threading
+from collections import Counter
+
+from llm_cache import cache_key
+from stream_guard import ChunkStream
+
+# Lab and exam shorthand players type, expanded before keying.
+ABBREVIATIONS = {
+    'cbc': 'complete blood count',
+    'bmp': 'basic metabolic panel',
+    'cmp': 'comprehensive metabolic panel',
+    'lft': 'liver function tests',
+    'lfts': 'liver function tests',
+    'ua': 'urinalysis',
+    'abg': 'arterial blood gas',
+    'vbg': 'venous blood gas',
+    'tsh': 'thyroid stimulating hormone',
+    'ecg': 'electrocardiogram',
+    'ekg': 'electrocardiogram',
+    'cxr': 'chest xray',
+    'esr': 'erythrocyte sedimentation rate',
+    'crp': 'c reactive protein',
+    'inr': 'international normalized ratio',
+    'pt': 'prothrombin time',
+    'ptt': 'partial thromboplastin time',
+    'bnp': 'brain natriuretic peptide',
+    'hba1c': 'hemoglobin a1c',
+    'a1c': 'hemoglobin a1c',
+    'csf': 'cerebrospinal fluid',
+    'lp': 'lumbar puncture',
+    'ct': 'computed tomography',
+    'mri': 'magnetic resonance imaging',
+    'abd': 'abdominal',
+    'abdomen': 'abdominal',
+    'cv': 'cardiovascular',
+    'cardiac': 'cardiovascular',
+    'heart': 'cardiovascular',
+    'resp': 'pulmonary',
+    'respiratory': 'pulmonary',
+    'lung': 'pulmonary',
+    'lungs': 'pulmonary',
+    'neuro': 'neurological',
+    'neurologic': 'neurological',
+    'msk': 'musculoskeletal',
+    'derm': 'skin',
+    'heent': 'head eyes ears nose throat',
+}
+
+# Request filler that doesn't change which report is generated.
+FILLER_WORDS = frozenset("""
+a an the and of for to on in me my i we you can could would please get order
+check do perform run some let lets see look at like want need also with
+exam examine examination test tests testing level levels result results
+""".split())
+
+# Markers the client relies on; reports without them are not cached.
+REPORT_MARKERS = {
+    'labs': '$$$',
+    'exam': 'PHYSICAL EXAM',
+}
+
+
+def normalize_report_request(text):
+    """Lower-case, expand abbreviations, drop filler words, dedupe and sort tokens."""
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        tokens.extend(ABBREVIATIONS.get(token, token).split())
+    return ' '.join(sorted({t for t in tokens if t not in FILLER_WORDS}))
+
+
+class ReportCache:
+    """
+    Generated lab and physical-exam reports per case_key and normalised request.
+
+    Reports are stored as the list of streamed chunks, so a hit replays the
+    same chunks through stream_response that the first player received.
+    Storage is the shared LLM response cache.
+    """
+
+    def __init__(self, llm_cache):
+        self.llm_cache = llm_cache
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    @staticmethod
+    def key(kind, case_key, request_text):
+        normalized = normalize_report_request(request_text)
+        if not case_key or not normalized:
+            return None
+        return cache_key(f"report:{kind}:{case_key}", normalized)
+
+    def get(self, key):
+        cached = self.llm_cache.get(key)
+        if cached is None:
+            return None
+        try:
+            return json.loads(cached)
+        except json.JSONDecodeError:
+            logging.warning("Ignoring unreadable cached report %s", key[:12])
+            return None
+
+    def cached_stream(self, kind, case_key, request_text, open_stream):
+        """
+        Chunks of the report for this request, from the cache or `open_stream()`.
+
+        On a miss the live chunks are passed through and stored once the
+        stream completes with the expected framing marker.
+        """
+        key = self.key(kind, case_key, request_text)
+        if key is None:
+            return open_stream()
+        chunks = self.get(key)
+        if chunks:
+            self._count(f'{kind}_hits')
+            logging.info("Replaying cached %s report for '%s'", kind,
+                         normalize_report_request(request_text))
+            return chunks
+        self._count(f'{kind}_misses')
+        return self._record(kind, key, open_stream())
+
+    def _record(self, kind, key, chunks):
+        received = []
+
+        def keep(chunk):
+            received.append(chunk)
+            return (chunk,)
+
+        def closed(completed):
+            # Only store streams that finished (not on disconnect or error).
+            if not completed:
+                return
+            if REPORT_MARKERS[kind] in ''.join(received):
+                self.llm_cache.put(key, json.dumps(received))
+            else:
+                self._count(f'{kind}_unframed')
+
+        return ChunkStream(chunks, transform=keep, on_close=closed)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
@@ -0,0 +1,249 @@
+# retrieval_cache.py
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from corpus_store import CORPUS_DIR, STORE_EXTENSION, open_id2text
+
+RETRIEVAL_CACHE_PATH = os.getenv(
+    'RETRIEVAL_CACHE_PATH', os.path.join(CORPUS_DIR, 'retrieval_cache.sqlite'))
+RETRIEVAL_CACHE_TTL_SECONDS = int(os.getenv(
+    'RETRIEVAL_CACHE_TTL_SECONDS', str(60 * 60 * 24 * 30)))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv('RETRIEVAL_CACHE_MAX_ENTRIES', '20000'))
+
+
+def normalize_query(query):
+    return ' '.join(re.findall(r"[a-z0-9]+", query.lower()))
+
+
+def corpus_version(corpus_name, corpus_dir=CORPUS_DIR):
+    """
+    Stamp identifying the current contents of a corpus.
+
+    Built from the size and mtime of its id2text file (the .dmc store if one
+    exists), so rebuilding or updating the corpus changes it.
+    """
+    base = os.path.join(corpus_dir, f"{corpus_name}_id2text")
+    for path in (base + STORE_EXTENSION, base + '.json'):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        return f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return None
+
+
+class RetrievalCache:
+    """
+    Persistent (retriever, corpus, query) -> [(doc id, score)] cache in SQLite.
+
+    Entries expire after `ttl_seconds`, the least recently used ones are
+    evicted beyond `max_entries`, and entries stamped with a different corpus
+    version are treated as misses and replaced.
+    """
+
+    def __init__(self, path=RETRIEVAL_CACHE_PATH, ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS,
+                 max_entries=RETRIEVAL_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS retrievals (
+                    cache_key TEXT PRIMARY KEY,
+                    corpus_version TEXT NOT NULL,
+                    results TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS retrievals_last_used ON retrievals (last_used)")
+
+    @staticmethod
+    def make_key(retriever_name, corpus_name, query, k):
+        return f"{retriever_name}|{corpus_name}|{k}|{normalize_query(query)}"
+
+    def get(self, key, version):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT corpus_version, results, created_at FROM retrievals WHERE cache_key = ?",
+                (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            if row[0] != version or now - row[2] > self.ttl_seconds:
+                self.stats['stale'] += 1
+                with self._db:
+                    self._db.execute("DELETE FROM retrievals WHERE cache_key = ?", (key,))
+                return None
+            with self._db:
+                self._db.execute(
+                    "UPDATE retrievals SET last_used = ? WHERE cache_key = ?", (now, key))
+            self.stats['hits'] += 1
+        return json.loads(row[1])
+
+    def put(self, key, version, results):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO retrievals VALUES (?, ?, ?, ?, ?)",
+                (key, version, json.dumps(results), now, now))
+            count = self._db.execute("SELECT COUNT(*) FROM retrievals").fetchone()[0]
+            if count > self.max_entries:
+                self._db.execute(
+                    "DELETE FROM retrievals WHERE cache_key IN ("
+                    "SELECT cache_key FROM retrievals ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,))
+                self.stats['evicted'] += count - self.max_entries
+
+    def snapshot(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM retrievals").fetchone()[0]
+            return dict(self.stats, entries=entries)
+
+
+class CachedRetriever:
+    """
+    Wraps a MedRAG retrieval system so repeated queries skip retrieval.
+
+    When the corpus has a memory-mapped .dmc store, only snippet ids and
+    scores are cached and snippets are rebuilt from the store on a hit.
+    Without one, the snippets themselves go in the cache row rather than
+    loading the whole id2text JSON into every worker. If the corpus has no
+    local id2text file at all, calls pass straight through.
+    """
+
+    def __init__(self, inner, retriever_name, corpus_name, cache=None):
+        self.inner = inner
+        self.retriever_name = retriever_name
+        self.corpus_name = corpus_name
+        self._cache = cache
+        self.version = corpus_version(corpus_name)
+        self.has_store = os.path.exists(
+            os.path.join(CORPUS_DIR, f"{corpus_name}_id2text{STORE_EXTENSION}"))
+        self._id2text = None
+        if self.version is None:
+            logging.warning("No local id2text for %s; retrieval results won't be cached",
+                            corpus_name)
+
+    def __getattr__(self, name):
+        if name == 'inner':
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    @property
+    def cache(self):
+        # Resolved per call so a MedRAG instance preloaded before fork uses
+        # the child's own SQLite connection.
+        return self._cache or get_retrieval_cache()
+
+    def _snippet(self, doc_id):
+        # Only ever the memory-mapped store; see has_store.
+        if self._id2text is None:
+            self._id2text = open_id2text(self.corpus_name)
+        value = self._id2text[doc_id]
+        snippet = dict(value) if isinstance(value, dict) else {'title': '', 'content': value}
+        snippet.setdefault('id', doc_id)
+        return snippet
+
+    def retrieve(self, question, k=32, rrf_k=100):
+        if self.version is None:
+            return self.inner.retrieve(question, k=k, rrf_k=rrf_k)
+
+        key = RetrievalCache.make_key(self.retriever_name, self.corpus_name, question, k)
+        try:
+            cached = self.cache.get(key, self.version)
+        except sqlite3.Error as e:
+            logging.error("Retrieval cache read failed: %s", e)
+            return self.inner.retrieve(question, k=k, rrf_k=rrf_k)
+        if cached is not None:
+            try:
+                return self._snippets(cached), [row[1] for row in cached]
+            except KeyError:
+                logging.warning("Cached retrieval for %s references missing ids", key[:60])
+
+        snippets, scores = self.inner.retrieve(question, k=k, rrf_k=rrf_k)
+        self._store(key, snippets, scores)
+        return snippets, scores
+
+    def _snippets(self, cached):
+        """Snippets for cached [id, score(, snippet)] rows."""
+        if all(len(row) > 2 for row in cached):
+            return [row[2] for row in cached]
+        if not self.has_store:
+            raise KeyError("cached rows without snippets and no corpus store")
+        return [self._snippet(row[0]) for row in cached]
+
+    def _store(self, key, snippets, scores):
+        try:
+            if self.has_store:
+                rows = [[snippet['id'], float(score)]
+                        for snippet, score in zip(snippets, scores)]
+            else:
+                rows = [[snippet['id'], float(score), snippet]
+                        for snippet, score in zip(snippets, scores)]
+            self.cache.put(key, self.version, rows)
+        except (sqlite3.Error, KeyError, TypeError, ValueError) as e:
+            logging.error("Retrieval cache write failed: %s", e)
+
+    def prefetch(self, questions, k=32):
+        """
+        Fill the cache for several questions at once.
+
+        Uncached questions go to the inner retriever's `retrieve_batch` in a
+        single call when it has one; returns how many were retrieved.
+        """
+        if self.version is None:
+            return 0
+        missing = []
+        for question in questions:
+            key = RetrievalCache.make_key(self.retriever_name, self.corpus_name, question, k)
+            if self.cache.get(key, self.version) is None:
+                missing.append((key, question))
+        if not missing:
+            return 0
+        if hasattr(self.inner, 'retrieve_batch'):
+            results = self.inner.retrieve_batch([question for _, question in missing], k=k)
+        else:
+            results = [self.inner.retrieve(question, k=k) for _, question in missing]
+        for (key, _), (snippets, scores) in zip(missing, results):
+            self._store(key, snippets, scores)
+        return len(missing)
+
+
+_retrieval_cache = None
+_retrieval_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache():
+    """Process-wide RetrievalCache, opened on first use."""
+    global _retrieval_cache
+    with _retrieval_cache_lock:
+        if _retrieval_cache is None:
+            _retrieval_cache = RetrievalCache()
+        return _retrieval_cache
+
+
+def retrieval_cache_stats():
+    """Counters for /metrics; None until the cache has been used."""
+    return _retrieval_cache.snapshot() if _retrieval_cache is not None else None
+
+
+def _reset_after_fork():
+    global _retrieval_cache, _retrieval_cache_lock
+    # SQLite connections must not be shared across fork.
+    _retrieval_cache = None
+    _retrieval_cache_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,244 @@
+# session_store.py
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+from lru import LRUCache
+
+SESSIONS_TABLE = os.getenv('SESSIONS_TABLE', 'diagnosemesessions')
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'local')
+CASE_CACHE_SIZE = int(os.getenv('SESSION_CASE_CACHE_SIZE', '256'))
+# Sessions expire two days after their last turn (DynamoDB TTL attribute).
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', str(60 * 60 * 48)))
+
+
+class LocalSessionBackend:
+    """In-process stand-in for the shared session table (tests, single worker)."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            item = self._items.get(session_id)
+            return json.loads(item) if item else None
+
+    def save(self, session):
+        with self._lock:
+            self._items[session['session_id']] = json.dumps(session)
+
+    def append_turns(self, session_id, entries, completed):
+        with self._lock:
+            item = self._items.get(session_id)
+            if not item:
+                return
+            session = json.loads(item)
+            session['history'].extend(entries)
+            session['completed'] = completed
+            self._items[session_id] = json.dumps(session)
+
+    def truncate(self, session_id, length, expected_length):
+        with self._lock:
+            item = self._items.get(session_id)
+            if not item:
+                return False
+            session = json.loads(item)
+            if len(session['history']) != expected_length:
+                return False
+            del session['history'][length:]
+            self._items[session_id] = json.dumps(session)
+            return True
+
+
+class DynamoSessionBackend:
+    """Sessions stored one item per game in SESSIONS_TABLE (hash key: session_id)."""
+
+    def __init__(self, dynamodb, table_name=SESSIONS_TABLE):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+
+    def load(self, session_id):
+        response = self.dynamodb.get_item(
+            TableName=self.table_name,
+            Key={'session_id': {'S': session_id}},
+            ConsistentRead=True
+        )
+        item = response.get('Item')
+        if not item:
+            return None
+        return {
+            'session_id': session_id,
+            'case_key': item['case_key']['S'],
+            'history': [entry['S'] for entry in item.get('history', {}).get('L', [])],
+            'attempts': int(item.get('attempts', {}).get('N', '2')),
+            'completed': item.get('completed', {}).get('BOOL', False),
+            'custom': item.get('custom', {}).get('BOOL', False),
+        }
+
+    def save(self, session):
+        self.dynamodb.put_item(
+            TableName=self.table_name,
+            Item={
+                'session_id': {'S': session['session_id']},
+                'case_key': {'S': session['case_key']},
+                'history': {'L': [{'S': entry} for entry in session['history']]},
+                'attempts': {'N': str(session.get('attempts', 2))},
+                'completed': {'BOOL': bool(session.get('completed'))},
+                'custom': {'BOOL': bool(session.get('custom'))},
+                'expires_at': {'N': str(int(time.time()) + SESSION_TTL_SECONDS)},
+            }
+        )
+
+    def append_turns(self, session_id, entries, completed):
+        # list_append only ships the new turns, not the whole transcript.
+        self.dynamodb.update_item(
+            TableName=self.table_name,
+            Key={'session_id': {'S': session_id}},
+            UpdateExpression=(
+                "SET history = list_append(if_not_exists(history, :empty), :turns), "
+                "completed = :done, expires_at = :exp"
+            ),
+            ExpressionAttributeValues={
+                ':empty': {'L': []},
+                ':turns': {'L': [{'S': entry} for entry in entries]},
+                ':done': {'BOOL': bool(completed)},
+                ':exp': {'N': str(int(time.time()) + SESSION_TTL_SECONDS)},
+            },
+            ReturnValues='NONE'
+        )
+
+    def truncate(self, session_id, length, expected_length):
+        # Only if no other worker appended a turn since the history was read.
+        try:
+            self.dynamodb.update_item(
+                TableName=self.table_name,
+                Key={'session_id': {'S': session_id}},
+                UpdateExpression="REMOVE " + ", ".join(
+                    f"history[{i}]" for i in range(length, expected_length)),
+                ConditionExpression="size(history) = :n",
+                ExpressionAttributeValues={':n': {'N': str(expected_length)}},
+                ReturnValues='NONE'
+            )
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+
+def make_session_backend(dynamodb=None, backend=SESSION_BACKEND):
+    if backend == 'dynamodb':
+        return DynamoSessionBackend(dynamodb)
+    if backend != 'local':
+        logging.warning(
+            "Unknown SESSION_BACKEND '%s'; using in-process sessions", backend)
+    return LocalSessionBackend()
+
+
+class SessionStore:
+    """
+    Server-side game state for /ask_llm, keyed by case_key plus session id.
+
+    Sessions only hold the per-game state (history, attempts, completion)
+    and are read from the backend on every request, since other workers
+    append to them. Case text and rubric never change, so they are shared
+    per case_key and loaded once through `case_loader`; each message only
+    needs the question and turn index.
+    """
+
+    def __init__(self, backend, case_loader):
+        self.backend = backend
+        self.case_loader = case_loader
+        self.cases = LRUCache(CASE_CACHE_SIZE)
+
+    def create(self, case_key, case, custom=False):
+        """
+        Start a new game session and return its id.
+
+        `case` is the shared case data: disease, case text, rubric and the
+        stored true-answer description.
+        """
+        self.cases.put(case_key, case)
+        session = {
+            'session_id': str(uuid.uuid4()),
+            'case_key': case_key,
+            'history': [],
+            'attempts': 2,
+            'completed': False,
+            'custom': custom,
+        }
+        self.backend.save(session)
+        return session['session_id']
+
+    def restore(self, session_id, patient_context):
+        """Re-seed a session (e.g. after expiry) from a client-held patient context."""
+        session = {
+            'session_id': session_id,
+            'case_key': patient_context['case_key'],
+            'history': list(patient_context.get('history') or []),
+            'attempts': patient_context.get('attempts', 2),
+            'completed': bool(patient_context.get('completed')),
+            'custom': bool(patient_context.get('custom')),
+        }
+        self.backend.save(session)
+
+    def _load_case(self, case_key):
+        case = self.cases.get(case_key)
+        if case is None:
+            case = self.case_loader(case_key)
+            self.cases.put(case_key, case)
+        return case
+
+    def get_context(self, session_id, case_key=None, turn=None):
+        """
+        Build the patient_context dict the route handlers expect.
+
+        Returns None if the session is unknown or belongs to another case.
+        `turn` is the number of exchanges the client has seen; server turns
+        beyond it (e.g. an answer the player never received) are dropped.
+        """
+        session = self.backend.load(session_id)
+        if session is None:
+            return None
+        if case_key and session['case_key'] != case_key:
+            logging.warning("Session %s does not belong to case %s",
+                            session_id, case_key[:60])
+            return None
+
+        if turn is not None and 0 <= int(turn) * 2 < len(session['history']):
+            length = int(turn) * 2
+            if self.backend.truncate(session_id, length, len(session['history'])):
+                session['history'] = session['history'][:length]
+            else:
+                # Another turn landed meanwhile; serve what is stored now.
+                session = self.backend.load(session_id)
+                if session is None:
+                    return None
+
+        case = self._load_case(session['case_key'])
+        return {
+            'session_id': session_id,
+            'case_key': session['case_key'],
+            'disease': case['disease'],
+            'case': case['case'],
+            'rubric': case['rubric'],
+            'answer_description': case.get('answer_description'),
+            'history': list(session['history']),
+            'attempts': session['attempts'],
+            'completed': session['completed'],
+            'custom': session['custom'],
+        }
+
+    def append_turn(self, session_id, question, answer, completed=False):
+        session = self.backend.load(session_id)
+        if session is None:
+            return
+        entries = ['User: ' + question, 'Patient: ' + answer]
+        self.backend.append_turns(session_id, entries,
+                                  session['completed'] or completed)
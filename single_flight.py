@@ -0,0 +1,174 @@
+# single_flight.py
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+CASE_LOCKS_TABLE = os.getenv('CASE_LOCKS_TABLE', 'diagnosemecaselocks')
+# In-process leases only de-duplicate within one worker. Setting
+# CASE_LOCKS_TABLE (or CASE_LEASE_BACKEND=dynamodb) shares them across
+# workers and nodes.
+CASE_LEASE_BACKEND = os.getenv(
+    'CASE_LEASE_BACKEND', 'dynamodb' if os.getenv('CASE_LOCKS_TABLE') else 'local')
+
+
+class SingleFlight:
+    """
+    De-duplicate concurrent calls per key within this process.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight block and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['done'].set()
+
+
+def lease_owner_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LocalLease:
+    """In-process stand-in for the DynamoDB lease table."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases = {}
+
+    def acquire(self, key, owner, ttl_seconds):
+        now = time.time()
+        with self._lock:
+            current = self._leases.get(key)
+            if current and current[0] != owner and current[1] > now:
+                return False
+            self._leases[key] = (owner, now + ttl_seconds)
+            return True
+
+    def release(self, key, owner):
+        with self._lock:
+            current = self._leases.get(key)
+            if current and current[0] == owner:
+                del self._leases[key]
+
+
+class DynamoLease:
+    """Cross-node lease via conditional writes (hash key: lock_key, TTL: expires_at)."""
+
+    def __init__(self, dynamodb, table_name=CASE_LOCKS_TABLE):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+
+    def acquire(self, key, owner, ttl_seconds):
+        now = int(time.time())
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={
+                    'lock_key': {'S': key},
+                    'owner': {'S': owner},
+                    'expires_at': {'N': str(now + ttl_seconds)},
+                },
+                ConditionExpression=(
+                    "attribute_not_exists(lock_key) OR expires_at < :now OR #o = :owner"
+                ),
+                ExpressionAttributeNames={'#o': 'owner'},
+                ExpressionAttributeValues={
+                    ':now': {'N': str(now)},
+                    ':owner': {'S': owner},
+                }
+            )
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def release(self, key, owner):
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.table_name,
+                Key={'lock_key': {'S': key}},
+                ConditionExpression="#o = :owner",
+                ExpressionAttributeNames={'#o': 'owner'},
+                ExpressionAttributeValues={':owner': {'S': owner}},
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                logging.error("Failed to release lease %s: %s", key[:60], e)
+
+
+def make_lease_backend(dynamodb=None, backend=CASE_LEASE_BACKEND):
+    if backend == 'dynamodb':
+        return DynamoLease(dynamodb)
+    if backend != 'local':
+        logging.warning(
+            "Unknown CASE_LEASE_BACKEND '%s'; using in-process leases", backend)
+    return LocalLease()
+
+
+def run_once(key, lease, generate, load_existing, ttl_seconds=300, poll_seconds=2.0):
+    """
+    Run `generate()` on exactly one node for `key`.
+
+    Whoever holds the lease re-checks `load_existing()` and generates if
+    still missing; everyone else polls `load_existing()` until the result
+    appears, retrying the lease on every poll so that a released (failed)
+    or expired lease is taken over at once.
+    Lease backend errors fail open (generate locally).
+    """
+    owner = lease_owner_id()
+    waiting = False
+    while True:
+        try:
+            acquired = lease.acquire(key, owner, ttl_seconds)
+        except Exception as e:
+            logging.error("Lease backend unavailable for %s; generating without it: %s",
+                          key[:60], e)
+            return generate()
+
+        if acquired:
+            try:
+                existing = load_existing()
+                if existing is not None:
+                    return existing
+                return generate()
+            finally:
+                lease.release(key, owner)
+
+        if not waiting:
+            logging.info("Another node is generating %s; waiting for it", key[:60])
+            waiting = True
+        time.sleep(poll_seconds)
+        existing = load_existing()
+        if existing is not None:
+            return existing
@@ -0,0 +1,117 @@
+# speculative.py
+import logging
+import queue
+import threading
+
+
+def estimate_tokens(num_chars):
+    """Rough token estimate (~4 characters per token) for cost metrics."""
+    return (num_chars + 3) // 4
+
+
+class SpeculationStats:
+    """Counters for speculative dispatch, used to tune when speculating pays off."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted_prompt_tokens = 0
+        self.wasted_output_tokens = 0
+
+    def record_start(self):
+        with self._lock:
+            self.started += 1
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self, prompt_tokens, output_tokens):
+        with self._lock:
+            self.misses += 1
+            self.wasted_prompt_tokens += prompt_tokens
+            self.wasted_output_tokens += output_tokens
+
+    def snapshot(self):
+        with self._lock:
+            resolved = self.hits + self.misses
+            return {
+                'started': self.started,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / resolved, 4) if resolved else None,
+                'wasted_prompt_tokens': self.wasted_prompt_tokens,
+                'wasted_output_tokens': self.wasted_output_tokens,
+            }
+
+
+speculation_stats = SpeculationStats()
+
+_DONE = object()
+
+
+class SpeculativeStream:
+    """
+    Start pulling an LLM text stream in the background before we know we want it.
+
+    `open_stream` is a zero-argument callable returning an iterator of text
+    chunks. Chunks are buffered until the caller either commits (and replays
+    the buffer followed by the rest of the stream) or cancels (and the
+    upstream iterator is closed at the next chunk boundary).
+    """
+
+    def __init__(self, open_stream, prompt, log_prefix="Speculative"):
+        self.prompt = prompt
+        self.log_prefix = log_prefix
+        self._open_stream = open_stream
+        self._chunks = queue.Queue()
+        self._cancelled = threading.Event()
+        self._output_chars = 0
+        speculation_stats.record_start()
+        self._thread = threading.Thread(target=self._pump, daemon=True)
+        self._thread.start()
+
+    def _pump(self):
+        upstream = None
+        try:
+            upstream = self._open_stream()
+            for text in upstream:
+                if self._cancelled.is_set():
+                    break
+                self._output_chars += len(text)
+                self._chunks.put(text)
+        except Exception as e:
+            if not self._cancelled.is_set():
+                logging.error("%s - Speculative stream failed: %s",
+                              self.log_prefix, e, exc_info=True)
+                self._chunks.put(e)
+        finally:
+            if upstream is not None and hasattr(upstream, 'close'):
+                upstream.close()
+            self._chunks.put(_DONE)
+
+    def commit(self):
+        """Adopt the speculative stream; yields every chunk, buffered ones first."""
+        speculation_stats.record_hit()
+        try:
+            while True:
+                item = self._chunks.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stops the pump (and closes the upstream) if the reader went away.
+            self._cancelled.set()
+
+    def cancel(self):
+        """Discard the speculative stream and account for the wasted tokens."""
+        self._cancelled.set()
+        speculation_stats.record_miss(
+            estimate_tokens(len(self.prompt)),
+            estimate_tokens(self._output_chars))
+        logging.info("%s - Speculative stream cancelled after %d chars",
+                     self.log_prefix, self._output_chars)
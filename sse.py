@@ -0,0 +1,195 @@
+# sse.py
+"""
+Server-sent event framing for streamed answers.
+
+Model text goes out as `data:` events. The sentinels the prompts ask the
+model for become typed events, even when one is split across Gemini
+chunks:
+
+    event: game-complete    %%%  (correct diagnosis)
+    event: gave-up          ~~~
+    event: lab-report       $$$
+    event: done             the stream finished normally
+
+Small chunks are coalesced for up to SSE_COALESCE_MS before being
+written. Under the ASGI server, ": keep-alive" comments are sent while
+the model is silent.
+"""
+import asyncio
+import os
+import re
+import time
+
+from stream_guard import ChunkStream, aclose_quietly, aiter_chunks, close_quietly
+
+SSE_COALESCE_SECONDS = float(os.getenv('SSE_COALESCE_MS', '30')) / 1000
+SSE_COALESCE_MAX_CHARS = int(os.getenv('SSE_COALESCE_MAX_CHARS', '1024'))
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+
+MARKER_EVENTS = {
+    '%%%': 'game-complete',
+    '~~~': 'gave-up',
+    '$$$': 'lab-report',
+}
+
+HEARTBEAT = ": keep-alive\n\n"
+# Ask nginx and other proxies not to buffer or cache the stream.
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+_END = object()
+
+
+def format_event(data='', event=None):
+    """One SSE event; multi-line data is sent as one `data:` line per line."""
+    lines = [f"event: {event}"] if event else []
+    data = data.replace('\r\n', '\n').replace('\r', '\n')
+    lines.extend(f"data: {line}" for line in data.split('\n'))
+    return '\n'.join(lines) + '\n\n'
+
+
+class MarkerScanner:
+    """Split streamed text into text and marker events across chunk boundaries."""
+
+    def __init__(self, markers=MARKER_EVENTS):
+        self.markers = markers
+        self.pattern = re.compile('|'.join(re.escape(m) for m in markers))
+        self.longest = max(len(m) for m in markers)
+        self.pending = ''
+
+    def _partial_len(self, text):
+        """Length of the longest tail of `text` that could start a marker."""
+        for n in range(min(self.longest - 1, len(text)), 0, -1):
+            tail = text[-n:]
+            if any(marker.startswith(tail) for marker in self.markers):
+                return n
+        return 0
+
+    def feed(self, text):
+        """[(event, text)] for the next chunk; `event` is None for plain text."""
+        text = self.pending + text
+        out = []
+        pos = 0
+        for match in self.pattern.finditer(text):
+            if match.start() > pos:
+                out.append((None, text[pos:match.start()]))
+            out.append((self.markers[match.group()], ''))
+            pos = match.end()
+        rest = text[pos:]
+        held = self._partial_len(rest)
+        self.pending = rest[len(rest) - held:] if held else ''
+        if len(rest) > held:
+            out.append((None, rest[:len(rest) - held]))
+        return out
+
+    def flush(self):
+        rest, self.pending = self.pending, ''
+        return [(None, rest)] if rest else []
+
+
+class SSEStream(ChunkStream):
+    """
+    Frame a stream of model text as server-sent events.
+
+    When iterated synchronously (WSGI), text is written at once unless the
+    last write was less than `coalesce_seconds` ago. In that case it is held
+    until the next chunk arrives or the stream ends. When iterated
+    asynchronously (ASGI), text is held for at most `coalesce_seconds`, and
+    heartbeats are sent after `heartbeat_seconds` of silence.
+    """
+
+    def __init__(self, source, coalesce_seconds=SSE_COALESCE_SECONDS,
+                 max_chars=SSE_COALESCE_MAX_CHARS, heartbeat_seconds=SSE_HEARTBEAT_SECONDS):
+        super().__init__(source)
+        self.coalesce_seconds = coalesce_seconds
+        self.max_chars = max_chars
+        self.heartbeat_seconds = heartbeat_seconds
+        self.scanner = MarkerScanner()
+        self._buffer = []
+        self._buffered_chars = 0
+        self._buffered_at = None
+
+    def _take(self, items):
+        """Buffer text from `items`, returning the frames due now (events flush first)."""
+        frames = []
+        for event, text in items:
+            if event is None:
+                if not self._buffer:
+                    self._buffered_at = time.monotonic()
+                self._buffer.append(text)
+                self._buffered_chars += len(text)
+            else:
+                frames.extend(self._flush())
+                frames.append(format_event(event=event))
+        if self._buffered_chars >= self.max_chars:
+            frames.extend(self._flush())
+        return frames
+
+    def _flush(self):
+        if not self._buffer:
+            return []
+        text = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered_chars = 0
+        self._buffered_at = None
+        return [format_event(text)]
+
+    def _ending(self):
+        return self._take(self.scanner.flush()) + self._flush() + [format_event(event='done')]
+
+    def _iterate(self):
+        completed = False
+        last_write = float('-inf')
+        try:
+            for text in self.source:
+                frames = self._take(self.scanner.feed(text))
+                now = time.monotonic()
+                if now - last_write >= self.coalesce_seconds:
+                    frames.extend(self._flush())
+                if frames:
+                    last_write = now
+                    yield ''.join(frames)
+            yield ''.join(self._ending())
+            completed = True
+        finally:
+            close_quietly(self.source)
+            self._finish(completed)
+
+    async def _aiterate(self):
+        completed = False
+        source = aiter_chunks(self.source)
+        pending = None
+        last_write = time.monotonic()
+
+        async def next_chunk():
+            return await anext(source, _END)
+
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(next_chunk())
+                if self._buffer:
+                    timeout = self._buffered_at + self.coalesce_seconds - time.monotonic()
+                else:
+                    timeout = last_write + self.heartbeat_seconds - time.monotonic()
+                done, _ = await asyncio.wait({pending}, timeout=max(0, timeout))
+                if not done:
+                    last_write = time.monotonic()
+                    yield ''.join(self._flush()) if self._buffer else HEARTBEAT
+                    continue
+                text = pending.result()
+                pending = None
+                if text is _END:
+                    break
+                frames = self._take(self.scanner.feed(text))
+                if frames:
+                    last_write = time.monotonic()
+                    yield ''.join(frames)
+            yield ''.join(self._ending())
+            completed = True
+        finally:
+            if pending is not None:
+                pending.cancel()
+                await asyncio.gather(pending, return_exceptions=True)
+            await aclose_quietly(source)
+            close_quietly(self.source)
+            await self._afinish(completed)
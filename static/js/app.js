@@ -342,7 +342,8 @@ document.addEventListener('DOMContentLoaded', function () {
               case: data.patient_context.case,
               placeholder_snippet: data.patient_context.placeholder_snippet,
               rubric: data.patient_context.rubric,
-              case_key: data.patient_context.case_key
+              case_key: data.patient_context.case_key,
+              session_id: data.patient_context.session_id
           };
 
           localStorage.setItem('patientContext', JSON.stringify(window.patientContext));
@@ -784,6 +785,7 @@ const playerRoleSelect = document.getElementById('player-role-select');
       case: preloadedGameData.patient_context.case,
       rubric: preloadedGameData.patient_context.rubric,
       case_key: preloadedGameData.patient_context.case_key,
+      session_id: preloadedGameData.patient_context.session_id,
     };
 
     // Reset timer display but don't start it
@@ -1007,7 +1009,10 @@ const playerRoleSelect = document.getElementById('player-role-select');
           games_completed: userStats.gamesCompleted || 0,
           last_played: userStats.lastPlayed || todayHonolulu,
           elapsed_time: typeof elapsedTime === 'number' ? elapsedTime : 0,
-          conversation: buildConversationString()
+          conversation: buildConversationString(),
+          // One stored item per game; the last snapshot of a game is flushed at once.
+          session_id: (window.patientContext && window.patientContext.session_id) ? window.patientContext.session_id : undefined,
+          final: !!(window.patientContext && window.patientContext.completed)
         })
       });
     } catch (e) {
@@ -1054,17 +1059,31 @@ const playerRoleSelect = document.getElementById('player-role-select');
           loadingIndicator.style.display = 'inline-flex'; // Show typing indicator
           // console.log('Message loading indicator displayed.');
 
-          // Call the LLM with context
-          fetch('/ask_llm', {
-              method: 'POST',
-              headers: {
-                  'Content-Type': 'application/json',
-              },
-              body: JSON.stringify({
+          // Call the LLM. With a server-side session only the new question and
+          // turn index are sent; the full context is only sent to re-seed a
+          // session the server no longer knows about.
+          const askLLM = (includeContext) => {
+              const ctx = window.patientContext;
+              const payload = ctx.session_id ? {
                   question: message,
-                  patient_context: window.patientContext // Include patient context
-              }),
-          })
+                  session_id: ctx.session_id,
+                  case_key: ctx.case_key,
+                  turn: Math.floor((ctx.history || []).length / 2)
+              } : { question: message };
+              if (includeContext || !ctx.session_id) {
+                  payload.patient_context = ctx;
+              }
+              return fetch('/ask_llm', {
+                  method: 'POST',
+                  headers: {
+                      'Content-Type': 'application/json',
+                  },
+                  body: JSON.stringify(payload),
+              });
+          };
+
+          askLLM(false)
+          .then(response => response.status === 409 ? askLLM(true) : response)
           .then(response => {
               // console.log(window.patientContext);
               if (!response.ok) {
@@ -1086,6 +1105,41 @@ const playerRoleSelect = document.getElementById('player-role-select');
               chatBox.appendChild(patientMessage);
               fixInputToBottom();
               
+              // Apply one server-sent event (see sse.py) to the patient message.
+              function handleStreamEvent(rawEvent) {
+                let eventType = 'message';
+                const dataLines = [];
+                rawEvent.split('\n').forEach(line => {
+                  if (line.startsWith('event:')) {
+                    eventType = line.substring(6).trim();
+                  } else if (line.startsWith('data:')) {
+                    dataLines.push(line.substring(line.startsWith('data: ') ? 6 : 5));
+                  }
+                  // Lines starting with ':' are heartbeat comments.
+                });
+                if (eventType === 'message') {
+                  if (!dataLines.length) {
+                    return;
+                  }
+                  if (patientMessage.innerHTML.startsWith('\n')) {
+                    patientMessage.innerHTML = patientMessage.innerHTML.substring(1);
+                  }
+                  patientMessage.innerHTML += dataLines.join('\n');
+                  fixInputToBottom();
+                } else if ((eventType === 'game-complete' || eventType === 'gave-up')
+                           && !window.patientContext.completed) {
+                  patientMessage.style.maxWidth = '100%';
+                  handleEnd(eventType === 'game-complete');
+                  window.patientContext.completed = true;
+                  // Disable inputs when game ends
+                  userInput.disabled = true;
+                  sendButton.disabled = true;
+                  sendButton.classList.add('disabled');
+                } else if (eventType === 'lab-report') {
+                  patientMessage.style.maxWidth = '100%';
+                }
+              }
+
               function read() {
                 reader.read().then(({ done, value }) => {
                   if (done) {
@@ -1109,53 +1163,13 @@ const playerRoleSelect = document.getElementById('player-role-select');
                     saveConversationSnapshot(); // Fire-and-forget snapshot save
                     return;
                   }
-                  let newText = decoder.decode(value, { stream: true });
-                  console.log('Received chunk:', newText);
-                  if (newText.includes('%%%') && !window.patientContext.completed) {
-                    // console.log('Correct answer found');
-                    patientMessage.style.maxWidth = '100%';
-                    handleEnd(true);
-                    window.patientContext.completed = true;
-                    newText = newText.replace('%%%', '');
-                    // Disable inputs when game ends
-                    userInput.disabled = true;
-                    sendButton.disabled = true;
-                    sendButton.classList.add('disabled');
-                  }
-                  if (newText.includes('~~~') && !window.patientContext.completed) {
-                    patientMessage.style.maxWidth = '100%';
-                    handleEnd(false);
-                    window.patientContext.completed = true;
-                    newText = newText.replace('~~~', '');
-                    // Disable inputs when game ends
-                    userInput.disabled = true;
-                    sendButton.disabled = true;
-                    sendButton.classList.add('disabled');
-                  }
-                  buffer += newText;
-                  // Split the buffer by triple newlines which delimit SSE messages.
-                  const parts = buffer.split('\n\n\n');
-                  // Retain any partial message.
-                  buffer = parts.pop();
-                  parts.forEach(part => {
-                    // if (part.startsWith("data: ")) {
-                    //   const text = part.substring(6);
-                    //   patientMessage.innerHTML += text;
-                    // } else if (part.startsWith("event: complete")) {
-                    //   // Optionally mark stream completion.
-                    // }
-                    if (patientMessage.innerHTML.startsWith('\n')) {
-                      patientMessage.innerHTML = patientMessage.innerHTML.substring(1);
-                    }
-                    patientMessage.innerHTML += part;
-                    fixInputToBottom();
-                  });
+                  buffer += decoder.decode(value, { stream: true });
+                  // Server-sent events are separated by a blank line.
+                  const events = buffer.split('\n\n');
+                  // Retain any partial event.
+                  buffer = events.pop();
+                  events.forEach(handleStreamEvent);
                   patientMessage.innerHTML = patientMessage.innerHTML.replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>');
-                  if (patientMessage.innerHTML.includes('$$$')) {
-                    // console.log('Ordered test');
-                    patientMessage.style.maxWidth = '100%';
-                    patientMessage.innerHTML = patientMessage.innerHTML.replace('$$$', '');
-                  }
                   read();
                 }).catch(err => {
                   // console.error("Error reading stream:", err);
@@ -1188,6 +1202,7 @@ const playerRoleSelect = document.getElementById('player-role-select');
                   case: window.patientContext.case,
                   rubric: window.patientContext.rubric,
                   case_key: window.patientContext.case_key,
+                  session_id: window.patientContext.session_id,
               };
 
               window.patientContext = patientContext; // Update patient context
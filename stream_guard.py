@@ -0,0 +1,248 @@
+# stream_guard.py
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from speculative import estimate_tokens
+
+STREAM_MAX_SECONDS = float(os.getenv('STREAM_MAX_SECONDS', '90'))
+
+# Output token caps per /ask_llm route (see ROUTES) and for postgame chat.
+STREAM_TOKEN_CAPS = {
+    'A': 400,    # patient answer
+    'B': 1200,   # lab report
+    'C': 800,    # physical exam
+    'D': 1000,   # diagnosis feedback
+    'E': 1000,   # give up explanation
+    'F': 300,    # disallowed action
+    'G': 300,    # too broad exam
+    'postgame': 1500,
+}
+DEFAULT_TOKEN_CAP = int(os.getenv('STREAM_DEFAULT_TOKEN_CAP', '1500'))
+
+
+def close_quietly(iterator):
+    """Close a generator/stream if it supports it, logging instead of raising."""
+    close = getattr(iterator, 'close', None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        logging.warning("Error closing stream: %s", e)
+
+
+async def aclose_quietly(iterator):
+    aclose = getattr(iterator, 'aclose', None)
+    if aclose is None:
+        return
+    try:
+        await aclose()
+    except Exception as e:
+        logging.warning("Error closing stream: %s", e)
+
+
+_END = object()
+
+
+async def _iterate_in_thread(source):
+    """Async view of a blocking iterator; each next() runs on a worker thread."""
+    iterator = iter(source)
+    try:
+        while True:
+            item = await asyncio.to_thread(next, iterator, _END)
+            if item is _END:
+                return
+            yield item
+    finally:
+        await asyncio.to_thread(close_quietly, iterator)
+
+
+def aiter_chunks(source):
+    """Async iterator over `source`, native when it has one."""
+    if hasattr(source, '__aiter__'):
+        return source.__aiter__()
+    if isinstance(source, (list, tuple)):
+        async def replay():
+            for item in source:
+                yield item
+        return replay()
+    return _iterate_in_thread(source)
+
+
+class ChunkStream:
+    """
+    One stage of a streamed answer that works under WSGI and ASGI servers.
+
+    Plain iteration pulls from `source` synchronously. `async for` pulls
+    from the source's async iterator when it has one (the async Gemini
+    stream) and from a worker thread otherwise. `transform` maps each
+    chunk to the chunks to emit, `should_stop()` ends the stream early,
+    `trailer` is emitted after the last chunk, and `on_close(completed)`
+    runs exactly once, after the source has been closed, whether the
+    stream finished, was stopped or lost its reader.
+    """
+
+    def __init__(self, source, transform=None, should_stop=None, trailer=(),
+                 on_start=None, on_close=None):
+        self.source = source
+        self.transform = transform
+        self.should_stop = should_stop
+        self.trailer = tuple(trailer)
+        self.on_start = on_start
+        self.on_close = on_close
+        self._active = None
+        self._closed = False
+
+    def _emit(self, text):
+        return self.transform(text) if self.transform else (text,)
+
+    def _finish(self, completed):
+        if self._closed:
+            return
+        self._closed = True
+        if self.on_close:
+            self.on_close(completed)
+
+    async def _afinish(self, completed):
+        if self.on_close and not self._closed:
+            # on_close may write to DynamoDB; keep it off the event loop.
+            await asyncio.to_thread(self._finish, completed)
+        self._finish(completed)
+
+    def _iterate(self):
+        completed = False
+        if self.on_start:
+            self.on_start()
+        try:
+            for text in self.source:
+                yield from self._emit(text)
+                if self.should_stop and self.should_stop():
+                    break
+            yield from self.trailer
+            completed = True
+        finally:
+            close_quietly(self.source)
+            self._finish(completed)
+
+    async def _aiterate(self):
+        completed = False
+        if self.on_start:
+            self.on_start()
+        source = aiter_chunks(self.source)
+        try:
+            async for text in source:
+                for out in self._emit(text):
+                    yield out
+                if self.should_stop and self.should_stop():
+                    break
+            for out in self.trailer:
+                yield out
+            completed = True
+        finally:
+            await aclose_quietly(source)
+            close_quietly(self.source)
+            await self._afinish(completed)
+
+    def __iter__(self):
+        self._active = self._iterate()
+        return self._active
+
+    def __aiter__(self):
+        self._active = self._aiterate()
+        return self._active
+
+    async def aopen(self):
+        """Open the underlying LLM stream ahead of the response headers."""
+        if hasattr(self.source, 'aopen'):
+            await self.source.aopen()
+
+    def close(self):
+        if self._active is not None and hasattr(self._active, 'close'):
+            close_quietly(self._active)
+        if not self._closed:
+            # Never (fully) iterated: still release the upstream.
+            close_quietly(self.source)
+            self._finish(False)
+
+
+class StreamStats:
+    """Counters for streamed answers: completions, disconnects and caps."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.completed = 0
+        self.aborted = 0
+        self.capped_duration = 0
+        self.capped_tokens = 0
+        self.tokens_streamed = 0
+        self.tokens_saved = 0
+
+    def record(self, outcome, tokens_streamed, tokens_saved=0):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.tokens_streamed += tokens_streamed
+            self.tokens_saved += tokens_saved
+
+    def record_start(self):
+        with self._lock:
+            self.started += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'started': self.started,
+                'completed': self.completed,
+                'aborted': self.aborted,
+                'capped_duration': self.capped_duration,
+                'capped_tokens': self.capped_tokens,
+                'tokens_streamed': self.tokens_streamed,
+                # Upper bound: the route's cap minus what had been streamed.
+                'tokens_saved_estimate': self.tokens_saved,
+            }
+
+
+stream_stats = StreamStats()
+
+
+def guarded_stream(chunks, route=None, max_seconds=STREAM_MAX_SECONDS, log_prefix=""):
+    """
+    Pass `chunks` through, closing the upstream as soon as it should stop.
+
+    Stops early when the route's output token cap or `max_seconds` is hit.
+    If the client disconnects, the server closes the response iterator and
+    the upstream Gemini stream is closed with it instead of running on.
+    """
+    token_cap = STREAM_TOKEN_CAPS.get(route, DEFAULT_TOKEN_CAP)
+    state = {'started': time.monotonic(), 'chars': 0, 'outcome': None}
+
+    def start():
+        state['started'] = time.monotonic()
+        stream_stats.record_start()
+
+    def count(text):
+        state['chars'] += len(text)
+        return (text,)
+
+    def should_stop():
+        if estimate_tokens(state['chars']) >= token_cap:
+            state['outcome'] = 'capped_tokens'
+        elif time.monotonic() - state['started'] > max_seconds:
+            state['outcome'] = 'capped_duration'
+        return state['outcome'] is not None
+
+    def closed(completed):
+        outcome = state['outcome'] or ('completed' if completed else 'aborted')
+        tokens = estimate_tokens(state['chars'])
+        saved = max(0, token_cap - tokens) if outcome == 'aborted' else 0
+        stream_stats.record(outcome, tokens, saved)
+        if outcome != 'completed':
+            logging.info("%s - Stream %s after %d tokens, %.1fs (route %s)",
+                         log_prefix, outcome, tokens,
+                         time.monotonic() - state['started'], route)
+
+    return ChunkStream(chunks, transform=count, should_stop=should_stop,
+                       on_start=start, on_close=closed)
@@ -0,0 +1,43 @@
+import random
+
+import pytest
+
+import conversation_writer
+from conversation_writer import ConversationLog, LocalConversationBackend
+
+
+def snapshot(session_id, text):
+    return {'session_id': {'S': session_id}, 'conversation': {'S': text}}
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    # Several segments per write, so a stale seq overwrites something.
+    monkeypatch.setattr(conversation_writer, 'SEGMENT_MAX_CHARS', 3)
+
+
+def test_stale_writer_rereads_state():
+    backend = LocalConversationBackend()
+    first, second = ConversationLog(backend), ConversationLog(backend)
+
+    first.write_batch([snapshot('s', 'User: hi\n')])
+    second.write_batch([snapshot('s', 'User: hi\nPatient: hello\n')])
+    # `first` still caches the one-line state.
+    first.write_batch([snapshot('s', 'User: hi\nPatient: hello\nUser: pain?\n')])
+
+    assert first.read('s') == 'User: hi\nPatient: hello\nUser: pain?\n'
+    assert first.snapshot()['conflicts'] == 1
+
+
+def test_two_writers_one_session_randomized():
+    rng = random.Random(0)
+    for run in range(500):
+        backend = LocalConversationBackend()
+        writers = [ConversationLog(backend), ConversationLog(backend)]
+        text = ''
+        for _ in range(rng.randint(1, 12)):
+            if text and rng.random() < 0.2:
+                text = text[:rng.randint(0, len(text))]
+            text += ''.join(rng.choice('ab\n') for _ in range(rng.randint(0, 8)))
+            rng.choice(writers).write_batch([snapshot('s', text)])
+            assert writers[0].read('s') == text, run